@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -86,6 +87,19 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so that booking
+            # validation and the insert that follows it cannot interleave
+            # with another writer (SQLite has no SELECT ... FOR UPDATE).
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Tests use a file in the temporary directory rather than SQLite's
+        # in-memory database, whose threads do not wait for each other's
+        # locks, so that ConcurrentBookingTests runs with real locking.
+        'TEST': {
+            'NAME': Path(tempfile.gettempdir()) / 'propertymentor_test.sqlite3',
+        },
     }
 }
 
@@ -132,3 +146,16 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+
+REST_FRAMEWORK = {
+    # DRF's defaults, plus the `Authorization: Token ...` header the API
+    # documents, resolved through an in-process cache (see api/authentication.py).
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+    ],
+}
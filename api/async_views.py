@@ -0,0 +1,137 @@
+import asyncio
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.http import Http404
+from rest_framework.decorators import permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from properties.cache import AVAILABILITY_VERSION, PROPERTIES_VERSION, get_property_bundle
+from bookings.batch import aquote_properties, aquote_stays, run_query
+from bookings.models import Booking, get_neighbourhood
+from bookings.occupancy import get_occupancy
+from .serializers import PropertySerializer
+from .views import (
+    BadRequest, CachedPage, PropertySearch, add_batch_quotes, check_booking_rules, paginate_rows,
+    parse_availability_params, parse_batch, parse_pricing_params, price_stay
+)
+
+
+class AsyncAPIView(APIView):
+    """
+    An APIView whose handlers are coroutines, for ASGI. DRF's own request
+    handling (authentication, permissions, throttling, content negotiation
+    and exceptions) is unchanged; the parts that can query run in a thread.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+def async_api_view(http_method_names):
+    """`rest_framework.decorators.api_view` for coroutine functions; DRF's policy decorators apply as usual."""
+    def decorator(func):
+        async def handler(self, *args, **kwargs):
+            return await func(*args, **kwargs)
+
+        attrs = {method.lower(): handler for method in http_method_names}
+        attrs['http_method_names'] = [method.lower() for method in set(http_method_names) | {'options'}]
+        for policy in ('renderer_classes', 'parser_classes', 'authentication_classes', 'throttle_classes', 'permission_classes'):
+            attrs[policy] = getattr(func, policy, getattr(APIView, policy))
+        view = type(func.__name__, (AsyncAPIView,), {**attrs, '__doc__': func.__doc__, '__module__': func.__module__})
+        return view.as_view()
+    return decorator
+
+
+# Each view gives the same responses as its sync namesake in `views.py`, but
+# waits for the database without holding a thread, and runs the queries
+# that do not depend on each other at the same time.
+
+@async_api_view(['GET'])
+@permission_classes([IsAuthenticated])
+async def check_availability(request, pk):
+    property = await run_query(get_property_bundle, pk)
+    if property is None:
+        raise Http404
+    check_in_date, check_out_date = parse_availability_params(request)
+    # Short stays look up their neighbours for the gap stay check.
+    return Response(await run_query(check_booking_rules, property, check_in_date, check_out_date))
+
+
+@async_api_view(['GET'])
+@permission_classes([IsAuthenticated])
+async def property_pricing(request, pk):
+    try:
+        check_in_date, check_out_date, num_guests = parse_pricing_params(request)
+    except BadRequest:
+        # A missing property is reported first, as in the sync view.
+        if await run_query(get_property_bundle, pk) is None:
+            raise Http404
+        raise
+
+    def load_occupancy():
+        if check_out_date > check_in_date:
+            return get_occupancy(pk, check_in_date - timedelta(days=1), check_out_date + timedelta(days=1))
+    property, occupancy = await asyncio.gather(run_query(get_property_bundle, pk), run_query(load_occupancy))
+    if property is None:
+        raise Http404
+
+    booking = Booking(property=property, check_in_date=check_in_date, check_out_date=check_out_date, num_guests=num_guests)
+    stays = None
+    if occupancy is None and check_out_date > check_in_date:
+        stays = await run_query(get_neighbourhood, property, check_in_date, check_out_date)
+    # The quote may come from the shared cache.
+    return await run_query(price_stay, booking, stays=stays, occupancy=occupancy)
+
+
+@async_api_view(['GET'])
+@permission_classes([IsAuthenticated])
+async def search_properties(request):
+    versions = [PROPERTIES_VERSION]
+    if request.query_params.get('check_in') or request.query_params.get('check_out'):
+        versions.append(AVAILABILITY_VERSION)
+    page = await run_query(CachedPage, request, versions)
+    response = await run_query(page.get)
+    if response is None:
+        response = await run_query(page.set, await find_properties(request))
+    return response
+
+
+async def find_properties(request):
+    search = PropertySearch(request)
+    if search.stay is None:
+        return await run_query(paginate_rows, request, search.queryset, search.paginator, PropertySerializer, search.fields)
+
+    if search.prices_page_only:
+        result_page = await run_query(search.paginator.paginate_queryset, search.queryset, request)
+        quotes = await aquote_properties(result_page, *search.stay)
+    else:
+        quotes = search.paginate_quotes(await aquote_properties(search.get_candidates(), *search.stay))
+        result_page = await run_query(search.get_page_properties, quotes)
+    return search.get_response(result_page, quotes)
+
+
+@async_api_view(['POST'])
+@permission_classes([IsAuthenticated])
+async def pricing_batch(request):
+    results, stays = parse_batch(request)
+    return Response(add_batch_quotes(results, await aquote_stays(stays)))
@@ -0,0 +1,43 @@
+import copy
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from properties.cache import LRUCache, bump_global_version, get_global_versions
+
+TOKEN_CACHE_SIZE = getattr(settings, 'API_TOKEN_CACHE_SIZE', 10000)
+TOKEN_CACHE_TIMEOUT = getattr(settings, 'API_TOKEN_CACHE_TIMEOUT', 5 * 60)
+# Global version of every token and user, bumped when any of them changes.
+TOKENS_VERSION = 'tokens'
+
+token_cache = LRUCache(TOKEN_CACHE_SIZE, timeout=TOKEN_CACHE_TIMEOUT)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    `TokenAuthentication` that remembers each valid token and its user for
+    `API_TOKEN_CACHE_TIMEOUT` seconds, so a request with a known token makes
+    no query. Entries are keyed by the tokens' global version: deleting a
+    token or saving a user bumps it, which retires every entry in the
+    processes that share the cache, and in the others once their entries
+    expire.
+    """
+
+    def authenticate_credentials(self, key):
+        version, changed_at = get_global_versions([TOKENS_VERSION])[TOKENS_VERSION]
+        token = token_cache.get((version, key))
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set((version, key), token)
+        if not token.user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        # Each request gets its own user, as views may change it.
+        return copy.copy(token.user), token
+
+
+def forget_tokens():
+    bump_global_version(TOKENS_VERSION)
+
+
+def get_token_cache_stats():
+    return token_cache.get_stats()
@@ -0,0 +1,62 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from bookings.models import Booking
+from properties.models import Property
+from api.serializers import BookingSerializer, PropertySerializer, RowSerializer
+
+SERIALIZERS = {
+    'properties': (Property, PropertySerializer),
+    'bookings': (Booking, BookingSerializer),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the rows per second of the list endpoints' row serializers with the model serializers, "
+        "on rows from the database, and check that both render the same JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100, help="Rows per list, like page_size (default 100)")
+        parser.add_argument('--repeat', type=int, default=200, help="Lists serialized per measurement (default 200)")
+
+    def measure(self, serialize, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            data = serialize()
+        return time.perf_counter() - start, data
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['repeat'] < 1:
+            raise CommandError("--rows and --repeat must be at least 1.")
+        rows, repeat = options['rows'], options['repeat']
+
+        for name, (model, serializer_class) in SERIALIZERS.items():
+            row_serializer = RowSerializer(serializer_class)
+            queryset = model.objects.order_by('pk')[:rows]
+            if not queryset.exists():
+                self.stdout.write(f"{name}: no rows to serialize")
+                continue
+
+            # Serializing alone, then fetching and serializing, as the endpoints do.
+            instances = list(queryset)
+            values = list(queryset.values(*row_serializer.sources))
+            model_time, model_data = self.measure(lambda: serializer_class(instances, many=True).data, repeat)
+            row_time, row_data = self.measure(lambda: row_serializer.serialize(values), repeat)
+            model_fetch_time, _ = self.measure(lambda: serializer_class(list(queryset), many=True).data, repeat)
+            row_fetch_time, _ = self.measure(lambda: row_serializer.serialize(queryset.values(*row_serializer.sources)), repeat)
+
+            if JSONRenderer().render(model_data) != JSONRenderer().render(row_data):
+                raise CommandError(f"{name}: the row serializer's JSON differs from {serializer_class.__name__}'s.")
+
+            count = len(instances) * repeat
+            self.stdout.write(f"{name} ({len(instances)} rows x {repeat}), identical JSON")
+            self.stdout.write(
+                f"  serialize only:    {serializer_class.__name__} {count / model_time:,.0f} rows/s, "
+                f"RowSerializer {count / row_time:,.0f} rows/s ({model_time / row_time:.1f}x)"
+            )
+            self.stdout.write(
+                f"  fetch + serialize: {serializer_class.__name__} {count / model_fetch_time:,.0f} rows/s, "
+                f"RowSerializer {count / row_fetch_time:,.0f} rows/s ({model_fetch_time / row_fetch_time:.1f}x)"
+            )
@@ -0,0 +1,202 @@
+import asyncio
+import io
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from urllib.parse import urlencode
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db.backends.signals import connection_created
+from django.utils.crypto import get_random_string
+from properties.models import Property
+
+SCENARIOS = ['pricing', 'availability', 'search', 'batch']
+
+
+class Command(BaseCommand):
+    help = (
+        "Load the sync (WSGI) and async (ASGI) pricing, availability, search and batch "
+        "endpoints with the same concurrent requests, and compare their throughput and latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help="User the requests are authenticated as")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per scenario (default 200)")
+        parser.add_argument('--concurrency', type=int, default=20, help="Requests in flight at once (default 20)")
+        parser.add_argument(
+            '--latency', type=float, default=0,
+            help="Milliseconds added to every query, to stand in for a database across the network (default 0)"
+        )
+        parser.add_argument('--scenario', choices=SCENARIOS, action='append', help="Run only this scenario; repeatable")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1 or options['latency'] < 0:
+            raise CommandError("--requests and --concurrency must be at least 1, and --latency cannot be negative.")
+        try:
+            user = get_user_model().objects.get(username=options['username'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user named {options['username']!r}.")
+        property_ids = list(Property.objects.order_by('pk').values_list('pk', flat=True)[:50])
+        if not property_ids:
+            raise CommandError("There are no properties to request.")
+
+        if options['latency']:
+            delay = options['latency'] / 1000
+
+            def add_latency(sender, connection, **kwargs):
+                def execute(execute, sql, params, many, context):
+                    time.sleep(delay)
+                    return execute(sql, params, many, context)
+                connection.execute_wrappers.append(execute)
+            connection_created.connect(add_latency, weak=False)
+
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        csrf_token = get_random_string(32)
+        self.headers = {
+            'Cookie': f'{settings.SESSION_COOKIE_NAME}={session.session_key}; {settings.CSRF_COOKIE_NAME}={csrf_token}',
+            'X-CSRFToken': csrf_token,
+            'Accept': 'application/json',
+        }
+
+        wsgi_application = get_wsgi_application()
+        asgi_application = get_asgi_application()
+        try:
+            for scenario in options['scenario'] or SCENARIOS:
+                # Every request is for different dates, so no response or quote comes from the cache.
+                sync_requests = self.get_requests(scenario, '/api/', property_ids, options['requests'], offset=0)
+                async_requests = self.get_requests(scenario, '/api/async/', property_ids, options['requests'], offset=options['requests'])
+                sync_result = self.run_wsgi(wsgi_application, sync_requests, options['concurrency'])
+                async_result = self.run_asgi(asgi_application, async_requests, options['concurrency'])
+                self.report(scenario, sync_result, async_result)
+        finally:
+            session.delete()
+
+    def get_requests(self, scenario, prefix, property_ids, count, offset):
+        requests = []
+        for i in range(offset, offset + count):
+            property_id = property_ids[i % len(property_ids)]
+            check_in = date.today() + timedelta(days=30 + i)
+            stay = {'check_in': check_in.isoformat(), 'check_out': (check_in + timedelta(days=3)).isoformat()}
+            if scenario == 'pricing':
+                requests.append(('GET', f'{prefix}properties/{property_id}/pricing/', urlencode({**stay, 'guests': 2}), b''))
+            elif scenario == 'availability':
+                requests.append(('GET', f'{prefix}properties/{property_id}/check-availability/', urlencode(stay), b''))
+            elif scenario == 'search':
+                requests.append(('GET', f'{prefix}properties/search/', urlencode({**stay, 'ordering': 'price'}), b''))
+            else:
+                body = json.dumps([{'property': pk, **stay, 'guests': 2} for pk in property_ids[:20]]).encode()
+                requests.append(('POST', f'{prefix}pricing/batch/', '', body))
+        return requests
+
+    def run_wsgi(self, application, requests, concurrency):
+        def send(request):
+            method, path, query_string, body = request
+            environ = {
+                'REQUEST_METHOD': method,
+                'PATH_INFO': path,
+                'QUERY_STRING': query_string,
+                'SCRIPT_NAME': '',
+                'SERVER_NAME': 'localhost',
+                'SERVER_PORT': '80',
+                'SERVER_PROTOCOL': 'HTTP/1.1',
+                'REMOTE_ADDR': '127.0.0.1',
+                'CONTENT_TYPE': 'application/json',
+                'CONTENT_LENGTH': str(len(body)),
+                'wsgi.input': io.BytesIO(body),
+                'wsgi.errors': io.StringIO(),
+                'wsgi.url_scheme': 'http',
+                'wsgi.version': (1, 0),
+                'wsgi.multithread': True,
+                'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+                'HTTP_HOST': 'localhost',
+                **{'HTTP_' + name.upper().replace('-', '_'): value for name, value in self.headers.items()},
+            }
+            status = []
+            start = time.perf_counter()
+            content = b''.join(application(environ, lambda response_status, headers, exc_info=None: status.append(response_status)))
+            return time.perf_counter() - start, int(status[0].split()[0]), content
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(send, requests))
+        return time.perf_counter() - start, results
+
+    def run_asgi(self, application, requests, concurrency):
+        async def send(request, slots):
+            method, path, query_string, body = request
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': '1.1',
+                'method': method,
+                'scheme': 'http',
+                'path': path,
+                'raw_path': path.encode(),
+                'query_string': query_string.encode(),
+                'root_path': '',
+                'headers': [
+                    (b'host', b'localhost'),
+                    (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode()),
+                ] + [
+                    (name.lower().encode(), value.encode()) for name, value in self.headers.items()
+                ],
+                'client': ('127.0.0.1', 0),
+                'server': ('localhost', 80),
+            }
+            events = [{'type': 'http.request', 'body': body, 'more_body': False}]
+            finished = asyncio.Event()
+            messages = []
+
+            async def receive():
+                if events:
+                    return events.pop()
+                # The client stays connected until the response is complete.
+                await finished.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send_message(message):
+                messages.append(message)
+                if message['type'] == 'http.response.body' and not message.get('more_body'):
+                    finished.set()
+
+            async with slots:
+                start = time.perf_counter()
+                await application(scope, receive, send_message)
+                elapsed = time.perf_counter() - start
+            status = next(message['status'] for message in messages if message['type'] == 'http.response.start')
+            content = b''.join(message.get('body', b'') for message in messages if message['type'] == 'http.response.body')
+            return elapsed, status, content
+
+        async def send_all():
+            slots = asyncio.Semaphore(concurrency)
+            start = time.perf_counter()
+            results = await asyncio.gather(*(send(request, slots) for request in requests))
+            return time.perf_counter() - start, results
+
+        return asyncio.run(send_all())
+
+    def report(self, scenario, sync_result, async_result):
+        self.stdout.write(scenario)
+        rates = []
+        for name, (elapsed, results) in (('WSGI', sync_result), ('ASGI', async_result)):
+            latencies = sorted(latency * 1000 for latency, status, content in results)
+            failed = [(status, content) for latency, status, content in results if status >= 400]
+            rates.append(len(results) / elapsed)
+            self.stdout.write(
+                f"  {name}: {len(results) / elapsed:,.1f} requests/s, latency p50 {statistics.median(latencies):.1f} ms, "
+                f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.1f} ms"
+                + (f", {len(failed)} failed (first: {failed[0][0]} {failed[0][1][:200]!r})" if failed else "")
+            )
+        self.stdout.write(f"  ASGI/WSGI throughput: {rates[1] / rates[0]:.2f}x")
@@ -0,0 +1,104 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from api.webhooks import DELIVERY_WORKERS, HOST_CONCURRENCY, WebhookSender
+
+
+class Receiver(ThreadingHTTPServer):
+    """A local stand-in for a subscriber's host: accepts every POST after `latency` seconds, over keep-alive connections."""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, latency):
+        self.connections = 0
+        self.lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(handler):
+                super().setup()
+                with self.lock:
+                    self.connections += 1
+
+            def do_POST(handler):
+                handler.rfile.read(int(handler.headers.get('Content-Length', 0)))
+                time.sleep(latency)
+                handler.send_response(200)
+                handler.send_header('Content-Length', '0')
+                handler.end_headers()
+
+            def log_message(handler, *args):
+                pass
+
+        super().__init__(('127.0.0.1', 0), Handler)
+
+
+class Command(BaseCommand):
+    help = (
+        "Send webhook events to local stand-in receivers with a set latency, one subscriber after another "
+        "as before and with the pooled concurrent sender, and compare how long each takes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=200, help="Endpoints per event (default 200)")
+        parser.add_argument('--hosts', type=int, default=20, help="Receivers the endpoints are spread over (default 20)")
+        parser.add_argument('--events', type=int, default=3, help="Events sent (default 3)")
+        parser.add_argument('--latency', type=float, default=50, help="Milliseconds each receiver takes to answer (default 50)")
+        parser.add_argument('--workers', type=int, default=DELIVERY_WORKERS, help=f"Concurrent requests (default {DELIVERY_WORKERS})")
+        parser.add_argument('--host-concurrency', type=int, default=HOST_CONCURRENCY, help=f"Concurrent requests per host (default {HOST_CONCURRENCY})")
+
+    def handle(self, *args, **options):
+        for name in ('subscribers', 'hosts', 'events', 'workers', 'host_concurrency'):
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be at least 1.")
+
+        receivers = [Receiver(options['latency'] / 1000) for _ in range(options['hosts'])]
+        for receiver in receivers:
+            threading.Thread(target=receiver.serve_forever, daemon=True).start()
+        urls = [
+            f'http://127.0.0.1:{receivers[i % len(receivers)].server_address[1]}/hooks/{i}'
+            for i in range(options['subscribers'])
+        ]
+        bodies = [json.dumps({'event': 'booking_updated', 'payload': {'id': n}}).encode() for n in range(options['events'])]
+
+        try:
+            # Before: a new connection per request, one subscriber after another.
+            start = time.perf_counter()
+            for body in bodies:
+                for url in urls:
+                    requests.post(url, data=body, headers={'Content-Type': 'application/json'}, timeout=5).raise_for_status()
+            serial_time = time.perf_counter() - start
+            serial_connections = sum(receiver.connections for receiver in receivers)
+
+            with WebhookSender(workers=options['workers'], host_concurrency=options['host_concurrency']) as sender:
+                start = time.perf_counter()
+                errors = [error for body in bodies for error in sender.send([(url, body) for url in urls])]
+                pooled_time = time.perf_counter() - start
+            pooled_connections = sum(receiver.connections for receiver in receivers) - serial_connections
+        finally:
+            for receiver in receivers:
+                receiver.shutdown()
+                receiver.server_close()
+
+        failed = [error for error in errors if error]
+        if failed:
+            raise CommandError(f"{len(failed)} deliveries failed, first: {failed[0]}")
+        count = len(urls) * len(bodies)
+        self.stdout.write(
+            f"{len(bodies)} events x {len(urls)} subscribers on {len(receivers)} hosts, "
+            f"{options['latency']:g} ms per request"
+        )
+        self.stdout.write(
+            f"  serial: {serial_time:.2f} s ({count / serial_time:,.0f} deliveries/s, "
+            f"{serial_time / len(bodies) * 1000:,.0f} ms per event), {serial_connections} connections"
+        )
+        self.stdout.write(
+            f"  pooled: {pooled_time:.2f} s ({count / pooled_time:,.0f} deliveries/s, "
+            f"{pooled_time / len(bodies) * 1000:,.0f} ms per event), {pooled_connections} connections"
+        )
+        self.stdout.write(f"  speedup: {serial_time / pooled_time:.1f}x")
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.webhooks import WORKER_BATCH_SIZE, WORKER_POLL_INTERVAL, run_worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Send queued webhook events to their subscribers. Runs until interrupted; "
+        "start several to share the queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+        parser.add_argument('--batch-size', type=int, default=WORKER_BATCH_SIZE, help=f"Events claimed at a time (default {WORKER_BATCH_SIZE})")
+        parser.add_argument(
+            '--poll-interval', type=float, default=WORKER_POLL_INTERVAL,
+            help=f"Seconds to wait when the queue is empty (default {WORKER_POLL_INTERVAL})"
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['poll_interval'] <= 0:
+            raise CommandError("--batch-size must be at least 1 and --poll-interval positive.")
+        try:
+            sent = run_worker(poll_interval=options['poll_interval'], batch_size=options['batch_size'], once=options['once'])
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(self.style.SUCCESS(f"Sent {sent} webhook events."))
@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 12:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='webhooksubscription',
+            name='event',
+            field=models.CharField(choices=[('booking_created', 'Booking Created'), ('booking_updated', 'Booking Updated'), ('booking_cancelled', 'Booking Cancelled'), ('property_created', 'Property Created'), ('property_updated', 'Property Updated'), ('bookings_imported', 'Bookings Imported')], max_length=20),
+        ),
+    ]
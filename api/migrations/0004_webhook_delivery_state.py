@@ -0,0 +1,48 @@
+# Generated by Django 5.1 on 2026-10-18 13:24
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_outbox_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhooksubscription',
+            name='consecutive_failures',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='webhooksubscription',
+            name='disabled_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='webhooksubscription',
+            name='last_error',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.CreateModel(
+            name='WebhookDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(choices=[('booking_created', 'Booking Created'), ('booking_updated', 'Booking Updated'), ('booking_cancelled', 'Booking Cancelled'), ('property_created', 'Property Created'), ('property_updated', 'Property Updated'), ('bookings_imported', 'Bookings Imported')], max_length=20)),
+                ('payload', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField()),
+                ('locked_by', models.CharField(blank=True, max_length=64)),
+                ('last_error', models.TextField(blank=True)),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='api.webhooksubscription')),
+            ],
+            options={
+                'verbose_name_plural': 'Webhook deliveries',
+                'indexes': [models.Index(fields=['subscription', 'id'], name='webhook_delivery_queue_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1 on 2026-10-18 13:26
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_webhook_delivery_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhooksubscription',
+            name='batch_size',
+            field=models.PositiveIntegerField(default=100, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(1000)]),
+        ),
+        migrations.AddField(
+            model_name='webhooksubscription',
+            name='batch_window',
+            field=models.PositiveIntegerField(default=0, validators=[django.core.validators.MaxValueValidator(3600)]),
+        ),
+    ]
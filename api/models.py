@@ -1,3 +1,5 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.contrib.auth.models import User
 
@@ -8,6 +10,7 @@ class WebhookSubscription(models.Model):
         ('booking_cancelled', 'Booking Cancelled'),
         ('property_created', 'Property Created'),
         ('property_updated', 'Property Updated'),
+        ('bookings_imported', 'Bookings Imported'),
     ]
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='webhook_subscriptions')
@@ -16,6 +19,14 @@ class WebhookSubscription(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # With a batch window, events are collected for that many seconds, or until there are
+    # batch_size of them, and sent together as a JSON array.
+    batch_window = models.PositiveIntegerField(default=0, validators=[MaxValueValidator(60 * 60)])
+    batch_size = models.PositiveIntegerField(default=100, validators=[MinValueValidator(1), MaxValueValidator(1000)])
+    # Delivery attempts that have failed in a row; at WEBHOOK_FAILURE_BUDGET the subscription is disabled.
+    consecutive_failures = models.PositiveIntegerField(default=0, editable=False)
+    last_error = models.TextField(blank=True, editable=False)
+    disabled_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         unique_together = ('user', 'event', 'target_url')
@@ -25,4 +36,49 @@ class WebhookSubscription(models.Model):
 
     @classmethod
     def get_available_events(cls):
-        return dict(cls.EVENT_CHOICES)
\ No newline at end of file
+        return dict(cls.EVENT_CHOICES)
+
+
+class OutboxEvent(models.Model):
+    """
+    A webhook event waiting for the webhook worker. It is written in the
+    transaction of the change it reports, so only committed changes are
+    sent, and deleted once it has been sent to the event's subscribers.
+    """
+    event = models.CharField(max_length=20, choices=WebhookSubscription.EVENT_CHOICES)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Set by the worker that claims the event; another worker can claim it once it passes.
+    locked_until = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=64, blank=True)
+
+    def __str__(self):
+        return f"{self.event} at {self.created_at}"
+
+
+class WebhookDelivery(models.Model):
+    """
+    An event still to be sent to one subscription: one that failed and
+    waits for its retry, one queued behind such an event so that the
+    subscription receives its events in order, or one collected for a
+    batch.
+    """
+    subscription = models.ForeignKey(WebhookSubscription, on_delete=models.CASCADE, related_name='deliveries')
+    event = models.CharField(max_length=20, choices=WebhookSubscription.EVENT_CHOICES)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    # Pushed forward by the worker that claims the delivery, for as long as its
+    # lease, and locked_by is cleared when the delivery is released.
+    next_attempt_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=64, blank=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.event} for {self.subscription.target_url} ({self.attempts} attempts)"
+
+    class Meta:
+        verbose_name_plural = "Webhook deliveries"
+        indexes = [
+            models.Index(fields=['subscription', 'id'], name='webhook_delivery_queue_idx'),
+        ]
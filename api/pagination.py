@@ -0,0 +1,115 @@
+import base64
+import json
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class StandardResultsSetPagination(PageNumberPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pages ordered by a unique key, such as ('check_in_date', 'id'), that
+    carry the key of their first and last rows in opaque `cursor` links.
+    Each page seeks straight to its first row on an index over the key
+    instead of counting and skipping the rows before it, so every page
+    costs the same as the first. There is no total count, and the results
+    are always in key order.
+    """
+    cursor_query_param = 'cursor'
+    page_size = StandardResultsSetPagination.page_size
+    page_size_query_param = StandardResultsSetPagination.page_size_query_param
+    max_page_size = StandardResultsSetPagination.max_page_size
+
+    def __init__(self, keys):
+        self.keys = list(keys)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(page_size, self.max_page_size) if page_size > 0 else self.page_size
+
+    def encode_cursor(self, reverse, row):
+        key = [str(row[name] if isinstance(row, dict) else getattr(row, name)) for name in self.keys]
+        position = json.dumps({'r': int(reverse), 'k': key}, separators=(',', ':'))
+        return replace_query_param(self.base_url, self.cursor_query_param, base64.urlsafe_b64encode(position.encode()).decode())
+
+    def decode_cursor(self, model, cursor):
+        """(reverse, key values), with the values converted back from their strings."""
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(position['k']) != len(self.keys):
+                raise ValueError
+            values = [model._meta.get_field(name).to_python(value) for name, value in zip(self.keys, position['k'])]
+            return bool(position['r']), values
+        except (TypeError, ValueError, KeyError, DjangoValidationError):
+            raise NotFound("Invalid cursor.")
+
+    def after(self, values, reverse):
+        """The rows after the key `values` (before them if `reverse`), as a tuple comparison spelled out in Q objects."""
+        lookup = 'lt' if reverse else 'gt'
+        condition = Q(**{f'{self.keys[-1]}__{lookup}': values[-1]})
+        for name, value in reversed(list(zip(self.keys[:-1], values[:-1]))):
+            condition = Q(**{f'{name}__{lookup}': value}) | Q(**{name: value}) & condition
+        # Redundant, but a plain range on the first key is what lets the
+        # database seek into the index rather than scan it from the start.
+        return Q(**{f'{self.keys[0]}__{lookup}e': values[0]}) & condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        reverse, values = self.decode_cursor(queryset.model, cursor) if cursor else (False, None)
+
+        if values is not None:
+            queryset = queryset.filter(self.after(values, reverse))
+        # One row more than the page tells whether there is another page.
+        rows = list(queryset.order_by(*[f'-{name}' if reverse else name for name in self.keys])[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        # A cursor means there are rows on its other side: the page it came from.
+        has_next = values is not None if reverse else has_more
+        has_previous = has_more if reverse else values is not None
+        self.next_link = self.encode_cursor(False, rows[-1]) if rows and has_next else None
+        self.previous_link = self.encode_cursor(True, rows[0]) if rows and has_previous else None
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.next_link,
+            'previous': self.previous_link,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+def get_paginator(request, keys):
+    """
+    The paginator for a listing: offset pages by default, or keyset pages
+    over `keys` when the client asks with `pagination=cursor` or follows a
+    `cursor` link.
+    """
+    if request.query_params.get('pagination') == 'cursor' or KeysetPagination.cursor_query_param in request.query_params:
+        return KeysetPagination(keys)
+    return StandardResultsSetPagination()
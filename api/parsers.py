@@ -0,0 +1,28 @@
+import codecs
+from django.conf import settings
+from rest_framework.parsers import BaseParser
+from bookings.importer import read_rows
+
+
+class StreamingRowsParser(BaseParser):
+    """
+    Parses a request body into a lazy iterator of row dicts, so a large
+    upload is read line by line while it is being processed instead of being
+    loaded whole first.
+    """
+    format = None
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return read_rows(codecs.iterdecode(stream, encoding), self.format)
+
+
+class CSVParser(StreamingRowsParser):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class JSONLinesParser(StreamingRowsParser):
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
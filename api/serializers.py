@@ -1,4 +1,7 @@
+import decimal
+from datetime import date
 from rest_framework import serializers
+from rest_framework.settings import ISO_8601, api_settings
 from properties.models import Property
 from bookings.models import Booking
 from .models import WebhookSubscription
@@ -14,12 +17,93 @@ class BookingSerializer(serializers.ModelSerializer):
         fields = ['id', 'property', 'guest', 'check_in_date', 'check_out_date', 'num_guests', 'total_price', 'status']
         read_only_fields = ['total_price', 'status']
 
+class QuoteSerializer(serializers.Serializer):
+    total_price = serializers.DecimalField(max_digits=10, decimal_places=2, coerce_to_string=False)
+    base_total = serializers.DecimalField(max_digits=10, decimal_places=2, coerce_to_string=False)
+    fees_total = serializers.DecimalField(max_digits=10, decimal_places=2, coerce_to_string=False)
+
 class WebhookSubscriptionSerializer(serializers.ModelSerializer):
     class Meta:
         model = WebhookSubscription
-        fields = ['id', 'event', 'target_url', 'is_active']
-        read_only_fields = ['id']
+        fields = [
+            'id', 'event', 'target_url', 'is_active', 'batch_window', 'batch_size',
+            'consecutive_failures', 'last_error', 'disabled_at'
+        ]
+        read_only_fields = ['id', 'consecutive_failures', 'last_error', 'disabled_at']
 
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        # Turning a subscription back on gives it a fresh failure budget.
+        if validated_data.get('is_active') and not instance.is_active:
+            instance.consecutive_failures = 0
+            instance.last_error = ''
+            instance.disabled_at = None
+        return super().update(instance, validated_data)
+
+
+def compile_field(field):
+    """
+    A function that turns a value as `.values()` returns it into what
+    `field.to_representation` gives for it, with the settings that decide
+    the output looked up now rather than for every value.
+    """
+    if isinstance(field, serializers.DecimalField) and field.decimal_places is not None and not field.localize:
+        context = decimal.getcontext().copy()
+        if field.max_digits is not None:
+            context.prec = field.max_digits
+        exponent = decimal.Decimal('.1') ** field.decimal_places
+        rounding = field.rounding
+        coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+
+        def convert(value):
+            if not isinstance(value, decimal.Decimal):
+                value = decimal.Decimal(str(value).strip())
+            value = value.quantize(exponent, rounding=rounding, context=context)
+            return '{:f}'.format(value) if coerce_to_string else value
+        return convert
+    if isinstance(field, serializers.DateField) and not isinstance(field, serializers.DateTimeField):
+        output_format = getattr(field, 'format', api_settings.DATE_FORMAT)
+        if output_format is not None and output_format.lower() == ISO_8601:
+            return date.isoformat
+    if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+        # `.values()` gives the related object's primary key itself.
+        return lambda value: value
+    if isinstance(field, serializers.IntegerField):
+        return int
+    if type(field) in (serializers.CharField, serializers.EmailField, serializers.URLField):
+        return str
+    return field.to_representation
+
+
+class RowSerializer:
+    """
+    Serializes rows fetched with `.values(*row_serializer.sources)` exactly as
+    `serializer_class` serializes the model instances, for read-only lists.
+    The fields' conversions are compiled once, so a row costs a dict lookup
+    and a function call per field instead of the serializer's field
+    machinery. `fields` limits the output to those field names, which stay
+    in the serializer's order.
+    """
+
+    def __init__(self, serializer_class, fields=None):
+        self.fields = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only or (fields is not None and name not in fields):
+                continue
+            if '.' in field.source or field.source == '*':
+                raise ValueError(f"{serializer_class.__name__}.{name} does not read a column of its own.")
+            self.fields.append((name, field.source, compile_field(field)))
+        self.sources = [source for name, source, convert in self.fields]
+
+    def to_representation(self, row):
+        # Like `Serializer.to_representation`, None is never converted.
+        return {
+            name: None if row[source] is None else convert(row[source])
+            for name, source, convert in self.fields
+        }
+
+    def serialize(self, rows):
+        return [self.to_representation(row) for row in rows]
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from properties.cache import bump_global_version
+from .authentication import forget_tokens
+from .models import WebhookDelivery, WebhookSubscription
+from .webhooks import WEBHOOKS_VERSION
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    forget_tokens()
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def forget_user_tokens(sender, instance, update_fields=None, **kwargs):
+    # Deactivating a user, or any other change, applies to their next
+    # request. Logging in only records the time.
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        forget_tokens()
+
+@receiver(post_save, sender=WebhookSubscription)
+@receiver(post_delete, sender=WebhookSubscription)
+def invalidate_subscription_registry(sender, **kwargs):
+    bump_global_version(WEBHOOKS_VERSION)
+
+@receiver(post_save, sender=WebhookSubscription)
+def drop_inactive_deliveries(sender, instance, **kwargs):
+    # Whether the worker disabled it or someone turned it off, a subscription
+    # that is turned back on starts afresh rather than replaying stale events.
+    if not instance.is_active:
+        WebhookDelivery.objects.filter(subscription=instance).delete()
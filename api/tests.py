@@ -1,3 +1,967 @@
-from django.test import TestCase
+import base64
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import urlsplit
+import requests
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from bookings.batch import run_query
+from bookings.models import Booking
+from guests.models import Guest
+from owners.models import Owner
+from properties.cache import get_shared_cache, local_cache
+from properties.models import BookingRule, Fee, PricingRule, Property
+from .authentication import forget_tokens, token_cache
+from .serializers import BookingSerializer, PropertySerializer
+from .models import OutboxEvent, WebhookDelivery, WebhookSubscription
+from .webhooks import (
+    WORKER_LEASE, CircuitBreaker, WebhookSender, claim_events, coalesce, dispatch_events, dispatch_retries, send_webhook,
+    send_webhook_notification
+)
 
-# Create your tests here.
+
+class APITestMixin:
+    """An authenticated client, an owner with a few properties and a guest, on empty caches."""
+
+    properties_count = 3
+
+    def setUp(self):
+        # Cached entries are keyed by primary keys, which SQLite hands out
+        # again once a test's rows are rolled back.
+        get_shared_cache().clear()
+        local_cache.clear()
+        self.addCleanup(get_shared_cache().clear)
+        self.addCleanup(local_cache.clear)
+
+        self.owner = Owner.objects.create(first_name='Olive', last_name='Owner', email='owner@example.com', phone='1', address='1 Road')
+        self.guest = Guest.objects.create(first_name='Gus', last_name='Guest', email='guest@example.com', phone='1')
+        self.properties = [self.create_property(f'Property {index}', Decimal(100 + 10 * index)) for index in range(self.properties_count)]
+        self.user = User.objects.create_user('agent')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_property(self, name, nightly_rate, **fields):
+        return Property.objects.create(
+            name=name, address='1 Road', owner=self.owner, bedrooms=1, bathrooms=1,
+            max_occupancy=4, nightly_rate=nightly_rate, description='', **fields
+        )
+
+
+class APITestCase(APITestMixin, TestCase):
+    pass
+
+
+class PricingBatchTests(APITestCase):
+    url = '/api/pricing/batch/'
+
+    def setUp(self):
+        super().setUp()
+        PricingRule.objects.create(property=self.properties[0], rule_type='weekend', price_modifier=Decimal('125.00'))
+        Fee.objects.create(
+            property=self.properties[0], name='Cleaning', fee_type='fixed', applies='once', display_strategy='separate', amount=Decimal('40.00')
+        )
+        self.properties[1].minimum_stay = 3
+        self.properties[1].save()
+        Booking.objects.create(
+            property=self.properties[2], guest=self.guest, num_guests=1, check_in_date=date(2031, 1, 10), check_out_date=date(2031, 1, 14)
+        )
+
+    def pricing(self, item):
+        """The per-property pricing view's answer for a batch item."""
+        return self.client.get(f"/api/properties/{item['property']}/pricing/", {
+            'check_in': item['check_in'], 'check_out': item['check_out'], 'guests': item['guests']
+        })
+
+    def test_matches_per_property_pricing(self):
+        items = [
+            {'property': self.properties[0].pk, 'check_in': '2031-01-09', 'check_out': '2031-01-12', 'guests': 2},
+            'not a stay',
+            {'property': self.properties[0].pk, 'check_in': '2031-01-09', 'check_out': '2031-01-12'},
+            {'property': self.properties[0].pk, 'check_in': '9 January', 'check_out': '2031-01-12', 'guests': 2},
+            {'property': 999999, 'check_in': '2031-01-09', 'check_out': '2031-01-12', 'guests': 2},
+            {'property': self.properties[1].pk, 'check_in': '2031-01-09', 'check_out': '2031-01-11', 'guests': 2},
+            {'property': self.properties[1].pk, 'check_in': '2031-01-09', 'check_out': '2031-01-12', 'guests': 2},
+            {'property': self.properties[2].pk, 'check_in': '2031-01-12', 'check_out': '2031-01-16', 'guests': 2},
+            {'property': self.properties[2].pk, 'check_in': '2031-01-14', 'check_out': '2031-01-16', 'guests': 2},
+            {'property': self.properties[0].pk, 'check_in': '2031-01-12', 'check_out': '2031-01-09', 'guests': 2},
+        ]
+        response = self.client.post(self.url, items, format='json')
+        self.assertEqual(response.status_code, 200)
+        results = response.data
+        self.assertEqual(len(results), len(items))
+
+        invalid = "Invalid stay. Provide property, check_in and check_out as YYYY-MM-DD, and an integer number of guests"
+        self.assertEqual(results[1], {'error': invalid})
+        self.assertEqual(results[2]['error'], invalid)
+        self.assertEqual(results[3]['error'], invalid)
+        self.assertEqual(results[4]['error'], "Property not found.")
+        self.assertEqual(results[9]['error'], "Check-out date must be after check-in date.")
+
+        for index in (0, 5, 6, 7, 8):
+            with self.subTest(item=items[index]):
+                expected = self.pricing(items[index])
+                self.assertEqual({key: results[index][key] for key in items[index]}, items[index])
+                if expected.status_code == 200:
+                    self.assertNotIn('error', results[index])
+                    self.assertEqual({key: results[index][key] for key in expected.data}, expected.data)
+                else:
+                    self.assertEqual(results[index]['error'], expected.data['error'])
+        self.assertEqual(results[0]['total_price'], Decimal('390.00'))
+        self.assertIn('error', results[5])
+        self.assertIn('error', results[7])
+
+    def test_rejects_anything_but_a_list(self):
+        for body in ({}, [], {'property': self.properties[0].pk}):
+            self.assertEqual(self.client.post(self.url, body, format='json').status_code, 400)
+
+
+class DateSearchTests(APITestCase):
+    """A search with dates prices, filters and orders stays as the per-property pricing view does."""
+
+    url = '/api/properties/search/'
+    properties_count = 12
+
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(20240704)
+        today = timezone.localdate()
+        # One stay covered by the stored nightly rates and one beyond them.
+        self.stays = [(today + timedelta(days=30), today + timedelta(days=34)), (today + timedelta(days=700), today + timedelta(days=703))]
+        for property in self.properties:
+            property.nightly_rate = Decimal(rng.randrange(5000, 30000)) / 100
+            property.minimum_stay = rng.choice([1, 1, 4])
+            property.save()
+            if rng.random() < 0.5:
+                PricingRule.objects.create(property=property, rule_type='weekend', price_modifier=Decimal(rng.choice([80, 125, 150])))
+            if rng.random() < 0.5:
+                Fee.objects.create(
+                    property=property, name='Service', fee_type='percentage', applies='once', display_strategy='separate',
+                    amount=Decimal(rng.choice(['5.00', '12.50']))
+                )
+            if rng.random() < 0.5:
+                Fee.objects.create(
+                    property=property, name='Cleaning', fee_type='fixed', applies=rng.choice(['once', 'per_night']),
+                    display_strategy=rng.choice(['separate', 'incorporated']), amount=Decimal(rng.randrange(1000, 9000)) / 100
+                )
+            if rng.random() < 0.25:
+                check_in_date, check_out_date = rng.choice(self.stays)
+                Booking.objects.create(
+                    property=property, guest=self.guest, num_guests=1,
+                    check_in_date=check_in_date - timedelta(days=1), check_out_date=check_in_date + timedelta(days=5)
+                )
+
+    def search(self, params):
+        """Every result of the search, following its pages."""
+        results = []
+        response = self.client.get(self.url, {**params, 'page_size': 5})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            results += response.data['results']
+            if not response.data['next']:
+                return results
+            response = self.client.get(response.data['next'])
+
+    def test_matches_per_property_pricing(self):
+        for check_in_date, check_out_date in self.stays:
+            params = {'check_in': check_in_date.isoformat(), 'check_out': check_out_date.isoformat(), 'guests': 2}
+            quotes = {}
+            for property in self.properties:
+                response = self.client.get(f'/api/properties/{property.pk}/pricing/', params)
+                if response.status_code == 200:
+                    quotes[property.pk] = response.data
+            prices = sorted(quote['total_price'] for quote in quotes.values())
+            max_price = prices[len(prices) // 2]
+
+            for ordering in ('price', '-price'):
+                with self.subTest(check_in=check_in_date, ordering=ordering):
+                    results = self.search({**params, 'ordering': ordering, 'max_price': str(max_price)})
+                    expected = [pk for pk, quote in quotes.items() if quote['total_price'] <= max_price]
+                    self.assertEqual(sorted(result['id'] for result in results), sorted(expected))
+                    for result in results:
+                        self.assertEqual({key: result[key] for key in quotes[result['id']]}, quotes[result['id']])
+                    totals = [result['total_price'] for result in results]
+                    self.assertEqual(totals, sorted(totals, reverse=ordering == '-price'))
+
+
+class CalendarTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.property = self.properties[0]
+        self.url = f'/api/properties/{self.property.pk}/calendar/'
+        self.params = {'from': '2031-01-01', 'to': '2031-01-31'}
+
+    def book(self, check_in_date, check_out_date):
+        return Booking.objects.create(
+            property=self.property, guest=self.guest, num_guests=1, check_in_date=check_in_date, check_out_date=check_out_date
+        )
+
+    def assertNotModified(self, etag):
+        self.assertEqual(self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def assertModified(self, etag):
+        response = self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response
+
+    def test_not_modified_until_the_range_changes(self):
+        response = self.client.get(self.url, self.params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['nights']), 31)
+        self.assertNotModified(response['ETag'])
+
+        # Bookings outside the range, or at another property, leave it alone.
+        self.book(date(2031, 3, 1), date(2031, 3, 5))
+        Booking.objects.create(
+            property=self.properties[1], guest=self.guest, num_guests=1, check_in_date=date(2031, 1, 10), check_out_date=date(2031, 1, 12)
+        )
+        self.assertNotModified(response['ETag'])
+
+        booking = self.book(date(2031, 1, 10), date(2031, 1, 12))
+        response = self.assertModified(response['ETag'])
+        self.assertTrue(response.data['nights'][9]['booked'])
+        self.assertNotModified(response['ETag'])
+
+        booking.status = 'cancelled'
+        booking.save()
+        response = self.assertModified(response['ETag'])
+        self.assertFalse(response.data['nights'][9]['booked'])
+
+        PricingRule.objects.create(property=self.property, rule_type='weekend', price_modifier=Decimal('125.00'))
+        self.assertModified(response['ETag'])
+
+
+class CheapestStaysTests(APITestCase):
+    """The cheapest stays are the cheapest of every stay the per-property pricing view would quote."""
+
+    url = '/api/pricing/cheapest/'
+    properties_count = 4
+
+    def setUp(self):
+        super().setUp()
+        first, second, third, small = self.properties
+        PricingRule.objects.create(property=first, rule_type='weekend', price_modifier=Decimal('150.00'))
+        PricingRule.objects.create(property=second, rule_type='seasonal', start_date=date(2031, 1, 12), end_date=date(2031, 1, 18), price_modifier=Decimal('60.00'))
+        Fee.objects.create(property=second, name='Cleaning', fee_type='fixed', applies='once', display_strategy='separate', amount=Decimal('45.00'))
+        Fee.objects.create(property=third, name='Service', fee_type='percentage', applies='once', display_strategy='incorporated', amount=Decimal('10.00'))
+        BookingRule.objects.create(property=first, start_date=date(2031, 1, 1), end_date=date(2031, 1, 8), min_nights=4)
+        for property, check_in_date, check_out_date in [
+            (second, date(2031, 1, 14), date(2031, 1, 17)),
+            (third, date(2031, 1, 5), date(2031, 1, 9)),
+            (third, date(2031, 1, 11), date(2031, 1, 15)),  # leaves a two-night gap stay
+        ]:
+            Booking.objects.create(property=property, guest=self.guest, num_guests=1, check_in_date=check_in_date, check_out_date=check_out_date)
+        third.no_checkin_days = '56'
+        third.minimum_stay = 4
+        third.save()
+        small.max_occupancy = 2
+        small.nightly_rate = Decimal('50.00')
+        small.save()
+
+    def every_stay(self, start_date, end_date, nights, guests):
+        """Every stay in the window that the pricing view quotes, as (total price, check-in, property) with its quote."""
+        stays = []
+        for property in self.properties:
+            if guests > property.max_occupancy:
+                continue
+            check_in_date = start_date
+            while check_in_date + timedelta(days=nights) <= end_date + timedelta(days=1):
+                check_out_date = check_in_date + timedelta(days=nights)
+                response = self.client.get(f'/api/properties/{property.pk}/pricing/', {
+                    'check_in': check_in_date.isoformat(), 'check_out': check_out_date.isoformat(), 'guests': guests
+                })
+                if response.status_code == 200:
+                    stays.append({'property': property.pk, 'check_in': check_in_date, 'check_out': check_out_date, **response.data})
+                check_in_date += timedelta(days=1)
+        stays.sort(key=lambda stay: (stay['total_price'], stay['check_in'], stay['property']))
+        return stays
+
+    def test_matches_every_quotable_stay(self):
+        start_date, end_date = date(2031, 1, 1), date(2031, 1, 31)
+        for nights, guests, limit in [(2, 1, 10), (3, 3, 5), (4, 2, 100)]:
+            with self.subTest(nights=nights, guests=guests):
+                response = self.client.get(self.url, {
+                    'owner': self.owner.pk, 'from': start_date.isoformat(), 'to': end_date.isoformat(),
+                    'nights': nights, 'guests': guests, 'limit': limit
+                })
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data, self.every_stay(start_date, end_date, nights, guests)[:limit])
+
+    def test_gap_stay_below_the_minimum_stay(self):
+        response = self.client.get(self.url, {
+            'properties': self.properties[2].pk, 'from': '2031-01-01', 'to': '2031-01-20', 'nights': 2, 'limit': 100
+        })
+        self.assertEqual([(stay['check_in'], stay['check_out']) for stay in response.data], [(date(2031, 1, 9), date(2031, 1, 11))])
+
+    def test_invalid_parameters(self):
+        for params in [
+            {'from': '2031-01-01', 'to': '2031-01-31', 'nights': 2},
+            {'owner': self.owner.pk, 'from': '1 January', 'to': '2031-01-31', 'nights': 2},
+            {'owner': self.owner.pk, 'from': '2031-01-31', 'to': '2031-01-01', 'nights': 2},
+            {'owner': self.owner.pk, 'from': '2031-01-01', 'to': '2033-01-31', 'nights': 2},
+            {'owner': self.owner.pk, 'from': '2031-01-01', 'to': '2031-01-31', 'nights': 0},
+            {'owner': self.owner.pk, 'from': '2031-01-01', 'to': '2031-01-31', 'nights': 2, 'limit': 101},
+        ]:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+
+class CursorPaginationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/owners/{self.owner.pk}/bookings/'
+        # Stays on the same dates at every property, so pages split ties on the date.
+        for week in range(4):
+            for property in self.properties:
+                self.book(property, date(2031, 1, 1) + timedelta(weeks=week))
+
+    def book(self, property, check_in_date):
+        return Booking.objects.create(
+            property=property, guest=self.guest, num_guests=1, check_in_date=check_in_date, check_out_date=check_in_date + timedelta(days=2)
+        )
+
+    def get(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_pages_are_stable_across_inserts(self):
+        page = self.get(self.url, {'pagination': 'cursor', 'page_size': 5})
+        seen = [row['id'] for row in page['results']]
+        self.assertIsNone(page['previous'])
+        # Stays before the page already read are not shown; later ones are.
+        earlier = self.book(self.properties[0], date(2030, 12, 1))
+        later = self.book(self.properties[0], date(2031, 3, 1))
+        while page['next']:
+            page = self.get(page['next'])
+            seen += [row['id'] for row in page['results']]
+
+        expected = list(Booking.objects.order_by('check_in_date', 'id').values_list('id', flat=True))
+        self.assertEqual(seen, expected[1:])
+        self.assertEqual((expected[0], expected[-1]), (earlier.pk, later.pk))
+
+        # Back from the last page, the earlier stay is there.
+        previous = []
+        while page['previous']:
+            page = self.get(page['previous'])
+            previous = [row['id'] for row in page['results']] + previous
+        self.assertEqual(previous, expected[:-3])
+
+    def test_invalid_cursor_is_not_found(self):
+        def encode(position):
+            return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+        for cursor in ('not-a-cursor', encode({'r': 0, 'k': ['2031-01-01']}), encode({'r': 0, 'k': ['January', '1']}), encode([])):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(self.url, {'cursor': cursor}).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {'cursor': encode({'r': 0, 'k': ['2031-01-01', '1']})}).status_code, 200)
+
+
+class RequestedFieldsTests(APITestCase):
+    """Listings serialize rows as the full serializers do, and `?fields=` only picks among their fields."""
+
+    def setUp(self):
+        super().setUp()
+        self.properties[0].bathrooms = Decimal('1.5')
+        self.properties[0].nightly_rate = Decimal('123.4')
+        self.properties[0].description = 'Sea view'
+        self.properties[0].save()
+        for index, property in enumerate(self.properties):
+            Booking.objects.create(
+                property=property, guest=self.guest, num_guests=2,
+                check_in_date=date(2031, 1, 1) + timedelta(days=7 * index), check_out_date=date(2031, 1, 4) + timedelta(days=7 * index)
+            )
+        self.properties = Property.objects.order_by('id')
+        self.bookings = Booking.objects.order_by('check_in_date', 'id')
+
+    def get(self, url, params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)['results']
+
+    def expected(self, serializer_class, instances, fields=None):
+        data = json.loads(json.dumps(serializer_class(instances, many=True).data, cls=DjangoJSONEncoder))
+        if fields is None:
+            return data
+        return [{name: item[name] for name in item if name in fields} for item in data]
+
+    def test_matches_the_full_serializers(self):
+        listings = [
+            ('/api/properties/', {'ordering': 'id'}, PropertySerializer, self.properties),
+            (f'/api/owners/{self.owner.pk}/properties/', {}, PropertySerializer, self.properties),
+            (f'/api/owners/{self.owner.pk}/properties/', {'pagination': 'cursor'}, PropertySerializer, self.properties),
+            ('/api/properties/search/', {}, PropertySerializer, self.properties),
+            (f'/api/owners/{self.owner.pk}/bookings/', {}, BookingSerializer, self.bookings),
+            (f'/api/owners/{self.owner.pk}/bookings/', {'pagination': 'cursor'}, BookingSerializer, self.bookings),
+        ]
+        for url, params, serializer_class, instances in listings:
+            for fields in (None, ['nightly_rate', 'name'], ['total_price', 'guest', 'check_in_date'], ['id']):
+                if fields is not None and not set(fields) <= set(serializer_class().fields):
+                    continue
+                with self.subTest(url=url, params=params, fields=fields):
+                    results = self.get(url, {**params, 'fields': ','.join(fields)} if fields else params)
+                    expected = self.expected(serializer_class, instances, fields)
+                    self.assertEqual(results, expected)
+                    self.assertEqual([list(item) for item in results], [list(item) for item in expected])
+
+    def test_search_with_dates(self):
+        params = {'check_in': '2031-02-01', 'check_out': '2031-02-04', 'guests': 2}
+        full = self.get('/api/properties/search/', params)
+        self.assertEqual([{name: item[name] for name in PropertySerializer().fields} for item in full], self.expected(PropertySerializer, self.properties))
+        results = self.get('/api/properties/search/', {**params, 'fields': 'id,total_price'})
+        self.assertEqual(results, [{'id': item['id'], 'total_price': item['total_price']} for item in full])
+
+    def test_unknown_fields_are_rejected(self):
+        for url in ('/api/properties/', '/api/properties/search/', f'/api/owners/{self.owner.pk}/bookings/'):
+            with self.subTest(url=url):
+                response = self.client.get(url, {'fields': 'id,owner'})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('Unknown fields: owner', response.data['fields'])
+
+
+class AsyncViewTests(APITestMixin, TransactionTestCase):
+    """The async views answer exactly as their sync namesakes. Their queries run in other threads, which only see committed rows."""
+
+    properties_count = 4
+
+    def setUp(self):
+        super().setUp()
+        first, second, third, fourth = self.properties
+        PricingRule.objects.create(property=first, rule_type='weekend', price_modifier=Decimal('125.00'))
+        Fee.objects.create(property=second, name='Cleaning', fee_type='fixed', applies='once', display_strategy='separate', amount=Decimal('45.00'))
+        third.minimum_stay = 3
+        third.save()
+        for check_in_date, check_out_date in [(date(2031, 1, 6), date(2031, 1, 10)), (date(2031, 1, 12), date(2031, 1, 16))]:
+            Booking.objects.create(property=third, guest=self.guest, num_guests=1, check_in_date=check_in_date, check_out_date=check_out_date)
+        # Beyond the years with stored occupancy, its checks read the bookings.
+        Booking.objects.create(property=fourth, guest=self.guest, num_guests=1, check_in_date=date(2040, 1, 6), check_out_date=date(2040, 1, 10))
+
+    def assertSameResponses(self, method, url, requests):
+        for data in requests:
+            with self.subTest(url=url, data=data):
+                sync = getattr(self.client, method)(f'/api/{url}', data, format='json')
+                get_shared_cache().clear()
+                local_cache.clear()
+                asynchronous = getattr(self.client, method)(f'/api/async/{url}', data, format='json')
+                self.assertEqual(asynchronous.status_code, sync.status_code)
+                # Page links point back at the view that gave them.
+                self.assertEqual(json.loads(asynchronous.content.replace(b'/api/async/', b'/api/')), json.loads(sync.content))
+
+    def stays(self):
+        return [
+            {'check_in': '2031-01-09', 'check_out': '2031-01-12', 'guests': 2},
+            {'check_in': '2031-01-10', 'check_out': '2031-01-12', 'guests': 2},  # a gap stay at the third
+            {'check_in': '2031-01-10', 'check_out': '2031-01-11', 'guests': 2},
+            {'check_in': '2031-01-08', 'check_out': '2031-01-11', 'guests': 2},
+            {'check_in': '2040-01-10', 'check_out': '2040-01-12', 'guests': 2},
+            {'check_in': '2040-01-08', 'check_out': '2040-01-12', 'guests': 2},
+            {'check_in': '2031-01-12', 'check_out': '2031-01-09', 'guests': 2},
+            {'check_in': '9 January', 'check_out': '2031-01-12', 'guests': 2},
+            {'check_in': '2031-01-09'},
+        ]
+
+    def test_check_availability(self):
+        for property_id in [property.pk for property in self.properties] + [999999]:
+            self.assertSameResponses('get', f'properties/{property_id}/check-availability/', self.stays())
+
+    def test_property_pricing(self):
+        for property_id in [property.pk for property in self.properties] + [999999]:
+            self.assertSameResponses('get', f'properties/{property_id}/pricing/', self.stays())
+
+    def test_search_properties(self):
+        self.assertSameResponses('get', 'properties/search/', [
+            {},
+            {'max_price': '115', 'fields': 'id,name'},
+            {**self.stays()[0], 'page_size': 2},
+            {**self.stays()[1], 'ordering': '-price'},
+            {**self.stays()[4], 'ordering': 'price', 'max_price': '300'},
+            {**self.stays()[4], 'fields': 'id,total_price'},
+            {'check_in': '2031-01-09'},
+            {'fields': 'owner'},
+        ])
+
+    def test_pricing_batch(self):
+        stays = self.stays()
+        self.assertSameResponses('post', 'pricing/batch/', [
+            [{'property': property.pk, **stay} for property in self.properties for stay in stays] + [{'property': 999999, **stays[0]}, 'x'],
+            [],
+            {'property': self.properties[0].pk},
+        ])
+
+
+    def test_query_threads_close_their_connections(self):
+        def count_properties():
+            used.append(connections['default'])
+            return Property.objects.count()
+        used = []
+        self.assertEqual(async_to_sync(run_query)(count_properties), len(self.properties))
+        self.assertIsNone(used[0].connection)
+
+        # Unless CONN_MAX_AGE keeps them open.
+        used.clear()
+        with mock.patch.dict(connections.settings['default'], {'CONN_MAX_AGE': None}):
+            async_to_sync(run_query)(count_properties)
+        self.assertIsNotNone(used[0].connection)
+        used[0].inc_thread_sharing()
+        used[0].close()
+
+
+class CachedPageTests(APITestCase):
+    url = '/api/properties/'
+
+    def test_not_modified_until_a_property_changes(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 3)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            # Other clients get the page from the cache.
+            self.assertEqual(self.client.get(self.url).data, response.data)
+
+        self.create_property('Property 3', Decimal('90.00'))
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.data['count'], 4)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+    def test_if_modified_since_within_the_second_of_a_change(self):
+        second = int(time.time()) + 10
+        with mock.patch('time.time', return_value=second + 0.2):
+            self.properties[0].save()
+            # Another change can still come in this second, with the same
+            # Last-Modified, so none is given out yet.
+            self.assertNotIn('Last-Modified', self.client.get(self.url))
+
+        with mock.patch('time.time', return_value=second + 1.2):
+            last_modified = self.client.get(self.url)['Last-Modified']
+            self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+            self.properties[0].name = 'Renamed'
+            self.properties[0].save()
+            response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Renamed', [row['name'] for row in response.data['results']])
+
+    def test_if_none_match_wins_over_if_modified_since(self):
+        response = self.client.get(self.url)
+        self.create_property('Property 3', Decimal('90.00'))
+        with mock.patch('time.time', return_value=time.time() + 60):
+            far_future = 'Fri, 01 Jan 2100 00:00:00 GMT'
+            self.assertEqual(
+                self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'], HTTP_IF_MODIFIED_SINCE=far_future).status_code, 200
+            )
+
+
+class CachedTokenAuthenticationTests(APITestCase):
+    url = '/api/webhooks/events/'
+
+    def setUp(self):
+        super().setUp()
+        token_cache.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_known_token_costs_no_query(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(token_cache.get_stats()['hits'], 1)
+
+    def test_deleted_token_is_rejected(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.token.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_deactivated_user_is_rejected(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_change_made_without_signals_applies_once_tokens_are_forgotten(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        # As another process would see a change there: through the version
+        # in the shared cache, not through this process's signals.
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        forget_tokens()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_login_keeps_the_cache(self):
+        self.user.set_password('secret')
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertTrue(APIClient().login(username='agent', password='secret'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_cache_stats_are_for_staff(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+        self.assertEqual(self.client.get('/api/stats/caches/').status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/api/stats/caches/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['tokens']['hits'], response.data['tokens']['misses']), (2, 2))
+        self.assertIn('hit_ratio', response.data['pricing'])
+
+
+class StubSession:
+    """
+    Stands in for the sender's `requests.Session`: records each POST, takes
+    `delays[host]` seconds over those to a host and fails those to `failing`
+    hosts, and keeps the most requests that were in flight to each host.
+    """
+
+    def __init__(self):
+        self.posts = []
+        self.failing = set()
+        self.delays = {}
+        self.in_flight = defaultdict(int)
+        self.most_in_flight = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def post(self, url, data, headers, timeout):
+        host = urlsplit(url).netloc
+        with self.lock:
+            self.posts.append((url, json.loads(data)))
+            self.in_flight[host] += 1
+            self.most_in_flight[host] = max(self.most_in_flight[host], self.in_flight[host])
+        try:
+            time.sleep(self.delays.get(host, 0))
+        finally:
+            with self.lock:
+                self.in_flight[host] -= 1
+        if host in self.failing:
+            raise requests.ConnectionError('Connection refused')
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        return response
+
+    def close(self):
+        pass
+
+
+class WebhookTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.session = StubSession()
+        self.sender = WebhookSender(workers=4, host_concurrency=2, breaker=CircuitBreaker(threshold=100))
+        self.sender.session = self.session
+        self.addCleanup(self.sender.close)
+
+    def subscribe(self, target_url, event='booking_created', **fields):
+        return WebhookSubscription.objects.create(user=self.user, event=event, target_url=target_url, **fields)
+
+    def make_due(self):
+        WebhookDelivery.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1), locked_by='')
+
+
+class OutboxTests(WebhookTestCase):
+    def test_claimed_events_are_not_claimed_again_before_the_lease_ends(self):
+        self.subscribe('http://up.example/hook')
+        for pk in range(3):
+            send_webhook('booking_created', {'id': pk})
+
+        claimed = claim_events('worker-a', limit=2)
+        self.assertEqual([event.payload['id'] for event in claimed], [0, 1])
+        self.assertEqual([event.payload['id'] for event in claim_events('worker-b')], [2])
+        self.assertEqual(claim_events('worker-c'), [])
+
+        # A worker that died holding events loses them once its lease runs out.
+        OutboxEvent.objects.filter(locked_by='worker-a').update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual([event.payload['id'] for event in claim_events('worker-c')], [0, 1])
+
+    def test_dispatch_sends_and_deletes_events_in_order(self):
+        self.subscribe('http://up.example/hook')
+        for pk in range(3):
+            send_webhook('booking_created', {'id': pk})
+        self.assertEqual(dispatch_events('worker', self.sender), 3)
+        self.assertEqual([body['payload']['id'] for url, body in self.session.posts], [0, 1, 2])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def slow_dispatch(self, seconds_per_event):
+        """Dispatch the queued events as worker-a, each taking `seconds_per_event`, while worker-b tries to claim them after each one."""
+        clock = [timezone.now()]
+        delivered = []
+        claimed = []
+
+        def deliver(event, payload, sender):
+            clock[0] += timedelta(seconds=seconds_per_event)
+            delivered.append(payload['id'])
+            claimed.extend(event.payload['id'] for event in claim_events('worker-b'))
+
+        with mock.patch('api.webhooks.deliver_webhook', deliver), mock.patch('django.utils.timezone.now', lambda: clock[0]):
+            sent = dispatch_events('worker-a', self.sender)
+        return sent, delivered, claimed
+
+    def test_lease_is_renewed_through_a_slow_batch(self):
+        self.subscribe('http://up.example/hook')
+        for pk in range(3):
+            send_webhook('booking_created', {'id': pk})
+        # The batch takes twice the lease, but each event well within it.
+        sent, delivered, claimed = self.slow_dispatch(WORKER_LEASE * 2 // 3)
+        self.assertEqual((sent, delivered, claimed), (3, [0, 1, 2], []))
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_batch_stops_once_another_worker_takes_it_over(self):
+        self.subscribe('http://up.example/hook')
+        for pk in range(3):
+            send_webhook('booking_created', {'id': pk})
+        # The first event outlasts the lease, so worker-b claims the batch
+        # and worker-a leaves the rest to it.
+        sent, delivered, claimed = self.slow_dispatch(WORKER_LEASE + 1)
+        self.assertEqual((sent, delivered), (1, [0]))
+        self.assertEqual(claimed, [0, 1, 2])
+        self.assertEqual(set(OutboxEvent.objects.values_list('locked_by', flat=True)), {'worker-b'})
+
+    def test_rolled_back_changes_queue_nothing(self):
+        self.subscribe('http://up.example/hook')
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Booking(
+                property=self.properties[0], guest=self.guest, num_guests=1,
+                check_in_date=date(2031, 1, 1), check_out_date=date(2031, 1, 3)
+            ).save()
+            self.assertEqual(OutboxEvent.objects.count(), 1)
+            raise RuntimeError
+        self.assertFalse(OutboxEvent.objects.exists())
+
+
+class SubscriptionRegistryTests(WebhookTestCase):
+    def book(self, day):
+        booking = Booking(
+            property=self.properties[0], guest=self.guest, num_guests=1,
+            check_in_date=date(2031, 1, day), check_out_date=date(2031, 1, day + 2)
+        )
+        with mock.patch('bookings.signals.BookingSerializer', wraps=BookingSerializer) as serializer:
+            booking.save()
+        return serializer.call_count
+
+    def test_events_nobody_subscribes_to_are_neither_serialized_nor_queued(self):
+        self.subscribe('http://up.example/hook', event='booking_cancelled')
+        self.assertEqual(self.book(1), 0)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+        subscription = self.subscribe('http://up.example/hook')
+        self.assertEqual(self.book(5), 1)
+        self.assertEqual(OutboxEvent.objects.get().event, 'booking_created')
+
+        subscription.is_active = False
+        subscription.save()
+        self.assertEqual(self.book(10), 0)
+        self.assertEqual(OutboxEvent.objects.count(), 1)
+
+
+class WebhookSenderTests(WebhookTestCase):
+    def test_failing_host_does_not_hold_up_others(self):
+        self.session.failing.add('down.example')
+        self.session.delays['down.example'] = 0.2
+        deliveries = [(f'http://down.example/{index}', b'{}') for index in range(6)]
+        deliveries += [(f'http://up{index}.example/', b'{}') for index in range(6)]
+
+        started = time.perf_counter()
+        errors = self.sender.send(deliveries)
+        # Six slow requests, two at a time, while the other hosts use the rest of the workers.
+        self.assertLess(time.perf_counter() - started, 0.2 * 6)
+        self.assertTrue(all(errors[:6]))
+        self.assertEqual(errors[6:], [None] * 6)
+        self.assertEqual(self.session.most_in_flight['down.example'], 2)
+
+    def test_event_goes_to_every_subscriber(self):
+        for index in range(5):
+            self.subscribe(f'http://hooks{index % 2}.example/{index}')
+        self.subscribe('http://hooks0.example/other', event='booking_updated')
+        send_webhook_notification('booking_created', {'id': 1}, self.sender)
+        self.assertEqual(sorted(url for url, body in self.session.posts), sorted(f'http://hooks{index % 2}.example/{index}' for index in range(5)))
+        self.assertEqual({json.dumps(body) for url, body in self.session.posts}, {json.dumps({'event': 'booking_created', 'payload': {'id': 1}})})
+
+
+class WebhookBatchTests(WebhookTestCase):
+    def test_coalesce_keeps_the_latest_state_of_each_object(self):
+        deliveries = [
+            WebhookDelivery(event='booking_updated', payload={'id': 1, 'status': 'pending'}),
+            WebhookDelivery(event='booking_updated', payload={'id': 2, 'status': 'pending'}),
+            WebhookDelivery(event='booking_cancelled', payload={'id': 1, 'status': 'cancelled'}),
+            WebhookDelivery(event='booking_updated', payload={'id': 1, 'status': 'confirmed'}),
+            WebhookDelivery(event='bookings_imported', payload=[1, 2]),
+        ]
+        self.assertEqual(coalesce(deliveries), [
+            {'event': 'booking_updated', 'payload': {'id': 2, 'status': 'pending'}},
+            {'event': 'booking_cancelled', 'payload': {'id': 1, 'status': 'cancelled'}},
+            {'event': 'booking_updated', 'payload': {'id': 1, 'status': 'confirmed'}},
+            {'event': 'bookings_imported', 'payload': [1, 2]},
+        ])
+
+    def test_events_are_sent_together_once_the_window_passes(self):
+        self.subscribe('http://up.example/hook', event='booking_updated', batch_window=60)
+        for status in ('pending', 'confirmed'):
+            send_webhook_notification('booking_updated', {'id': 1, 'status': status}, self.sender)
+        send_webhook_notification('booking_updated', {'id': 2, 'status': 'pending'}, self.sender)
+        self.assertEqual(dispatch_retries('worker', self.sender), 0)
+
+        self.make_due()
+        self.assertEqual(dispatch_retries('worker', self.sender), 1)
+        self.assertEqual(self.session.posts, [('http://up.example/hook', [
+            {'event': 'booking_updated', 'payload': {'id': 1, 'status': 'confirmed'}},
+            {'event': 'booking_updated', 'payload': {'id': 2, 'status': 'pending'}},
+        ])])
+        self.assertFalse(WebhookDelivery.objects.exists())
+
+    def test_full_batches_go_before_the_window_passes(self):
+        self.subscribe('http://up.example/hook', event='booking_updated', batch_window=3600, batch_size=3)
+        for pk in range(7):
+            send_webhook_notification('booking_updated', {'id': pk}, self.sender)
+        dispatch_retries('worker', self.sender)
+        dispatch_retries('worker', self.sender)
+        self.assertEqual(
+            [[item['payload']['id'] for item in body] for url, body in self.session.posts],
+            [[0, 1, 2], [3, 4, 5]]
+        )
+        self.assertEqual(WebhookDelivery.objects.count(), 1)
+
+
+class WebhookRetryTests(WebhookTestCase):
+    def test_failed_delivery_is_retried_with_backoff(self):
+        subscription = self.subscribe('http://down.example/hook')
+        self.session.failing.add('down.example')
+        started = timezone.now()
+        send_webhook_notification('booking_created', {'id': 1}, self.sender)
+
+        delivery = WebhookDelivery.objects.get()
+        self.assertEqual(delivery.attempts, 1)
+        # RETRY_BASE_DELAY (10s) with up to half of it as jitter either way.
+        self.assertTrue(started + timedelta(seconds=5) <= delivery.next_attempt_at <= timezone.now() + timedelta(seconds=15))
+        self.assertEqual(dispatch_retries('worker', self.sender), 0)
+
+        # Later events wait behind it, so the subscriber gets them in order.
+        send_webhook_notification('booking_created', {'id': 2}, self.sender)
+        self.assertEqual(len(self.session.posts), 1)
+
+        self.make_due()
+        started = timezone.now()
+        self.assertEqual(dispatch_retries('worker', self.sender), 1)
+        delivery = WebhookDelivery.objects.order_by('pk').first()
+        self.assertEqual(delivery.attempts, 2)
+        self.assertTrue(started + timedelta(seconds=10) <= delivery.next_attempt_at <= timezone.now() + timedelta(seconds=30))
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.consecutive_failures, 2)
+
+        self.session.failing.clear()
+        self.make_due()
+        dispatch_retries('worker', self.sender)
+        self.make_due()
+        dispatch_retries('worker', self.sender)
+        self.assertEqual([body['payload']['id'] for url, body in self.session.posts[-2:]], [1, 2])
+        self.assertFalse(WebhookDelivery.objects.exists())
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.consecutive_failures, 0)
+
+    def test_subscription_is_disabled_when_its_failure_budget_is_spent(self):
+        subscription = self.subscribe('http://down.example/hook')
+        self.session.failing.add('down.example')
+        with mock.patch('api.webhooks.FAILURE_BUDGET', 3):
+            send_webhook_notification('booking_created', {'id': 1}, self.sender)
+            send_webhook_notification('booking_created', {'id': 2}, self.sender)
+            for attempt in range(2):
+                self.make_due()
+                dispatch_retries('worker', self.sender)
+
+        subscription.refresh_from_db()
+        self.assertFalse(subscription.is_active)
+        self.assertIsNotNone(subscription.disabled_at)
+        self.assertFalse(WebhookDelivery.objects.exists())
+        # Nothing more is sent to it.
+        send_webhook_notification('booking_created', {'id': 3}, self.sender)
+        self.assertEqual(len(self.session.posts), 3)
+
+    def test_turning_a_subscription_off_drops_its_waiting_deliveries(self):
+        subscription = self.subscribe('http://down.example/hook')
+        self.session.failing.add('down.example')
+        send_webhook_notification('booking_created', {'id': 1}, self.sender)
+        send_webhook_notification('booking_created', {'id': 2}, self.sender)
+        self.assertEqual(WebhookDelivery.objects.count(), 2)
+
+        url = f'/api/webhooks/{subscription.pk}/'
+        self.assertEqual(self.client.patch(url, {'is_active': False}, format='json').status_code, 200)
+        self.assertFalse(WebhookDelivery.objects.exists())
+
+        self.session.failing.clear()
+        self.assertEqual(self.client.patch(url, {'is_active': True}, format='json').status_code, 200)
+        self.make_due()
+        self.assertEqual(dispatch_retries('worker', self.sender), 0)
+        self.assertEqual(len(self.session.posts), 1)
+
+    def test_deliveries_skipped_by_an_open_circuit_are_not_attempts(self):
+        self.sender.breaker = CircuitBreaker(threshold=1, cooldown=60)
+        self.subscribe('http://down.example/a')
+        self.subscribe('http://down.example/b')
+        self.session.failing.add('down.example')
+        # One request goes out at a time to the host, so the first failure opens its circuit.
+        self.sender.host_concurrency = 1
+        send_webhook_notification('booking_created', {'id': 1}, self.sender)
+
+        self.assertEqual(len(self.session.posts), 1)
+        self.assertEqual(sorted(WebhookDelivery.objects.values_list('attempts', flat=True)), [0, 1])
+        skipped = WebhookDelivery.objects.get(attempts=0)
+        self.assertGreater(skipped.next_attempt_at, timezone.now() + timedelta(seconds=50))
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = 1000.0
+        patcher = mock.patch('api.webhooks.time.monotonic', side_effect=lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(threshold=2, cooldown=30)
+
+    def test_opens_after_threshold_failures(self):
+        self.breaker.record('a.example', failed=True)
+        self.assertTrue(self.breaker.allow('a.example'))
+        self.breaker.record('a.example', failed=True)
+        self.assertFalse(self.breaker.allow('a.example'))
+        self.assertEqual(self.breaker.retry_after('a.example'), 30)
+        # Other hosts are not affected.
+        self.assertTrue(self.breaker.allow('b.example'))
+
+    def test_success_resets_the_count(self):
+        self.breaker.record('a.example', failed=True)
+        self.breaker.record('a.example', failed=False)
+        self.breaker.record('a.example', failed=True)
+        self.assertTrue(self.breaker.allow('a.example'))
+
+    def test_half_open_probe(self):
+        self.breaker.record('a.example', failed=True)
+        self.breaker.record('a.example', failed=True)
+        self.clock += 30
+        # One probe at a time once the cooldown is over.
+        self.assertTrue(self.breaker.allow('a.example'))
+        self.assertFalse(self.breaker.allow('a.example'))
+
+        # A failed probe keeps it open for another cooldown.
+        self.breaker.record('a.example', failed=True)
+        self.assertFalse(self.breaker.allow('a.example'))
+        self.clock += 30
+        self.assertTrue(self.breaker.allow('a.example'))
+
+        # A successful one closes it.
+        self.breaker.record('a.example', failed=False)
+        self.assertTrue(self.breaker.allow('a.example'))
+        self.assertTrue(self.breaker.allow('a.example'))
+        self.assertEqual(self.breaker.retry_after('a.example'), 0)
@@ -1,11 +1,12 @@
 from django.urls import path
 from .views import (
     PropertyList, PropertyDetail, PropertyCreate, PropertyUpdate,
-    check_availability, search_properties, property_pricing,
-    BookingCreate, BookingDetail, BookingUpdate, cancel_booking,
+    check_availability, search_properties, property_pricing, property_calendar, property_ical, pricing_batch, cheapest_stays,
+    BookingCreate, BookingDetail, BookingUpdate, cancel_booking, import_bookings,
     get_owner_properties, owner_booking_overview,
-    WebhookSubscriptionList, WebhookSubscriptionDetail, WebhookEventsList
+    WebhookSubscriptionList, WebhookSubscriptionDetail, WebhookEventsList, cache_stats
 )
+from . import async_views
 from .auth import CustomAuthToken
 
 urlpatterns = [
@@ -17,12 +18,23 @@ urlpatterns = [
     path('properties/<int:pk>/check-availability/', check_availability, name='check-availability'),
     path('properties/search/', search_properties, name='search-properties'),
     path('properties/<int:pk>/pricing/', property_pricing, name='property-pricing'),
+    path('properties/<int:pk>/calendar/', property_calendar, name='property-calendar'),
+    path('properties/<int:pk>/calendar.ics', property_ical, name='property-ical'),
+    path('pricing/batch/', pricing_batch, name='pricing-batch'),
+    path('pricing/cheapest/', cheapest_stays, name='pricing-cheapest'),
+
+    # Async versions of the read-heavy views, for ASGI servers
+    path('async/properties/<int:pk>/check-availability/', async_views.check_availability, name='async-check-availability'),
+    path('async/properties/search/', async_views.search_properties, name='async-search-properties'),
+    path('async/properties/<int:pk>/pricing/', async_views.property_pricing, name='async-property-pricing'),
+    path('async/pricing/batch/', async_views.pricing_batch, name='async-pricing-batch'),
 
     # Booking-related URLs
     path('bookings/', BookingCreate.as_view(), name='booking-create'),
     path('bookings/<int:pk>/', BookingDetail.as_view(), name='booking-detail'),
     path('bookings/<int:pk>/update/', BookingUpdate.as_view(), name='booking-update'),
     path('bookings/<int:pk>/cancel/', cancel_booking, name='cancel-booking'),
+    path('bookings/import/', import_bookings, name='booking-import'),
 
     # Owner-related URLs
     path('owners/<int:owner_id>/properties/', get_owner_properties, name='owner-properties'),
@@ -31,6 +43,9 @@ urlpatterns = [
     # Authentication URL
     path('token/', CustomAuthToken.as_view(), name='api_token_auth'),
 
+    # Cache metrics of the serving process, for staff
+    path('stats/caches/', cache_stats, name='cache-stats'),
+
     # Webhook-related URLs
     path('webhooks/events/', WebhookEventsList.as_view(), name='webhook-events'),
     path('webhooks/', WebhookSubscriptionList.as_view(), name='webhook-list'),
@@ -1,40 +1,172 @@
+import csv
+import hashlib
+import time
 from rest_framework import generics, status, permissions
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import api_view, parser_classes, permission_classes
+from rest_framework.exceptions import APIException, ParseError, ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import Http404, HttpResponse, HttpResponseNotModified
 from django.shortcuts import get_object_or_404
-from datetime import datetime
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from properties.cache import (
+    AVAILABILITY_VERSION, PROPERTIES_VERSION, get_cache_stats, get_global_versions, get_property_bundle, get_property_version,
+    get_shared_cache
+)
 from properties.models import Property
+from properties.nightly_rates import nightly_total_subquery
 from bookings.models import Booking
+from bookings.availability import build_availability_calendar, filter_available, get_calendar_bookings
+from bookings.batch import quote_properties, quote_stays
+from bookings.flexible import find_cheapest_stays
+from bookings.ical import build_ics, get_export_bookings, is_valid_export_key
+from bookings.importer import import_bookings as run_booking_import
 from owners.models import Owner
+from .authentication import get_token_cache_stats
 from .models import WebhookSubscription
-from .serializers import PropertySerializer, BookingSerializer, WebhookSubscriptionSerializer
+from .pagination import StandardResultsSetPagination, get_paginator
+from .parsers import CSVParser, JSONLinesParser
+from .serializers import PropertySerializer, BookingSerializer, QuoteSerializer, RowSerializer, WebhookSubscriptionSerializer
 from django.db.models import Q
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.views import APIView
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 10
-    page_size_query_param = 'page_size'
-    max_page_size = 100
+MAX_BATCH_SIZE = 1000
+MAX_CALENDAR_DAYS = 731
+MAX_CHEAPEST_STAYS = 100
+RESPONSE_CACHE_TIMEOUT = getattr(settings, 'API_RESPONSE_CACHE_TIMEOUT', 60 * 60)
+
+def is_settled(last_modified):
+    """
+    Whether the second of a change at `last_modified` (Unix time) is over.
+    HTTP dates have one-second granularity: until then, another change can
+    come with the same Last-Modified.
+    """
+    return int(last_modified) < int(time.time())
+
+def get_validators(etag, last_modified=None):
+    """The ETag and, once its second is over, the Last-Modified of a response."""
+    headers = {'ETag': etag}
+    if last_modified and is_settled(last_modified):
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+def is_not_modified(request, etag, last_modified=None):
+    """
+    Whether the client's copy, per its conditional headers, is current.
+    If-None-Match wins when both are sent; If-Modified-Since alone cannot
+    tell that something was deleted, but clients that send it get our ETag
+    too. A change in the current second is never reported as unmodified.
+    """
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return etag in etags or '*' in etags
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return bool(
+        last_modified and if_modified_since and is_settled(last_modified)
+        and int(last_modified) <= if_modified_since
+    )
+
+class BadRequest(APIException):
+    """Invalid request parameters, answered with the API's usual `{"error": ...}` body."""
+    status_code = status.HTTP_400_BAD_REQUEST
+
+    def __init__(self, error):
+        self.detail = {"error": error}
+
+class CachedPage:
+    """
+    A list or search page in the shared cache. The page's ETag is derived
+    from its full URL and the global versions it depends on, so a client
+    polling an unchanged page gets a 304 without a single query, and the
+    first client after a change rebuilds the page for everyone.
+    """
+
+    def __init__(self, request, versions):
+        versions = get_global_versions(versions)
+        fingerprint = f"{sorted(versions.items())}:{request.accepted_media_type}:{request.build_absolute_uri()}"
+        self.key = f"api:response:{hashlib.md5(fingerprint.encode()).hexdigest()}"
+        last_modified = max(changed_at for token, changed_at in versions.values())
+        self.headers = get_validators(quote_etag(self.key.rsplit(':', 1)[1]), last_modified)
+        self.not_modified = is_not_modified(request, self.headers['ETag'], last_modified)
+
+    def get(self):
+        if self.not_modified:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=self.headers)
+        data = get_shared_cache().get(self.key)
+        return None if data is None else Response(data, headers=self.headers)
+
+    def set(self, response):
+        """Cache a built response, if it succeeded, and return it with the page's headers."""
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        get_shared_cache().set(self.key, response.data, RESPONSE_CACHE_TIMEOUT)
+        return Response(response.data, headers=self.headers)
+
+def cached_response(request, versions, build):
+    """Serve a page from the cache (see `CachedPage`), calling `build` for its response on a miss."""
+    page = CachedPage(request, versions)
+    response = page.get()
+    return response if response is not None else page.set(build())
+
+def get_requested_fields(request, *serializer_classes):
+    """The field names asked for with `?fields=a,b`, or None for all of them."""
+    fields = request.query_params.get('fields')
+    if not fields:
+        return None
+    fields = {name.strip() for name in fields.split(',') if name.strip()}
+    available = [name for serializer_class in serializer_classes for name in serializer_class().fields]
+    unknown = fields.difference(available)
+    if unknown:
+        raise ValidationError({'fields': f"Unknown fields: {', '.join(sorted(unknown))}. Choose from: {', '.join(available)}."})
+    return fields
+
+def paginate_rows(request, queryset, paginator, serializer_class, fields=None):
+    """
+    A page of `queryset` as `serializer_class` would serialize it, read with
+    `.values()` and converted by a `RowSerializer` instead of building and
+    serializing model instances.
+    """
+    rows = RowSerializer(serializer_class, fields)
+    columns = dict.fromkeys(rows.sources + getattr(paginator, 'keys', []))
+    result_page = paginator.paginate_queryset(queryset.values(*columns), request)
+    return paginator.get_paginated_response(rows.serialize(result_page))
 
 class PropertyList(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     queryset = Property.objects.all()
     serializer_class = PropertySerializer
-    pagination_class = StandardResultsSetPagination
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['bedrooms', 'bathrooms', 'max_occupancy']
     search_fields = ['name', 'address']
     ordering_fields = ['nightly_rate', 'date_added']
 
+    def list(self, request, *args, **kwargs):
+        fields = get_requested_fields(request, PropertySerializer)
+        return cached_response(request, [PROPERTIES_VERSION], lambda: paginate_rows(
+            request, self.filter_queryset(self.get_queryset()), get_paginator(request, ['id']), PropertySerializer, fields
+        ))
+
 class PropertyDetail(generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated]
     queryset = Property.objects.all()
     serializer_class = PropertySerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        property = self.get_object()
+        etag = quote_etag(hashlib.md5(f"{property.pk}:{property.updated_at.isoformat()}".encode()).hexdigest())
+        headers = get_validators(etag, property.updated_at.timestamp())
+        if is_not_modified(request, etag, property.updated_at.timestamp()):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(self.get_serializer(property).data, headers=headers)
+
 class PropertyCreate(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
     queryset = Property.objects.all()
@@ -48,86 +180,340 @@ class PropertyUpdate(generics.UpdateAPIView):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def check_availability(request, pk):
-    property = get_object_or_404(Property, pk=pk)
+    property = get_property_bundle(pk)
+    if property is None:
+        raise Http404
+    check_in_date, check_out_date = parse_availability_params(request)
+    return Response(check_booking_rules(property, check_in_date, check_out_date))
+
+def parse_availability_params(request):
     check_in = request.query_params.get('check_in')
     check_out = request.query_params.get('check_out')
 
     if not check_in or not check_out:
-        return Response({"error": "Please provide check_in and check_out dates"}, status=status.HTTP_400_BAD_REQUEST)
+        raise BadRequest("Please provide check_in and check_out dates")
 
     try:
-        check_in_date = datetime.strptime(check_in, "%Y-%m-%d").date()
-        check_out_date = datetime.strptime(check_out, "%Y-%m-%d").date()
+        return datetime.strptime(check_in, "%Y-%m-%d").date(), datetime.strptime(check_out, "%Y-%m-%d").date()
     except ValueError:
-        return Response({"error": "Invalid date format. Use YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+        raise BadRequest("Invalid date format. Use YYYY-MM-DD")
 
+def check_booking_rules(property, check_in_date, check_out_date):
     try:
         property.check_booking_rules(check_in_date, check_out_date)
-        return Response({"available": True})
+        return {"available": True}
     except Exception as e:
-        return Response({"available": False, "reason": str(e)})
+        return {"available": False, "reason": str(e)}
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def search_properties(request):
-    location = request.query_params.get('location')
-    min_bedrooms = request.query_params.get('min_bedrooms')
-    max_bedrooms = request.query_params.get('max_bedrooms')
-    min_price = request.query_params.get('min_price')
-    max_price = request.query_params.get('max_price')
+    # Searches with dates also depend on every booking and calendar block.
+    versions = [PROPERTIES_VERSION]
+    if request.query_params.get('check_in') or request.query_params.get('check_out'):
+        versions.append(AVAILABILITY_VERSION)
+    return cached_response(request, versions, lambda: find_properties(request))
 
-    queryset = Property.objects.all()
+class PropertySearch:
+    """
+    The checked parameters of a property search, and the steps that turn
+    them into a page of results. The queries are left to the caller, so the
+    sync and async views run the same search.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.fields = get_requested_fields(request, PropertySerializer, QuoteSerializer)
+        location = request.query_params.get('location')
+        min_bedrooms = request.query_params.get('min_bedrooms')
+        max_bedrooms = request.query_params.get('max_bedrooms')
+        min_price = request.query_params.get('min_price')
+        max_price = request.query_params.get('max_price')
+        check_in = request.query_params.get('check_in')
+        check_out = request.query_params.get('check_out')
+        guests = request.query_params.get('guests')
+        self.ordering = request.query_params.get('ordering')
+
+        queryset = Property.objects.all()
 
-    if location:
-        queryset = queryset.filter(Q(address__icontains=location) | Q(name__icontains=location))
-    if min_bedrooms:
-        queryset = queryset.filter(bedrooms__gte=min_bedrooms)
-    if max_bedrooms:
-        queryset = queryset.filter(bedrooms__lte=max_bedrooms)
-    if min_price:
-        queryset = queryset.filter(nightly_rate__gte=min_price)
-    if max_price:
-        queryset = queryset.filter(nightly_rate__lte=max_price)
-
-    paginator = StandardResultsSetPagination()
-    result_page = paginator.paginate_queryset(queryset, request)
-    serializer = PropertySerializer(result_page, many=True)
-    return paginator.get_paginated_response(serializer.data)
+        if location:
+            queryset = queryset.filter(Q(address__icontains=location) | Q(name__icontains=location))
+        if min_bedrooms:
+            queryset = queryset.filter(bedrooms__gte=min_bedrooms)
+        if max_bedrooms:
+            queryset = queryset.filter(bedrooms__lte=max_bedrooms)
+
+        self.paginator = StandardResultsSetPagination()
+        self.stay = None
+
+        if not check_in and not check_out:
+            if min_price:
+                queryset = queryset.filter(nightly_rate__gte=min_price)
+            if max_price:
+                queryset = queryset.filter(nightly_rate__lte=max_price)
+            self.queryset = queryset
+            return
+
+        # With dates, only properties that can take the stay are returned and
+        # the price filters and ordering apply to the price of the whole stay.
+        if not check_in or not check_out:
+            raise BadRequest("Please provide both check_in and check_out dates")
+
+        try:
+            check_in_date = datetime.strptime(check_in, "%Y-%m-%d").date()
+            check_out_date = datetime.strptime(check_out, "%Y-%m-%d").date()
+            num_guests = int(guests) if guests else None
+            self.min_total = Decimal(min_price) if min_price else None
+            self.max_total = Decimal(max_price) if max_price else None
+        except (ValueError, InvalidOperation):
+            raise BadRequest("Invalid search parameters. Use YYYY-MM-DD for dates, an integer for guests and numbers for prices")
+
+        if check_out_date <= check_in_date:
+            raise BadRequest("Check-out date must be after check-in date.")
+
+        self.stay = (check_in_date, check_out_date, num_guests or 1)
+        self.queryset = filter_available(queryset, check_in_date, check_out_date, num_guests).order_by('pk')
+
+    @property
+    def prices_page_only(self):
+        """Whether only the properties on the page need pricing, as no price filter or ordering applies."""
+        return self.min_total is None and self.max_total is None and self.ordering not in ('price', '-price')
+
+    def get_candidates(self):
+        # Every candidate has to be priced before filtering and sorting, so
+        # only load what pricing needs and fetch full rows for the page alone.
+        candidates = self.queryset.only('pk', 'nightly_rate')
+        if self.max_total is not None:
+            # Fees are never negative, so a stay whose stored nightly prices
+            # alone exceed the maximum can be dropped in the database.
+            candidates = candidates.annotate(
+                nightly_total=nightly_total_subquery(*self.stay[:2])
+            ).filter(Q(nightly_total__isnull=True) | Q(nightly_total__lte=self.max_total))
+        return candidates
+
+    def paginate_quotes(self, quotes):
+        quotes = [
+            quote for quote in quotes
+            if (self.min_total is None or quote.total_price >= self.min_total) and (self.max_total is None or quote.total_price <= self.max_total)
+        ]
+        if self.ordering in ('price', '-price'):
+            quotes.sort(key=lambda quote: quote.total_price, reverse=self.ordering == '-price')
+        return self.paginator.paginate_queryset(quotes, self.request)
+
+    def get_page_properties(self, quotes):
+        properties = Property.objects.in_bulk([quote.property.pk for quote in quotes])
+        return [properties[quote.property.pk] for quote in quotes]
+
+    def get_response(self, result_page, quotes):
+        data = PropertySerializer(result_page, many=True).data
+        for item, quote in zip(data, quotes):
+            item.update(QuoteSerializer(quote).data)
+        if self.fields is not None:
+            data = [{name: value for name, value in item.items() if name in self.fields} for item in data]
+        return self.paginator.get_paginated_response(data)
+
+def find_properties(request):
+    search = PropertySearch(request)
+    if search.stay is None:
+        return paginate_rows(request, search.queryset, search.paginator, PropertySerializer, search.fields)
+
+    if search.prices_page_only:
+        result_page = search.paginator.paginate_queryset(search.queryset, request)
+        quotes = quote_properties(result_page, *search.stay)
+    else:
+        quotes = search.paginate_quotes(quote_properties(search.get_candidates(), *search.stay))
+        result_page = search.get_page_properties(quotes)
+    return search.get_response(result_page, quotes)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def property_pricing(request, pk):
-    property = get_object_or_404(Property, pk=pk)
+    property = get_property_bundle(pk)
+    if property is None:
+        raise Http404
+    check_in_date, check_out_date, num_guests = parse_pricing_params(request)
+    return price_stay(Booking(property=property, check_in_date=check_in_date, check_out_date=check_out_date, num_guests=num_guests))
+
+def parse_pricing_params(request):
     check_in = request.query_params.get('check_in')
     check_out = request.query_params.get('check_out')
     guests = request.query_params.get('guests')
 
     if not check_in or not check_out or not guests:
-        return Response({"error": "Please provide check_in, check_out dates, and number of guests"}, status=status.HTTP_400_BAD_REQUEST)
+        raise BadRequest("Please provide check_in, check_out dates, and number of guests")
 
     try:
-        check_in_date = datetime.strptime(check_in, "%Y-%m-%d").date()
-        check_out_date = datetime.strptime(check_out, "%Y-%m-%d").date()
-        num_guests = int(guests)
+        return datetime.strptime(check_in, "%Y-%m-%d").date(), datetime.strptime(check_out, "%Y-%m-%d").date(), int(guests)
     except ValueError:
-        return Response({"error": "Invalid date format or number of guests. Use YYYY-MM-DD for dates and an integer for guests"}, status=status.HTTP_400_BAD_REQUEST)
+        raise BadRequest("Invalid date format or number of guests. Use YYYY-MM-DD for dates and an integer for guests")
 
+def price_stay(booking, **availability):
+    """The quote for an unsaved booking, or why it cannot be made. `availability` is passed on to `Booking.clean()`."""
     try:
-        booking = Booking(property=property, check_in_date=check_in_date, check_out_date=check_out_date, num_guests=num_guests)
-        booking.clean()  # This will calculate the price
-        return Response({
-            "total_price": booking.total_price,
-            "base_total": booking.base_total,
-            "fees_total": booking.fees_total
-        })
+        booking.clean(**availability)  # This will calculate the price
+        return Response(QuoteSerializer(booking.get_quote()).data)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def property_calendar(request, pk):
+    property = get_property_bundle(pk)
+    if property is None:
+        raise Http404
+    start = request.query_params.get('from')
+    end = request.query_params.get('to')
+
+    if not start or not end:
+        return Response({"error": "Please provide from and to dates"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        start_date = datetime.strptime(start, "%Y-%m-%d").date()
+        end_date = datetime.strptime(end, "%Y-%m-%d").date() + timedelta(days=1)
+    except ValueError:
+        return Response({"error": "Invalid date format. Use YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+
+    if end_date <= start_date:
+        return Response({"error": "The to date must not be before the from date"}, status=status.HTTP_400_BAD_REQUEST)
+    if (end_date - start_date).days > MAX_CALENDAR_DAYS:
+        return Response({"error": f"A calendar can cover at most {MAX_CALENDAR_DAYS} days"}, status=status.HTTP_400_BAD_REQUEST)
+
+    # The calendar only changes when the property, its rules or the bookings
+    # in the range change, so the ETag is derived from exactly those.
+    bookings = get_calendar_bookings(property, start_date, end_date)
+    fingerprint = f"{get_property_version(pk)}:{start_date}:{end_date}:{bookings}"
+    etag = quote_etag(hashlib.md5(fingerprint.encode()).hexdigest())
+
+    if is_not_modified(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+    return Response({
+        "property": property.pk,
+        "from": start_date,
+        "to": end_date - timedelta(days=1),
+        "nights": build_availability_calendar(property, start_date, end_date, bookings)
+    }, headers={'ETag': etag})
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def property_ical(request, pk):
+    # External calendars cannot send an API token, so the export also
+    # accepts the property's signed key (see `bookings.ical.get_export_key`).
+    if not request.user.is_authenticated and not is_valid_export_key(pk, request.query_params.get('key', '')):
+        return Response({"error": "Please authenticate or provide the calendar's key"}, status=status.HTTP_403_FORBIDDEN)
+    property = get_object_or_404(Property, pk=pk)
+
+    bookings, last_modified = get_export_bookings(property)
+    fingerprint = f"{property.name}:{[booking[:3] for booking in bookings]}"
+    etag = quote_etag(hashlib.md5(fingerprint.encode()).hexdigest())
+    headers = get_validators(etag, last_modified and last_modified.timestamp())
+
+    if is_not_modified(request, etag, last_modified and last_modified.timestamp()):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(build_ics(property, bookings), content_type='text/calendar; charset=utf-8')
+    for name, value in headers.items():
+        response[name] = value
+    return response
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def pricing_batch(request):
+    results, stays = parse_batch(request)
+    return Response(add_batch_quotes(results, quote_stays(stays)))
+
+def parse_batch(request):
+    """A result dict per item of a pricing batch, and the stays of the valid ones as `quote_stays()` takes them."""
+    items = request.data
+    if not isinstance(items, list) or not items:
+        raise BadRequest("Please provide a list of stays with property, check_in, check_out and guests")
+    if len(items) > MAX_BATCH_SIZE:
+        raise BadRequest(f"A batch can contain at most {MAX_BATCH_SIZE} stays")
+
+    stays = []
+    results = []
+    for item in items:
+        result = {key: item.get(key) for key in ('property', 'check_in', 'check_out', 'guests')} if isinstance(item, dict) else {}
+        results.append(result)
+        try:
+            stays.append((
+                int(result['property']),
+                datetime.strptime(result['check_in'], "%Y-%m-%d").date(),
+                datetime.strptime(result['check_out'], "%Y-%m-%d").date(),
+                int(result['guests'])
+            ))
+        except (KeyError, TypeError, ValueError):
+            result['error'] = "Invalid stay. Provide property, check_in and check_out as YYYY-MM-DD, and an integer number of guests"
+    return results, stays
+
+def add_batch_quotes(results, quoted):
+    valid_results = [result for result in results if 'error' not in result]
+    for result, (quote, error) in zip(valid_results, quoted):
+        if error:
+            result['error'] = error
+        else:
+            result.update(QuoteSerializer(quote).data)
+    return results
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def cheapest_stays(request):
+    properties = request.query_params.get('properties')
+    owner = request.query_params.get('owner')
+    start = request.query_params.get('from')
+    end = request.query_params.get('to')
+    nights = request.query_params.get('nights')
+
+    if not (properties or owner) or not start or not end or not nights:
+        return Response({"error": "Please provide properties or owner, from and to dates, and nights"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        start_date = datetime.strptime(start, "%Y-%m-%d").date()
+        end_date = datetime.strptime(end, "%Y-%m-%d").date() + timedelta(days=1)
+        num_nights = int(nights)
+        num_guests = int(request.query_params.get('guests', 1))
+        limit = int(request.query_params.get('limit', 10))
+        property_ids = [int(pk) for pk in properties.split(',')] if properties else []
+        owner_id = int(owner) if owner else None
+    except ValueError:
+        return Response({"error": "Invalid parameters. Use YYYY-MM-DD for dates, a comma-separated list of ids for properties and integers for owner, nights, guests and limit"}, status=status.HTTP_400_BAD_REQUEST)
+
+    if end_date <= start_date:
+        return Response({"error": "The to date must not be before the from date"}, status=status.HTTP_400_BAD_REQUEST)
+    if (end_date - start_date).days > MAX_CALENDAR_DAYS:
+        return Response({"error": f"A search can cover at most {MAX_CALENDAR_DAYS} days"}, status=status.HTTP_400_BAD_REQUEST)
+    if num_nights < 1 or num_guests < 1 or not 1 <= limit <= MAX_CHEAPEST_STAYS:
+        return Response({"error": f"nights and guests must be at least 1, and limit between 1 and {MAX_CHEAPEST_STAYS}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    if owner_id is not None:
+        property_ids += Property.objects.filter(owner_id=owner_id).values_list('pk', flat=True)
+    if len(property_ids) > MAX_BATCH_SIZE:
+        return Response({"error": f"A search can cover at most {MAX_BATCH_SIZE} properties"}, status=status.HTTP_400_BAD_REQUEST)
+
+    results = []
+    for quote in find_cheapest_stays(set(property_ids), start_date, end_date, num_nights, num_guests, limit):
+        result = {
+            "property": quote.property.pk,
+            "check_in": quote.check_in_date,
+            "check_out": quote.check_out_date,
+        }
+        result.update(QuoteSerializer(quote).data)
+        results.append(result)
+    return Response(results)
+
 class BookingCreate(generics.CreateAPIView):
     queryset = Booking.objects.all()
     serializer_class = BookingSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def perform_create(self, serializer):
+        # The model validates availability while holding the property's
+        # lock, so a booking that lost a race is reported like any other.
+        try:
+            serializer.save()
+        except DjangoValidationError as e:
+            raise ValidationError({"error": e.messages})
+
 class BookingDetail(generics.RetrieveAPIView):
     queryset = Booking.objects.all()
     serializer_class = BookingSerializer
@@ -138,6 +524,30 @@ class BookingUpdate(generics.UpdateAPIView):
     serializer_class = BookingSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def perform_update(self, serializer):
+        try:
+            serializer.save()
+        except DjangoValidationError as e:
+            raise ValidationError({"error": e.messages})
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([JSONParser, CSVParser, JSONLinesParser])
+def import_bookings(request):
+    # CSV and JSON Lines bodies arrive as a lazy iterator of rows and are
+    # imported while they are read; JSON bodies must be a list of rows.
+    rows = request.data
+    if isinstance(rows, (dict, str)) or not hasattr(rows, '__iter__'):
+        return Response({"error": "Please provide a list of bookings as JSON, JSON Lines or CSV"}, status=status.HTTP_400_BAD_REQUEST)
+
+    rejects = []
+    try:
+        summary = run_booking_import(rows, on_reject=rejects.append)
+    except (csv.Error, UnicodeDecodeError) as e:
+        # Chunks read before the bad input stay imported.
+        raise ParseError(f"Could not read the bookings: {e}")
+    return Response({**summary, "rejects": rejects})
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def cancel_booking(request, pk):
@@ -152,24 +562,29 @@ def cancel_booking(request, pk):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_owner_properties(request, owner_id):
-    owner = get_object_or_404(Owner, pk=owner_id)
-    properties = Property.objects.filter(owner=owner)
-    paginator = StandardResultsSetPagination()
-    result_page = paginator.paginate_queryset(properties, request)
-    serializer = PropertySerializer(result_page, many=True)
-    return paginator.get_paginated_response(serializer.data)
+    fields = get_requested_fields(request, PropertySerializer)
+
+    def build():
+        owner = get_object_or_404(Owner, pk=owner_id)
+        properties = Property.objects.filter(owner=owner)
+        return paginate_rows(request, properties, get_paginator(request, ['id']), PropertySerializer, fields)
+    return cached_response(request, [PROPERTIES_VERSION], build)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def owner_booking_overview(request, owner_id):
+    fields = get_requested_fields(request, BookingSerializer)
     owner = get_object_or_404(Owner, pk=owner_id)
     properties = Property.objects.filter(owner=owner)
     bookings = Booking.objects.filter(property__in=properties).order_by('check_in_date')
     
-    paginator = StandardResultsSetPagination()
-    result_page = paginator.paginate_queryset(bookings, request)
-    serializer = BookingSerializer(result_page, many=True)
-    return paginator.get_paginated_response(serializer.data)
+    return paginate_rows(request, bookings, get_paginator(request, ['check_in_date', 'id']), BookingSerializer, fields)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def cache_stats(request):
+    # Per process: each server process has its own in-memory caches.
+    return Response({'pricing': get_cache_stats(), 'tokens': get_token_cache_stats()})
 
 class WebhookEventsList(APIView):
     permission_classes = [IsAuthenticated]
@@ -1,43 +1,417 @@
+import json
 import logging
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
 from django.conf import settings
-from .models import WebhookSubscription
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from properties.cache import get_global_versions
+from .models import OutboxEvent, WebhookDelivery, WebhookSubscription
 
 logger = logging.getLogger(__name__)
 
-def send_webhook_notification(event, payload):
-    try:
-        import requests
-    except ImportError:
-        logger.error("Requests library is not installed. Unable to send webhook notifications.")
+WORKER_BATCH_SIZE = getattr(settings, 'WEBHOOK_WORKER_BATCH_SIZE', 100)
+WORKER_POLL_INTERVAL = getattr(settings, 'WEBHOOK_WORKER_POLL_INTERVAL', 1.0)  # seconds
+# How long a worker has to send the events it claims before another worker may take them over.
+WORKER_LEASE = getattr(settings, 'WEBHOOK_WORKER_LEASE', 5 * 60)  # seconds
+DELIVERY_WORKERS = getattr(settings, 'WEBHOOK_DELIVERY_WORKERS', 64)
+HOST_CONCURRENCY = getattr(settings, 'WEBHOOK_HOST_CONCURRENCY', 8)
+DELIVERY_TIMEOUT = getattr(settings, 'WEBHOOK_TIMEOUT', 5)  # seconds
+# Failed deliveries are retried after RETRY_BASE_DELAY seconds, doubling per attempt up to RETRY_MAX_DELAY.
+RETRY_BASE_DELAY = getattr(settings, 'WEBHOOK_RETRY_BASE_DELAY', 10)
+RETRY_MAX_DELAY = getattr(settings, 'WEBHOOK_RETRY_MAX_DELAY', 60 * 60)
+# Failed attempts in a row after which a subscription is disabled.
+FAILURE_BUDGET = getattr(settings, 'WEBHOOK_FAILURE_BUDGET', 10)
+# Failures in a row after which a host is left alone for CIRCUIT_COOLDOWN seconds.
+CIRCUIT_THRESHOLD = getattr(settings, 'WEBHOOK_CIRCUIT_THRESHOLD', 5)
+CIRCUIT_COOLDOWN = getattr(settings, 'WEBHOOK_CIRCUIT_COOLDOWN', 60)
+REGISTRY_TIMEOUT = getattr(settings, 'WEBHOOK_REGISTRY_TIMEOUT', 60)  # seconds
+
+# Bumped whenever a subscription is saved or deleted.
+WEBHOOKS_VERSION = 'webhooks'
+
+# What `WebhookSender.send()` returns for a request it did not make because the host's circuit is open.
+CIRCUIT_OPEN = object()
+
+
+class SubscriptionRegistry:
+    """
+    The events that have at least one active subscription, loaded once per
+    version of the subscriptions. Saving or deleting a subscription bumps
+    the version; as a process only sees the bumps of others through a
+    shared cache, the events are also reloaded every WEBHOOK_REGISTRY_TIMEOUT
+    seconds.
+    """
+
+    def __init__(self, timeout=REGISTRY_TIMEOUT):
+        self.timeout = timeout
+        self.state = (None, frozenset(), 0)
+
+    def has_subscribers(self, event):
+        version = get_global_versions([WEBHOOKS_VERSION])[WEBHOOKS_VERSION]
+        loaded_version, events, loaded_at = self.state
+        if version != loaded_version or time.monotonic() - loaded_at > self.timeout:
+            events = frozenset(WebhookSubscription.objects.filter(is_active=True).values_list('event', flat=True).distinct())
+            self.state = (version, events, time.monotonic())
+        return event in events
+
+
+registry = SubscriptionRegistry()
+
+
+def send_webhook(event, payload):
+    """
+    Queue `event` for the webhook worker (`manage.py run_webhook_worker`).
+    The event is written in the caller's transaction, so it is only sent
+    if that transaction commits, and the caller never waits for subscribers.
+    `payload` may be a function that builds it, which is only called if
+    the event has subscribers; otherwise nothing is written.
+    """
+    if not registry.has_subscribers(event):
         return
+    OutboxEvent.objects.create(event=event, payload=payload() if callable(payload) else payload)
+
+
+class CircuitBreaker:
+    """
+    Circuits per host. After `threshold` failures in a row a host's circuit
+    opens and its requests are skipped. Once `cooldown` seconds have
+    passed, one request goes through as a probe: if it succeeds the
+    circuit closes, and if not it stays open for another `cooldown`.
+    """
 
-    subscriptions = WebhookSubscription.objects.filter(event=event, is_active=True)
-    
-    for subscription in subscriptions:
+    def __init__(self, threshold=CIRCUIT_THRESHOLD, cooldown=CIRCUIT_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = defaultdict(int)
+        self.open_until = {}
+        self.probing = set()
+        self.lock = threading.Lock()
+
+    def allow(self, host):
+        with self.lock:
+            open_until = self.open_until.get(host)
+            if open_until is None:
+                return True
+            if host in self.probing or time.monotonic() < open_until:
+                return False
+            self.probing.add(host)
+            return True
+
+    def record(self, host, failed):
+        with self.lock:
+            self.probing.discard(host)
+            if not failed:
+                self.failures.pop(host, None)
+                self.open_until.pop(host, None)
+                return
+            self.failures[host] += 1
+            if self.failures[host] >= self.threshold:
+                self.open_until[host] = time.monotonic() + self.cooldown
+
+    def retry_after(self, host):
+        """Seconds until a request to `host` may be tried again."""
+        with self.lock:
+            return max(self.open_until.get(host, 0) - time.monotonic(), 0)
+
+
+class WebhookSender:
+    """
+    Posts webhooks concurrently over keep-alive connections pooled per
+    host: up to `workers` requests at once, and at most `host_concurrency`
+    to any one host, so a slow host cannot take every worker. Sending one
+    event to many endpoints takes about as long as the slowest of them.
+    Hosts that keep failing are skipped by a `CircuitBreaker`.
+    """
+
+    def __init__(self, workers=DELIVERY_WORKERS, host_concurrency=HOST_CONCURRENCY, timeout=DELIVERY_TIMEOUT, breaker=None):
+        self.host_concurrency = host_concurrency
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=host_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='webhook')
+
+    def post(self, url, body):
+        """
+        POST `body` to `url`. Returns the error, or None once the endpoint has
+        accepted it, and whether the host is to blame: it timed out, refused
+        the connection or failed with a 5xx. Never raises.
+        """
         try:
-            response = requests.post(
-                subscription.target_url,
-                json={
-                    'event': event,
-                    'payload': payload
-                },
-                headers={'Content-Type': 'application/json'},
-                timeout=5
-            )
+            response = self.session.post(url, data=body, headers={'Content-Type': 'application/json'}, timeout=self.timeout)
             response.raise_for_status()
-            logger.info(f"Webhook sent successfully to {subscription.target_url} for event {event}")
+            return None, False
+        except requests.HTTPError as e:
+            return str(e), e.response.status_code >= 500
         except requests.RequestException as e:
-            logger.error(f"Failed to send webhook to {subscription.target_url} for event {event}: {str(e)}")
-            # Here you might want to implement some error handling,
-            # such as marking the subscription as inactive after multiple failures
+            return str(e), True
         except Exception as e:
-            logger.error(f"Unexpected error when sending webhook to {subscription.target_url} for event {event}: {str(e)}")
+            return f"Unexpected error: {e}", False
+
+    def send(self, deliveries):
+        """
+        POST each (url, body) in `deliveries`, and return their errors (None
+        for those that succeeded, CIRCUIT_OPEN for those not tried) in the
+        same order. A host's requests wait here, rather than in a worker
+        thread, while it is at its limit.
+        """
+        errors = [None] * len(deliveries)
+        queued = defaultdict(deque)
+        for index, (url, body) in enumerate(deliveries):
+            queued[urlsplit(url).netloc].append(index)
+        in_flight = defaultdict(int)
+        futures = {}
+
+        while queued or futures:
+            for host in list(queued):
+                while queued[host] and in_flight[host] < self.host_concurrency:
+                    index = queued[host].popleft()
+                    if not self.breaker.allow(host):
+                        errors[index] = CIRCUIT_OPEN
+                        continue
+                    futures[self.executor.submit(self.post, *deliveries[index])] = (index, host)
+                    in_flight[host] += 1
+                if not queued[host]:
+                    del queued[host]
+            if not futures:
+                break
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, host = futures.pop(future)
+                in_flight[host] -= 1
+                errors[index], host_failed = future.result()
+                self.breaker.record(host, host_failed)
+        return errors
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
-def mock_send_webhook_notification(event, payload):
+
+def send_webhook_notification(event, payload, sender):
+    """
+    Send an event to each of its active subscriptions at once, with
+    `sender`. Subscriptions with earlier events still waiting get it queued
+    behind those instead, so that they receive their events in order.
+    """
+    subscriptions = list(WebhookSubscription.objects.filter(event=event, is_active=True))
+    if not subscriptions:
+        return
+    waiting = set(WebhookDelivery.objects.filter(subscription__in=subscriptions).values_list('subscription_id', flat=True))
+    now = timezone.now()
+    # Subscriptions that batch their events collect it for their window.
+    WebhookDelivery.objects.bulk_create([
+        WebhookDelivery(
+            subscription=subscription, event=event, payload=payload,
+            next_attempt_at=now + timedelta(seconds=subscription.batch_window)
+        )
+        for subscription in subscriptions if subscription.pk in waiting or subscription.batch_window
+    ])
+
+    subscriptions = [subscription for subscription in subscriptions if subscription.pk not in waiting and not subscription.batch_window]
+    body = json.dumps({'event': event, 'payload': payload}, cls=DjangoJSONEncoder).encode()
+    errors = sender.send([(subscription.target_url, body) for subscription in subscriptions])
+    for subscription, error in zip(subscriptions, errors):
+        record_delivery(sender, subscription, error, WebhookDelivery(subscription=subscription, event=event, payload=payload))
+
+def coalesce(deliveries):
+    """
+    The {'event', 'payload'} items of a batch, in order, with repeated
+    events about the same object (the same event and payload id) collapsed
+    into the latest, which keeps its place.
+    """
+    def get_key(delivery):
+        if isinstance(delivery.payload, dict) and 'id' in delivery.payload:
+            return delivery.event, delivery.payload['id']
+        return None
+
+    latest = {get_key(delivery): delivery for delivery in deliveries}
+    return [
+        {'event': delivery.event, 'payload': delivery.payload}
+        for delivery in deliveries
+        if get_key(delivery) is None or latest[get_key(delivery)] is delivery
+    ]
+
+def record_delivery(sender, subscription, error, delivery, batch=()):
+    """
+    Record how sending `delivery` went, along with the rest of its `batch`
+    if it led one: delete them once sent; keep them for a retry with
+    exponential backoff and jitter if they failed, or for when the host's
+    circuit closes if they were not tried. A subscription that uses up
+    WEBHOOK_FAILURE_BUDGET failed attempts in a row is disabled.
+    """
+    url = subscription.target_url
+    sent = f"{1 + len(batch)} events" if batch else f"event {delivery.event}"
+    if error is None:
+        logger.info(f"Webhook sent successfully to {url} for {sent}")
+        if delivery.pk:
+            WebhookDelivery.objects.filter(pk__in=[delivery.pk] + [queued.pk for queued in batch]).delete()
+        if subscription.consecutive_failures:
+            WebhookSubscription.objects.filter(pk=subscription.pk).update(consecutive_failures=0, last_error='')
+        return
+
+    # The rest of a batch waits behind its first delivery, which carries the attempts.
+    now = timezone.now()
+    delivery.locked_by = ''
+    if error is CIRCUIT_OPEN:
+        delivery.next_attempt_at = now + timedelta(seconds=sender.breaker.retry_after(urlsplit(url).netloc))
+        delivery.save()
+        return
+
+    logger.error(f"Failed to send webhook to {url} for {sent}: {error}")
+    subscription.consecutive_failures += 1
+    subscription.last_error = error
+    if subscription.consecutive_failures >= FAILURE_BUDGET:
+        logger.error(f"Disabled the webhook to {url} for event {subscription.event} after {subscription.consecutive_failures} failures in a row")
+        subscription.is_active = False
+        subscription.disabled_at = now
+        # Saving it drops its waiting deliveries (see `api.signals`).
+        subscription.save(update_fields=['is_active', 'disabled_at', 'consecutive_failures', 'last_error', 'updated_at'])
+        return
+    WebhookSubscription.objects.filter(pk=subscription.pk).update(
+        consecutive_failures=subscription.consecutive_failures, last_error=error
+    )
+    delivery.attempts += 1
+    delivery.last_error = error
+    delay = min(RETRY_BASE_DELAY * 2 ** (delivery.attempts - 1), RETRY_MAX_DELAY)
+    delivery.next_attempt_at = now + timedelta(seconds=delay * random.uniform(0.5, 1.5))
+    delivery.save()
+
+def mock_send_webhook_notification(event, payload, sender):
     logger.info(f"Mock webhook notification: Event: {event}, Payload: {payload}")
 
 # Choose the appropriate function based on settings
 if getattr(settings, 'USE_MOCK_WEBHOOKS', False):
-    send_webhook = mock_send_webhook_notification
+    deliver_webhook = mock_send_webhook_notification
 else:
-    send_webhook = send_webhook_notification
\ No newline at end of file
+    deliver_webhook = send_webhook_notification
+
+
+def claim_events(worker_id, limit=WORKER_BATCH_SIZE):
+    """
+    The oldest `limit` queued events that no other worker holds, leased to
+    `worker_id` for `WEBHOOK_WORKER_LEASE` seconds. The lease is taken with
+    a conditional update rather than a lock, so no transaction stays open
+    while the events are sent.
+    """
+    now = timezone.now()
+    claimable = Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+    event_ids = list(OutboxEvent.objects.filter(claimable).order_by('pk').values_list('pk', flat=True)[:limit])
+    if not event_ids:
+        return []
+    OutboxEvent.objects.filter(claimable, pk__in=event_ids).update(
+        locked_until=now + timedelta(seconds=WORKER_LEASE),
+        locked_by=worker_id
+    )
+    return list(OutboxEvent.objects.filter(pk__in=event_ids, locked_by=worker_id).order_by('pk'))
+
+
+def dispatch_events(worker_id, sender, limit=WORKER_BATCH_SIZE):
+    """
+    Send a batch of queued events to their subscribers and return how many
+    were sent. Events go one after another, so subscribers get them in
+    order; each goes to all of its subscribers at once.
+    """
+    events = claim_events(worker_id, limit)
+    for index, outbox_event in enumerate(events):
+        # Each event can take up to WEBHOOK_TIMEOUT seconds, so a whole batch
+        # can outlast the lease: it is renewed on the rest of the batch before
+        # every event. If the lease lapsed and another worker has claimed
+        # some of them already, that worker sends them from here on.
+        if not renew_lease(worker_id, [event.pk for event in events[index:]]):
+            OutboxEvent.objects.filter(pk__in=[event.pk for event in events[index:]], locked_by=worker_id).update(locked_until=None)
+            return index
+        deliver_webhook(outbox_event.event, outbox_event.payload, sender)
+        # Deleted one by one, so a crash resends at most the event in flight.
+        OutboxEvent.objects.filter(pk=outbox_event.pk, locked_by=worker_id).delete()
+    return len(events)
+
+
+def renew_lease(worker_id, event_ids):
+    """Extend `worker_id`'s lease on `event_ids` by WEBHOOK_WORKER_LEASE seconds, and return whether it still held all of them."""
+    renewed = OutboxEvent.objects.filter(pk__in=event_ids, locked_by=worker_id).update(
+        locked_until=timezone.now() + timedelta(seconds=WORKER_LEASE)
+    )
+    return renewed == len(event_ids)
+
+
+def dispatch_retries(worker_id, sender, limit=WORKER_BATCH_SIZE):
+    """
+    Send the deliveries at the head of their subscription's queue that are
+    due, or that start a full batch, each claimed for WEBHOOK_WORKER_LEASE
+    seconds by moving its next attempt, and return how many were tried. A
+    batching subscription's head takes up to `batch_size` of the queued
+    deliveries behind it along in one request.
+    """
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=WORKER_LEASE)
+    queues = list(WebhookDelivery.objects.filter(subscription__is_active=True).values(
+        'subscription', 'subscription__batch_window', 'subscription__batch_size'
+    ).annotate(first=Min('pk'), queued=Count('pk')).order_by())
+    full = [
+        queue['first'] for queue in queues
+        if queue['subscription__batch_window'] and queue['queued'] >= queue['subscription__batch_size']
+    ]
+    claimable = Q(next_attempt_at__lte=now) | Q(pk__in=full, attempts=0, locked_by='')
+    delivery_ids = list(WebhookDelivery.objects.filter(
+        claimable, pk__in=[queue['first'] for queue in queues]
+    ).order_by('next_attempt_at').values_list('pk', flat=True)[:limit])
+    if not delivery_ids:
+        return 0
+    WebhookDelivery.objects.filter(claimable, pk__in=delivery_ids).update(next_attempt_at=lease_until, locked_by=worker_id)
+    deliveries = list(WebhookDelivery.objects.filter(
+        pk__in=delivery_ids, next_attempt_at=lease_until, locked_by=worker_id
+    ).select_related('subscription'))
+
+    batches = []
+    bodies = []
+    for delivery in deliveries:
+        subscription = delivery.subscription
+        if subscription.batch_window:
+            batch = list(subscription.deliveries.filter(pk__gt=delivery.pk).order_by('pk')[:subscription.batch_size - 1])
+            body = coalesce([delivery] + batch)
+        else:
+            batch = []
+            body = {'event': delivery.event, 'payload': delivery.payload}
+        batches.append(batch)
+        bodies.append((subscription.target_url, json.dumps(body, cls=DjangoJSONEncoder).encode()))
+
+    errors = sender.send(bodies)
+    for delivery, batch, error in zip(deliveries, batches, errors):
+        record_delivery(sender, delivery.subscription, error, delivery, batch)
+    return len(deliveries)
+
+
+def run_worker(poll_interval=WORKER_POLL_INTERVAL, batch_size=WORKER_BATCH_SIZE, once=False):
+    """Send queued events until interrupted, or until the queue is empty if `once`. Returns how many were sent."""
+    worker_id = uuid.uuid4().hex
+    sent = 0
+    with WebhookSender() as sender:
+        while True:
+            close_old_connections()
+            count = dispatch_events(worker_id, sender, batch_size)
+            retried = dispatch_retries(worker_id, sender, batch_size)
+            sent += count
+            if count < batch_size and not retried:
+                if once:
+                    return sent
+                time.sleep(poll_interval)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Booking
+from .models import Booking, CalendarBlock, CalendarFeed
 from django.utils.html import format_html
 from decimal import Decimal
 
@@ -14,20 +14,14 @@ class BookingAdmin(admin.ModelAdmin):
         if not obj.pk:  # If the object hasn't been saved yet
             return "Price breakdown will be available after saving."
 
-        breakdown = obj.calculate_price_breakdown()
+        quote = obj.get_quote()
+        breakdown = quote.breakdown
         if not breakdown:
             return "Unable to calculate price breakdown. Please ensure all required fields are filled."
 
         nights = len(breakdown)
-        incorporated_fees_total = Decimal('0.00')
-        incorporated_fees = []
-
-        # Calculate total incorporated fees and adjust nightly rates
-        for fee in obj.property.fees.all():
-            if fee.display_strategy == 'incorporated':
-                fee_amount = obj.calculate_fee_amount(fee)
-                incorporated_fees_total += fee_amount
-                incorporated_fees.append((fee.name, fee_amount))
+        incorporated_fees = [(fee.name, fee_amount) for fee, fee_amount in quote.incorporated_fees]
+        incorporated_fees_total = quote.incorporated_fees_total
 
         fee_per_night = incorporated_fees_total / nights if nights > 0 else Decimal('0.00')
 
@@ -41,8 +35,7 @@ class BookingAdmin(admin.ModelAdmin):
         
         # Add fee breakdown
         html += "<tr><td colspan='4'><strong>Fees:</strong></td></tr>"
-        for fee in obj.property.fees.all():
-            fee_amount = obj.calculate_fee_amount(fee)
+        for fee, fee_amount in quote.fees:
             if fee.display_strategy == 'incorporated':
                 html += f"<tr><td colspan='3'>{fee.name}</td><td>${fee_amount:.2f} (incorporated)</td></tr>"
             else:
@@ -89,4 +82,30 @@ class BookingAdmin(admin.ModelAdmin):
                     'fields': ['base_total', 'fees_total', 'total_price', 'price_breakdown'],
                 }),
             ]
-        return fieldsets
\ No newline at end of file
+        return fieldsets
+
+class CalendarBlockInline(admin.TabularInline):
+    model = CalendarBlock
+    fields = ('uid', 'start_date', 'end_date', 'summary')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+@admin.register(CalendarFeed)
+class CalendarFeedAdmin(admin.ModelAdmin):
+    list_display = ('property', 'name', 'url', 'is_active', 'last_synced_at', 'last_error')
+    list_filter = ('is_active',)
+    search_fields = ('property__name', 'name', 'url')
+    readonly_fields = ('last_synced_at', 'last_error')
+    inlines = [CalendarBlockInline]
+    actions = ['sync_now']
+
+    @admin.action(description="Sync selected calendars now")
+    def sync_now(self, request, queryset):
+        from .ical import sync_feeds
+        results = sync_feeds(queryset)
+        errors = sum(1 for result in results.values() if result['status'] == 'error')
+        self.message_user(request, f"Synced {len(results) - errors} calendars, {errors} failed.")
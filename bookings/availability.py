@@ -0,0 +1,103 @@
+from django.db.models import Exists, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from properties.models import BookingRule
+from .models import ACTIVE_STATUSES, Booking, CalendarBlock
+
+
+def filter_available(queryset, check_in_date, check_out_date, num_guests=None):
+    """
+    Narrow a Property queryset to the properties that can take a stay from
+    `check_in_date` to `check_out_date`, applying the same checks as
+    `Booking.clean` and `Property.check_booking_rules` in SQL. Calendar
+    blocks count as bookings.
+    """
+    nights = (check_out_date - check_in_date).days
+
+    active_bookings = Booking.objects.filter(property=OuterRef('pk'), status__in=ACTIVE_STATUSES)
+    overlapping = active_bookings.filter(
+        check_in_date__lt=check_out_date,
+        check_out_date__gt=check_in_date
+    )
+    # A short stay is a valid gap stay exactly when one booking ends on the
+    # check-in date and another starts on the check-out date.
+    ends_on_check_in = active_bookings.filter(check_out_date=check_in_date)
+    starts_on_check_out = active_bookings.filter(check_in_date=check_out_date)
+    blocks = CalendarBlock.objects.filter(property=OuterRef('pk'))
+    overlapping_block = blocks.filter(start_date__lt=check_out_date, end_date__gt=check_in_date)
+    block_ends_on_check_in = blocks.filter(end_date=check_in_date)
+    block_starts_on_check_out = blocks.filter(start_date=check_out_date)
+    rule_min_nights = BookingRule.objects.filter(
+        property=OuterRef('pk'),
+        start_date__lte=check_in_date,
+        end_date__gte=check_in_date
+    ).order_by('start_date', 'pk').values('min_nights')[:1]
+
+    queryset = queryset.exclude(
+        no_checkin_days__contains=str(check_in_date.weekday())
+    ).exclude(
+        no_checkout_days__contains=str(check_out_date.weekday())
+    ).annotate(
+        min_stay=Greatest('minimum_stay', Coalesce(Subquery(rule_min_nights), Value(0)))
+    ).filter(
+        ~Exists(overlapping) & ~Exists(overlapping_block)
+    ).filter(
+        Q(min_stay__lte=nights) | Q(allow_gap_stays=True)
+        & (Exists(ends_on_check_in) | Exists(block_ends_on_check_in))
+        & (Exists(starts_on_check_out) | Exists(block_starts_on_check_out))
+    )
+
+    if num_guests:
+        queryset = queryset.filter(max_occupancy__gte=num_guests)
+
+    return queryset
+
+
+def get_calendar_bookings(property, start_date, end_date):
+    """
+    The (check_in_date, check_out_date) of every active booking and calendar
+    block touching a night from `start_date` up to `end_date`, in date order.
+    """
+    bookings = Booking.objects.filter(
+        property=property,
+        status__in=ACTIVE_STATUSES,
+        check_in_date__lt=end_date,
+        check_out_date__gt=start_date
+    ).values_list('check_in_date', 'check_out_date')
+    blocks = CalendarBlock.objects.filter(
+        property=property,
+        start_date__lt=end_date,
+        end_date__gt=start_date
+    ).values_list('start_date', 'end_date')
+    return sorted(list(bookings) + list(blocks))
+
+
+def build_availability_calendar(property, start_date, end_date, bookings):
+    """
+    Night by night, from `start_date` up to `end_date`: the price and rule
+    applied, whether the night is booked, whether check-in and check-out are
+    allowed that day and the minimum stay for a check-in that day.
+    """
+    nights = (end_date - start_date).days
+
+    booked = [False] * nights
+    for check_in_date, check_out_date in bookings:
+        first = max((check_in_date - start_date).days, 0)
+        last = min((check_out_date - start_date).days, nights)
+        if first < last:
+            booked[first:last] = [True] * (last - first)
+
+    rule_min_nights = property.get_booking_rule_index().min_nights_for_range(start_date, end_date)
+
+    calendar = []
+    for index, day in enumerate(property.get_price_calendar().breakdown(start_date, end_date)):
+        weekday = str(day['date'].weekday())
+        calendar.append({
+            'date': day['date'],
+            'price': day['price'],
+            'rule_applied': day['rule_applied'],
+            'booked': booked[index],
+            'checkin_allowed': not booked[index] and weekday not in property.no_checkin_days,
+            'checkout_allowed': weekday not in property.no_checkout_days,
+            'min_stay': max(property.minimum_stay, rule_min_nights[index]),
+        })
+    return calendar
@@ -0,0 +1,234 @@
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections
+from django.db.models import QuerySet
+from properties.cache import get_property_bundles
+from properties.models import PricingRule, Fee
+from properties.nightly_rates import get_nightly_totals
+from properties.pricing import PriceCalendar
+from .models import ACTIVE_STATUSES, Booking, CalendarBlock
+from .occupancy import get_occupancies
+from .quote import Quote, get_quote
+
+# Threads, each with its own database connections, for the async views' queries.
+ASYNC_QUERY_WORKERS = getattr(settings, 'ASYNC_QUERY_WORKERS', 20)
+query_executor = ThreadPoolExecutor(max_workers=ASYNC_QUERY_WORKERS, thread_name_prefix='query')
+
+
+async def run_query(func, *args, **kwargs):
+    """
+    Run `func`, which reads from the database, in one of the query worker
+    threads. Django's async ORM runs all of a request's queries in the
+    request's single thread, one after another, so queries that do not
+    depend on each other only overlap when gathered through this. The
+    threads cannot see a transaction still open in the caller's.
+    """
+    return await sync_to_async(partial(call_in_worker, func, *args, **kwargs), thread_sensitive=False, executor=query_executor)()
+
+
+def call_in_worker(func, *args, **kwargs):
+    # No request starts or ends in these threads, so they close their
+    # connections as Django does around each request: those past
+    # CONN_MAX_AGE, which by default is every one, or that are broken.
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def get_window_stays(property_ids, start_date, end_date):
+    """The (property_id, check_in_date, check_out_date) of the active bookings touching a window."""
+    return list(Booking.objects.filter(
+        property_id__in=property_ids,
+        status__in=ACTIVE_STATUSES,
+        check_in_date__lte=end_date,
+        check_out_date__gte=start_date
+    ).values_list('property_id', 'check_in_date', 'check_out_date'))
+
+
+def get_window_blocks(property_ids, start_date, end_date):
+    """The (property_id, start_date, end_date) of the calendar blocks touching a window."""
+    return list(CalendarBlock.objects.filter(
+        property_id__in=property_ids,
+        start_date__lte=end_date,
+        end_date__gte=start_date
+    ).values_list('property_id', 'start_date', 'end_date'))
+
+
+def get_stay_windows(stays):
+    """
+    The windows `quote_stays` reads for a list of stays: the occupancy window,
+    a night wider on each side for the gap stay check, and the window of
+    bookings and blocks that covers the same checks without it.
+    """
+    first_check_in = min(stay[1] for stay in stays)
+    last_check_out = max(stay[2] for stay in stays)
+    return (first_check_in - timedelta(days=1), last_check_out + timedelta(days=1)), (first_check_in, last_check_out)
+
+
+def quote_stays(stays):
+    """
+    Price many stays with a fixed number of queries, or fewer when the
+    properties and quotes are already in the pricing cache.
+
+    `stays` is a list of (property_id, check_in_date, check_out_date, num_guests)
+    tuples. Returns a list of (quote, error) pairs in the same order, where
+    exactly one of the two is set.
+    """
+    if not stays:
+        return []
+
+    property_ids = {property_id for property_id, check_in_date, check_out_date, num_guests in stays}
+    properties = get_property_bundles(property_ids)
+
+    # The stored occupancy answers the overlap and gap stay checks with bit
+    # operations. Properties without it fall back to one window of bookings
+    # and calendar blocks that covers every overlap check as well as the
+    # stays that end on a check-in date or start on a check-out date.
+    (window_start, window_end), window = get_stay_windows(stays)
+    occupancies = get_occupancies(list(properties), window_start, window_end) if window_start < window_end else {}
+
+    unindexed_ids = [property_id for property_id in properties if property_id not in occupancies]
+    booked = get_window_stays(unindexed_ids, *window) + get_window_blocks(unindexed_ids, *window) if unindexed_ids else []
+    return check_and_quote_stays(stays, properties, occupancies, booked)
+
+
+async def aquote_stays(stays):
+    """`quote_stays()` for async views, with the independent queries run concurrently."""
+    if not stays:
+        return []
+
+    property_ids = {property_id for property_id, check_in_date, check_out_date, num_guests in stays}
+    (window_start, window_end), window = get_stay_windows(stays)
+
+    def load_occupancies():
+        return get_occupancies(list(property_ids), window_start, window_end) if window_start < window_end else {}
+    properties, occupancies = await asyncio.gather(run_query(get_property_bundles, property_ids), run_query(load_occupancies))
+
+    booked = []
+    unindexed_ids = [property_id for property_id in properties if property_id not in occupancies]
+    if unindexed_ids:
+        booked_stays, blocks = await asyncio.gather(
+            run_query(get_window_stays, unindexed_ids, *window),
+            run_query(get_window_blocks, unindexed_ids, *window)
+        )
+        booked = booked_stays + blocks
+    # Quotes can come from the shared cache, which is blocking I/O too.
+    return await run_query(check_and_quote_stays, stays, properties, occupancies, booked)
+
+
+def check_and_quote_stays(stays, properties, occupancies, booked):
+    """The (quote, error) of each stay, given everything `quote_stays` loads for them."""
+    stays_by_property = defaultdict(list)
+    for property_id, check_in_date, check_out_date in booked:
+        stays_by_property[property_id].append((check_in_date, check_out_date))
+
+    results = []
+    for property_id, check_in_date, check_out_date, num_guests in stays:
+        property = properties.get(property_id)
+        if property is None:
+            results.append((None, "Property not found."))
+            continue
+        if check_out_date <= check_in_date:
+            results.append((None, "Check-out date must be after check-in date."))
+            continue
+
+        booking = Booking(property=property, check_in_date=check_in_date, check_out_date=check_out_date, num_guests=num_guests)
+        try:
+            if property_id in occupancies:
+                booking.check_availability(occupancy=occupancies[property_id])
+            else:
+                booking.check_availability(stays=stays_by_property[property_id])
+        except ValidationError as e:
+            results.append((None, str(e)))
+            continue
+        results.append((get_quote(property, check_in_date, check_out_date, num_guests), None))
+
+    return results
+
+
+def get_pricing_rules(property_ids):
+    rules_by_property = defaultdict(list)
+    if property_ids:
+        for rule in PricingRule.objects.filter(property_id__in=property_ids):
+            rules_by_property[rule.property_id].append(rule)
+    return rules_by_property
+
+
+def get_fees(property_ids):
+    fees_by_property = defaultdict(list)
+    for fee in Fee.objects.filter(property_id__in=property_ids):
+        fees_by_property[fee.property_id].append(fee)
+    return fees_by_property
+
+
+def quote_properties(properties, check_in_date, check_out_date, num_guests):
+    """
+    Quote the same stay at every property in `properties`, loading their rules
+    and fees in bulk. Passing a queryset lets the rules and fees be selected
+    with a subquery, which is much cheaper than a long list of ids.
+    """
+    if isinstance(properties, QuerySet):
+        property_ids = properties.values('pk')
+        properties = list(properties)
+    else:
+        property_ids = [property.pk for property in properties]
+
+    # Stays covered by the stored nightly rates only need their sum; the
+    # rest are priced from their pricing rules.
+    nightly_totals = get_nightly_totals(property_ids, check_in_date, check_out_date)
+    unpriced_ids = property_ids
+    if nightly_totals:
+        unpriced_ids = [property.pk for property in properties if property.pk not in nightly_totals]
+
+    rules_by_property = get_pricing_rules(unpriced_ids)
+    fees_by_property = get_fees(property_ids)
+    return build_property_quotes(properties, check_in_date, check_out_date, num_guests, nightly_totals, rules_by_property, fees_by_property)
+
+
+async def aquote_properties(properties, check_in_date, check_out_date, num_guests):
+    """`quote_properties()` for async views: the properties, their nightly totals and their fees load concurrently."""
+    if isinstance(properties, QuerySet):
+        # A subquery each, as the threads must not share a queryset.
+        properties, nightly_totals, fees_by_property = await asyncio.gather(
+            run_query(list, properties),
+            run_query(get_nightly_totals, properties.values('pk'), check_in_date, check_out_date),
+            run_query(get_fees, properties.values('pk'))
+        )
+        unpriced_ids = [property.pk for property in properties if property.pk not in nightly_totals]
+    else:
+        property_ids = [property.pk for property in properties]
+        nightly_totals, fees_by_property = await asyncio.gather(
+            run_query(get_nightly_totals, property_ids, check_in_date, check_out_date),
+            run_query(get_fees, property_ids)
+        )
+        unpriced_ids = [property_id for property_id in property_ids if property_id not in nightly_totals]
+
+    rules_by_property = await run_query(get_pricing_rules, unpriced_ids) if unpriced_ids else defaultdict(list)
+    return build_property_quotes(properties, check_in_date, check_out_date, num_guests, nightly_totals, rules_by_property, fees_by_property)
+
+
+def build_property_quotes(properties, check_in_date, check_out_date, num_guests, nightly_totals, rules_by_property, fees_by_property):
+    quotes = []
+    for property in properties:
+        if property.pk in nightly_totals:
+            quote = Quote(
+                property, check_in_date, check_out_date, num_guests,
+                fees=fees_by_property[property.pk],
+                nightly_total=nightly_totals[property.pk]
+            )
+        else:
+            quote = Quote(
+                property, check_in_date, check_out_date, num_guests,
+                calendar=PriceCalendar(property.nightly_rate, rules_by_property[property.pk]),
+                fees=fees_by_property[property.pk]
+            )
+        quotes.append(quote)
+    return quotes
@@ -0,0 +1,111 @@
+import heapq
+from datetime import timedelta
+from itertools import accumulate
+from properties.cache import get_property_bundles
+from properties.pricing import from_cents
+from .models import ACTIVE_STATUSES, Booking, CalendarBlock
+from .occupancy import get_occupancies
+from .quote import Quote
+
+
+def get_booked_nights(property_ids, start_date, end_date):
+    """
+    Whether each night from `start_date` up to `end_date` is taken by a
+    booking or calendar block, as a list of booleans per property. Stored
+    occupancy is used where it covers the range, and one query each for
+    bookings and blocks fills in the rest.
+    """
+    nights = (end_date - start_date).days
+    booked = {}
+    for property_id, occupancy in get_occupancies(property_ids, start_date, end_date).items():
+        bits = occupancy.bits >> (start_date - occupancy.start_date).days
+        booked[property_id] = [bool(bits >> index & 1) for index in range(nights)]
+
+    unindexed_ids = [property_id for property_id in property_ids if property_id not in booked]
+    if unindexed_ids:
+        stays = list(Booking.objects.filter(
+            property_id__in=unindexed_ids,
+            status__in=ACTIVE_STATUSES,
+            check_in_date__lt=end_date,
+            check_out_date__gt=start_date
+        ).values_list('property_id', 'check_in_date', 'check_out_date'))
+        stays += CalendarBlock.objects.filter(
+            property_id__in=unindexed_ids,
+            start_date__lt=end_date,
+            end_date__gt=start_date
+        ).values_list('property_id', 'start_date', 'end_date')
+
+        for property_id in unindexed_ids:
+            booked[property_id] = [False] * nights
+        for property_id, check_in_date, check_out_date in stays:
+            first = max((check_in_date - start_date).days, 0)
+            last = min((check_out_date - start_date).days, nights)
+            booked[property_id][first:last] = [True] * (last - first)
+    return booked
+
+
+def find_stays(property, booked, start_date, end_date, nights):
+    """
+    Yield (nightly_total_cents, check_in_date) for every stay of `nights`
+    nights within the nights from `start_date` up to `end_date` that the
+    property can take. `booked` covers the night before `start_date` to the
+    night of `end_date`, for the gap stay check.
+
+    The nightly total slides along the window and the booked nights are
+    counted with a prefix sum, so the whole window costs O(days) however
+    long the stay or many the rules.
+    """
+    days = (end_date - start_date).days
+    if days < nights:
+        return
+
+    prices = property.get_price_calendar().nightly_cents(start_date, end_date)
+    booked_before = [0] + list(accumulate(booked))
+    last_check_in = end_date - timedelta(days=nights - 1)
+    min_nights = property.get_booking_rule_index().min_nights_for_range(start_date, last_check_in)
+    no_checkin_days = {int(day) for day in property.no_checkin_days}
+    no_checkout_days = {int(day) for day in property.no_checkout_days}
+
+    total = sum(prices[:nights])
+    for index in range(days - nights + 1):
+        if index:
+            total += prices[index + nights - 1] - prices[index - 1]
+        check_in_date = start_date + timedelta(days=index)
+        check_out_date = check_in_date + timedelta(days=nights)
+        if check_in_date.weekday() in no_checkin_days or check_out_date.weekday() in no_checkout_days:
+            continue
+        # booked[0] is the night before `start_date`.
+        if booked_before[index + 1 + nights] != booked_before[index + 1]:
+            continue
+        if nights < max(property.minimum_stay, min_nights[index]):
+            fills_gap = booked[index] and booked[index + 1 + nights]
+            if not (property.allow_gap_stays and fills_gap):
+                continue
+        yield total, check_in_date
+
+
+def find_cheapest_stays(property_ids, start_date, end_date, nights, num_guests=1, limit=10):
+    """
+    The `limit` cheapest stays of `nights` nights, check-out by `end_date`,
+    across the given properties, as quotes sorted by total price. Stays
+    follow the same rules as a booking: free nights, allowed check-in and
+    check-out days, and the minimum stay unless the stay fills a gap.
+    """
+    properties = get_property_bundles(property_ids)
+    booked = get_booked_nights(list(properties), start_date - timedelta(days=1), end_date + timedelta(days=1))
+
+    quotes = []
+    for property_id, property in properties.items():
+        if num_guests > property.max_occupancy:
+            continue
+        # Fees never fall as the nightly total rises, so a property's cheapest
+        # stays by nightly total are its cheapest by total price too, and only
+        # those need a full quote.
+        for nightly_total_cents, check_in_date in heapq.nsmallest(limit, find_stays(property, booked[property_id], start_date, end_date, nights)):
+            quotes.append(Quote(
+                property, check_in_date, check_in_date + timedelta(days=nights), num_guests,
+                fees=property.fees.all(), nightly_total=from_cents(nightly_total_cents)
+            ))
+
+    quotes.sort(key=lambda quote: (quote.total_price_cents, quote.check_in_date, quote.property.pk))
+    return quotes[:limit]
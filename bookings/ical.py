@@ -0,0 +1,282 @@
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta, timezone as dt_timezone
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.utils import timezone
+from properties.cache import AVAILABILITY_VERSION, bump_global_version
+from properties.models import Property
+from .models import ACTIVE_STATUSES, Booking, CalendarBlock
+from .occupancy import get_years, rebuild_occupancy
+
+SYNC_WORKERS = getattr(settings, 'ICAL_SYNC_WORKERS', 8)
+FETCH_TIMEOUT = getattr(settings, 'ICAL_FETCH_TIMEOUT', 10)  # seconds
+# Identifies the events of our own exports, so they are not imported back as blocks.
+UID_DOMAIN = getattr(settings, 'ICAL_UID_DOMAIN', 'propertymentor')
+PRODID = '-//PropertyMentor//Booking Calendar//EN'
+EXPORT_KEY_SALT = 'bookings.ical.export'
+
+
+# Export
+
+def get_export_key(property_id):
+    """The key that lets external calendars fetch a property's export without an API token."""
+    return signing.Signer(salt=EXPORT_KEY_SALT).sign(str(property_id)).split(':', 1)[1]
+
+
+def is_valid_export_key(property_id, key):
+    try:
+        return signing.Signer(salt=EXPORT_KEY_SALT).unsign(f'{property_id}:{key}') == str(property_id)
+    except signing.BadSignature:
+        return False
+
+
+def get_export_bookings(property):
+    """
+    The bookings of a property's exported calendar, those not checked out
+    yet, as (pk, check_in_date, check_out_date, updated_at), and when any
+    booking in that range last changed, cancelled ones included.
+    """
+    rows = Booking.objects.filter(
+        property=property,
+        check_out_date__gte=timezone.localdate()
+    ).order_by('check_in_date', 'pk').values_list('pk', 'check_in_date', 'check_out_date', 'updated_at', 'status')
+
+    bookings = []
+    last_modified = None
+    for pk, check_in_date, check_out_date, updated_at, status in rows:
+        last_modified = max(last_modified, updated_at) if last_modified else updated_at
+        if status in ACTIVE_STATUSES:
+            bookings.append((pk, check_in_date, check_out_date, updated_at))
+    return bookings, last_modified
+
+
+def escape_text(value):
+    return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def fold_line(line):
+    """Split a content line into lines of at most 75 octets, continued with a leading space."""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    while encoded:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(encoded))
+        # Never split a multi-byte character.
+        while cut < len(encoded) and encoded[cut] & 0xC0 == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+    return '\r\n '.join(parts)
+
+
+def build_ics(property, bookings):
+    """An iCalendar document with an all-day event per booking, without any guest details."""
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        f'PRODID:{PRODID}',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{escape_text(property.name)}',
+    ]
+    for pk, check_in_date, check_out_date, updated_at in bookings:
+        lines += [
+            'BEGIN:VEVENT',
+            f'UID:booking-{pk}@{UID_DOMAIN}',
+            f"DTSTAMP:{updated_at.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')}",
+            f"DTSTART;VALUE=DATE:{check_in_date.strftime('%Y%m%d')}",
+            f"DTEND;VALUE=DATE:{check_out_date.strftime('%Y%m%d')}",
+            'SUMMARY:Reserved',
+            'END:VEVENT',
+        ]
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(fold_line(line) for line in lines) + '\r\n'
+
+
+# Import
+
+def unfold_lines(text):
+    lines = []
+    for line in re.split(r'\r\n|\n|\r', text):
+        if line[:1] in (' ', '\t') and lines:
+            lines[-1] += line[1:]
+        elif line:
+            lines.append(line)
+    return lines
+
+
+def unescape_text(value):
+    return re.sub(r'\\([\\;,nN])', lambda match: '\n' if match.group(1) in 'nN' else match.group(1), value)
+
+
+def parse_date(value):
+    """The date of an iCalendar DATE or DATE-TIME value (its local date, ignoring any time zone)."""
+    return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+
+
+def parse_events(text):
+    """
+    The blocking events of an iCalendar document as {uid: (start_date,
+    end_date, summary)}, end dates exclusive. Cancelled and transparent
+    (free) events, and events exported by us, are left out. Recurring events
+    are not expanded; booking feeds do not use them.
+    """
+    events = {}
+    components = []
+    event = None
+    for line in unfold_lines(text):
+        name, separator, value = line.partition(':')
+        name = name.split(';', 1)[0].upper()
+        if name == 'BEGIN':
+            components.append(value.upper())
+            if components == ['VCALENDAR', 'VEVENT']:
+                event = {}
+        elif name == 'END':
+            if components == ['VCALENDAR', 'VEVENT'] and event is not None:
+                parsed = parse_event(event)
+                if parsed:
+                    events.setdefault(parsed[0], parsed[1:])
+                event = None
+            if components:
+                components.pop()
+        elif event is not None and components == ['VCALENDAR', 'VEVENT']:
+            event.setdefault(name, value)
+    return events
+
+
+def parse_event(event):
+    if event.get('STATUS', '').upper() == 'CANCELLED' or event.get('TRANSP', '').upper() == 'TRANSPARENT':
+        return None
+    try:
+        start_date = parse_date(event['DTSTART'])
+        end_date = parse_date(event['DTEND']) if 'DTEND' in event else start_date
+    except (KeyError, ValueError):
+        return None
+    # All-day events without an end, or ending the day they start, block that night.
+    end_date = max(end_date, start_date + timedelta(days=1))
+
+    summary = unescape_text(event.get('SUMMARY', ''))[:255]
+    uid = event.get('UID') or hashlib.sha256(f"{start_date}:{end_date}:{summary}".encode()).hexdigest()
+    if uid.endswith(f'@{UID_DOMAIN}'):
+        return None
+    return uid[:255], start_date, end_date, summary
+
+
+def get_session(workers=SYNC_WORKERS):
+    """A requests session that keeps up to `workers` connections open per host."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_feed(session, feed):
+    """
+    GET a feed, sending back the validators of the last response so an
+    unchanged feed costs a 304 and no body. Returns the response, or the
+    error that stopped it; never raises, as it runs in worker threads.
+    """
+    headers = {}
+    if feed.etag:
+        headers['If-None-Match'] = feed.etag
+    if feed.last_modified:
+        headers['If-Modified-Since'] = feed.last_modified
+    try:
+        response = session.get(feed.url, headers=headers, timeout=FETCH_TIMEOUT)
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response, None
+    except requests.RequestException as e:
+        return None, str(e)
+
+
+def apply_feed(feed, response, error=None):
+    """
+    Bring a feed's blocks in line with a fetched response, writing only the
+    events that were added, moved or removed. Returns a summary of the sync.
+    """
+    feed.last_synced_at = timezone.now()
+    if error:
+        feed.last_error = error
+        feed.save(update_fields=['last_synced_at', 'last_error'])
+        return {'status': 'error', 'error': error}
+
+    feed.last_error = ''
+    update_fields = ['last_synced_at', 'last_error', 'etag', 'last_modified', 'content_hash']
+    if response.status_code == 304:
+        feed.save(update_fields=['last_synced_at', 'last_error'])
+        return {'status': 'not_modified'}
+
+    feed.etag = response.headers.get('ETag', '')[:200]
+    feed.last_modified = response.headers.get('Last-Modified', '')[:100]
+    # Servers without validators send the whole feed every time; an
+    # identical body is still not parsed again.
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    if content_hash == feed.content_hash:
+        feed.save(update_fields=update_fields)
+        return {'status': 'unchanged'}
+    feed.content_hash = content_hash
+
+    events = parse_events(response.content.decode('utf-8', errors='replace'))
+    existing = {block.uid: block for block in feed.blocks.all()}
+    created = [
+        CalendarBlock(feed=feed, property_id=feed.property_id, uid=uid, start_date=start_date, end_date=end_date, summary=summary)
+        for uid, (start_date, end_date, summary) in events.items()
+        if uid not in existing
+    ]
+    updated = []
+    changed_stays = []
+    for uid, block in existing.items():
+        if uid in events and events[uid] != (block.start_date, block.end_date, block.summary):
+            changed_stays.append((block.start_date, block.end_date))
+            block.start_date, block.end_date, block.summary = events[uid]
+            updated.append(block)
+    deleted = [block for uid, block in existing.items() if uid not in events]
+
+    with transaction.atomic():
+        if created or updated or deleted:
+            # Taken like `Booking.save()` takes it, so no booking is checked
+            # against the old blocks while they change.
+            list(Property.objects.select_for_update().filter(pk=feed.property_id).values_list('pk'))
+            CalendarBlock.objects.bulk_create(created)
+            CalendarBlock.objects.bulk_update(updated, ['start_date', 'end_date', 'summary'])
+            CalendarBlock.objects.filter(pk__in=[block.pk for block in deleted]).delete()
+
+            years = set()
+            for start_date, end_date in changed_stays + [(block.start_date, block.end_date) for block in created + updated + deleted]:
+                years.update(get_years(start_date, end_date))
+            rebuild_occupancy(feed.property_id, years)
+            bump_global_version(AVAILABILITY_VERSION)
+        feed.save(update_fields=update_fields)
+
+    return {'status': 'synced', 'created': len(created), 'updated': len(updated), 'deleted': len(deleted)}
+
+
+def sync_feeds(feeds, workers=SYNC_WORKERS):
+    """
+    Sync many feeds: they are fetched concurrently over one pooled session
+    and applied one by one in this thread as they arrive, so the database
+    work stays on a single connection. Returns {feed: summary}.
+    """
+    feeds = list(feeds)
+    results = {}
+    if not feeds:
+        return results
+    with get_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_feed, session, feed): feed for feed in feeds}
+        for future in as_completed(futures):
+            feed = futures[future]
+            results[feed] = apply_feed(feed, *future.result())
+    return results
+
+
+def sync_feed(feed):
+    return sync_feeds([feed], workers=1)[feed]
@@ -0,0 +1,241 @@
+import csv
+import json
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import date
+from itertools import islice
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from guests.models import Guest
+from properties.cache import AVAILABILITY_VERSION, bump_global_version, get_property_bundles
+from properties.models import Property
+from .models import ACTIVE_STATUSES, Booking, CalendarBlock
+from .occupancy import apply_stays
+from .quote import Quote
+
+# Rows validated and written per transaction. Each chunk holds the locks of
+# its properties, so smaller chunks let live bookings in sooner.
+CHUNK_SIZE = getattr(settings, 'BOOKING_IMPORT_CHUNK_SIZE', 1000)
+BATCH_SIZE = getattr(settings, 'BOOKING_IMPORT_BATCH_SIZE', 500)
+
+FIELDS = ['property', 'guest', 'check_in_date', 'check_out_date', 'num_guests', 'status', 'special_requests']
+STATUSES = [value for value, label in Booking._meta.get_field('status').choices]
+
+
+def read_rows(file, format):
+    """
+    Yield the bookings in a text file, or any iterable of lines, one dict at a
+    time. `format` is 'csv' (with a header row), 'jsonl' (one object per
+    line) or 'json' (a list of objects, which has to be read whole).
+    """
+    if format == 'csv':
+        yield from csv.DictReader(file)
+    elif format == 'jsonl':
+        for line in file:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Passed on as is, to be rejected like any other bad row.
+                    yield line.strip()
+    elif format == 'json':
+        yield from json.load(file)
+    else:
+        raise ValueError(f"Unknown import format: {format}")
+
+
+class StayIntervals:
+    """
+    The active stays of one property, sorted. As active stays never overlap,
+    their check-in and check-out dates are in the same order, so a stay's
+    neighbours are found by binary search on either list. Calendar `blocks`
+    can overlap anything and are checked one by one.
+    """
+
+    def __init__(self, stays, blocks=()):
+        stays = sorted(stays)
+        self.check_ins = [check_in_date for check_in_date, check_out_date in stays]
+        self.check_outs = [check_out_date for check_in_date, check_out_date in stays]
+        self.blocks = list(blocks)
+
+    def assess(self, check_in_date, check_out_date):
+        """(overlapping, fills_gap) for the stay, like `assess_stay`."""
+        # The last stay starting before the check-out date ends latest of all those that do.
+        index = bisect_left(self.check_ins, check_out_date)
+        overlapping = index > 0 and self.check_outs[index - 1] > check_in_date
+        starts_on_check_out = index < len(self.check_ins) and self.check_ins[index] == check_out_date
+        previous = bisect_left(self.check_outs, check_in_date)
+        ends_on_check_in = previous < len(self.check_outs) and self.check_outs[previous] == check_in_date
+        for block_start_date, block_end_date in self.blocks:
+            overlapping = overlapping or (block_start_date < check_out_date and block_end_date > check_in_date)
+            ends_on_check_in = ends_on_check_in or block_end_date == check_in_date
+            starts_on_check_out = starts_on_check_out or block_start_date == check_out_date
+        return overlapping, ends_on_check_in and starts_on_check_out
+
+    def add(self, check_in_date, check_out_date):
+        insort(self.check_ins, check_in_date)
+        insort(self.check_outs, check_out_date)
+
+
+def parse_row(row):
+    """The booking fields of an input row, or a ValidationError listing what is wrong with it."""
+    if not isinstance(row, dict):
+        raise ValidationError("Each row must be an object with the booking's fields.")
+
+    errors = []
+    values = {}
+    for field, parse in (('property', int), ('guest', int), ('num_guests', int)):
+        try:
+            values[field] = parse(row.get(field))
+        except (TypeError, ValueError):
+            errors.append(f"{field} must be an integer.")
+    for field in ('check_in_date', 'check_out_date'):
+        try:
+            values[field] = date.fromisoformat(str(row.get(field)))
+        except ValueError:
+            errors.append(f"{field} must be a date as YYYY-MM-DD.")
+
+    values['status'] = row.get('status') or 'pending'
+    if values['status'] not in STATUSES:
+        errors.append(f"status must be one of {', '.join(STATUSES)}.")
+    values['special_requests'] = str(row.get('special_requests') or '')
+
+    if 'num_guests' in values and values['num_guests'] < 1:
+        errors.append("num_guests must be at least 1.")
+    if 'check_in_date' in values and 'check_out_date' in values and values['check_out_date'] <= values['check_in_date']:
+        errors.append("Check-out date must be after check-in date.")
+    if errors:
+        raise ValidationError(errors)
+    return values
+
+
+def import_chunk(rows):
+    """
+    Validate and insert one chunk of (row number, row) pairs in a single
+    transaction. Returns the created bookings and a list of rejects.
+    """
+    rejects = []
+    parsed = []
+    for number, row in rows:
+        try:
+            parsed.append((number, row, parse_row(row)))
+        except ValidationError as e:
+            rejects.append({'row': number, 'data': row, 'errors': e.messages})
+    if not parsed:
+        return [], rejects
+
+    property_ids = {values['property'] for number, row, values in parsed}
+    guest_ids = set(Guest.objects.filter(pk__in={values['guest'] for number, row, values in parsed}).values_list('pk', flat=True))
+    start_date = min(values['check_in_date'] for number, row, values in parsed)
+    end_date = max(values['check_out_date'] for number, row, values in parsed)
+
+    bookings = []
+    with transaction.atomic():
+        # Taken in the same order as `Booking.save()` takes its single lock,
+        # so live bookings for these properties wait for the chunk.
+        locked_ids = set(Property.objects.select_for_update().filter(pk__in=property_ids).order_by('pk').values_list('pk', flat=True))
+        properties = get_property_bundles(locked_ids) if locked_ids else {}
+
+        # Every active booking and calendar block that can overlap or border a stay in the chunk.
+        stays = defaultdict(list)
+        for property_id, check_in_date, check_out_date in Booking.objects.filter(
+            property_id__in=locked_ids,
+            status__in=ACTIVE_STATUSES,
+            check_in_date__lte=end_date,
+            check_out_date__gte=start_date
+        ).values_list('property_id', 'check_in_date', 'check_out_date'):
+            stays[property_id].append((check_in_date, check_out_date))
+        blocks = defaultdict(list)
+        for property_id, block_start_date, block_end_date in CalendarBlock.objects.filter(
+            property_id__in=locked_ids,
+            start_date__lte=end_date,
+            end_date__gte=start_date
+        ).values_list('property_id', 'start_date', 'end_date'):
+            blocks[property_id].append((block_start_date, block_end_date))
+        intervals = {property_id: StayIntervals(stays[property_id], blocks[property_id]) for property_id in locked_ids}
+
+        added = defaultdict(list)
+        for number, row, values in parsed:
+            property = properties.get(values['property'])
+            check_in_date, check_out_date = values['check_in_date'], values['check_out_date']
+            try:
+                if property is None:
+                    raise ValidationError("Property not found.")
+                if values['guest'] not in guest_ids:
+                    raise ValidationError("Guest not found.")
+
+                active = values['status'] in ACTIVE_STATUSES
+                overlapping, fills_gap = intervals[property.pk].assess(check_in_date, check_out_date)
+                # Cancelled bookings hold no nights, so only their rules are checked, as in `Booking.check_availability`.
+                if active and overlapping:
+                    raise ValidationError("This booking overlaps with an existing booking.")
+                property.check_booking_rules(check_in_date, check_out_date, fills_gap=fills_gap and not overlapping)
+            except ValidationError as e:
+                rejects.append({'row': number, 'data': row, 'errors': e.messages})
+                continue
+
+            quote = Quote(
+                property, check_in_date, check_out_date, values['num_guests'],
+                calendar=property.get_price_calendar(), fees=property.fees.all()
+            )
+            bookings.append(Booking(
+                property_id=property.pk,
+                guest_id=values['guest'],
+                check_in_date=check_in_date,
+                check_out_date=check_out_date,
+                num_guests=values['num_guests'],
+                status=values['status'],
+                special_requests=values['special_requests'],
+                base_total=quote.base_total,
+                fees_total=quote.fees_total,
+                total_price=quote.total_price
+            ))
+            if active:
+                intervals[property.pk].add(check_in_date, check_out_date)
+                added[property.pk].append((check_in_date, check_out_date))
+
+        # bulk_create sends no signals, so the occupancy is updated here,
+        # inside the same transaction as the bookings.
+        Booking.objects.bulk_create(bookings, batch_size=BATCH_SIZE)
+        for property_id, property_stays in added.items():
+            apply_stays(property_id, [], property_stays)
+        if added:
+            bump_global_version(AVAILABILITY_VERSION)
+
+    rejects.sort(key=lambda reject: reject['row'])
+    return bookings, rejects
+
+
+def import_bookings(rows, chunk_size=CHUNK_SIZE, on_reject=None, send_summary=True):
+    """
+    Import bookings from an iterable of dicts with the fields in `FIELDS`,
+    reading and committing `chunk_size` rows at a time so any number of rows
+    can be streamed through. Rows get the same checks as `Booking.save()`
+    (overlaps, booking rules and gap stays) but are checked in memory and
+    inserted with `bulk_create`, without per-booking signals or webhooks.
+
+    Invalid rows are passed to `on_reject` as {'row', 'data', 'errors'} dicts
+    and do not stop the import. Returns a summary, which is also sent as a
+    single `bookings_imported` webhook unless `send_summary` is False.
+    """
+    from api.webhooks import send_webhook
+
+    summary = {'created': 0, 'rejected': 0, 'properties': set()}
+    rows = enumerate(rows, start=1)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        bookings, rejects = import_chunk(chunk)
+        summary['created'] += len(bookings)
+        summary['properties'].update(booking.property_id for booking in bookings)
+        summary['rejected'] += len(rejects)
+        if on_reject:
+            for reject in rejects:
+                on_reject(reject)
+
+    summary['properties'] = sorted(summary['properties'])
+    if send_summary and (summary['created'] or summary['rejected']):
+        send_webhook('bookings_imported', summary)
+    return summary
@@ -0,0 +1,80 @@
+import time
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from guests.models import Guest
+from owners.models import Owner
+from properties.models import Property
+from bookings.models import Booking
+
+STAY_NIGHTS = 3
+STAY_SPACING = 5  # days from one check-in to the next, leaving a two-night gap
+
+
+class Command(BaseCommand):
+    help = (
+        "Time booking validation against a property's bookings as its history grows. Each size is "
+        "written to a scratch property inside a transaction that is rolled back, so nothing is kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[300, 1000, 10000, 30000],
+            help="Booking histories to measure (default 300 1000 10000 30000)"
+        )
+        parser.add_argument('--repeat', type=int, default=500, help="Validations timed per size (default 500)")
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1 or min(options['sizes']) < 3:
+            raise CommandError("--repeat must be at least 1 and every size at least 3.")
+
+        self.stdout.write("bookings   existing booking   new stay    queries")
+        for size in options['sizes']:
+            with transaction.atomic():
+                existing, new, queries = self.measure(size, options['repeat'])
+                transaction.set_rollback(True)
+            self.stdout.write(f"{size:>8,}   {existing * 1000:>13.2f}ms   {new * 1000:>6.2f}ms   {queries:>7}")
+
+    def measure(self, size, repeat):
+        suffix = uuid.uuid4().hex
+        owner = Owner.objects.create(first_name='Benchmark', last_name='Owner', email=f'{suffix}@example.com', phone='0', address='-')
+        guest = Guest.objects.create(first_name='Benchmark', last_name='Guest', email=f'{suffix}@example.com', phone='0')
+        property = Property.objects.create(
+            name='Benchmark', address='-', owner=owner, bedrooms=1, bathrooms=1, max_occupancy=2,
+            nightly_rate=Decimal('100.00'), description='', allow_gap_stays=False
+        )
+        # Written without signals, so there is no stored occupancy and every
+        # check goes to the bookings, as it does outside the indexed years.
+        first = date(2000, 1, 1)
+        Booking.objects.bulk_create([
+            Booking(
+                property=property, guest=guest, num_guests=1, status='confirmed',
+                check_in_date=first + timedelta(days=index * STAY_SPACING),
+                check_out_date=first + timedelta(days=index * STAY_SPACING + STAY_NIGHTS),
+                base_total=0, fees_total=0, total_price=0
+            )
+            for index in range(size)
+        ], batch_size=1000)
+        connection.cursor().execute('ANALYZE')
+
+        # A booking from the middle of the history, checked as when it is
+        # edited, and a new stay in the gap after it.
+        existing = Booking.objects.filter(property=property).order_by('check_in_date')[size // 2]
+        new = Booking(
+            property=property, guest=guest, num_guests=1,
+            check_in_date=existing.check_out_date, check_out_date=existing.check_out_date + timedelta(days=1)
+        )
+        timings = []
+        for booking in (existing, new):
+            booking.check_availability()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                booking.check_availability()
+            timings.append((time.perf_counter() - start) / repeat)
+
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+            existing.check_availability()
+        return timings[0], timings[1], len(queries)
@@ -0,0 +1,61 @@
+import csv
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from bookings.importer import CHUNK_SIZE, FIELDS, import_bookings, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Import bookings from a CSV, JSON Lines or JSON file, validating and inserting them in chunks. "
+        "Rows that fail validation are written to a reject report instead of stopping the import."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for standard input")
+        parser.add_argument('--format', choices=['csv', 'jsonl', 'json'], help="Input format (guessed from the file extension if not given)")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help=f"Rows per transaction (default {CHUNK_SIZE})")
+        parser.add_argument('--rejects', help="Write rejected rows to this CSV file with their row number and errors")
+        parser.add_argument('--no-webhook', action='store_true', help="Do not send the bookings_imported summary webhook")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if format not in ('csv', 'jsonl', 'json'):
+            raise CommandError("Cannot tell the input format from the file name; pass --format.")
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+
+        input_file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        rejects_file = open(options['rejects'], 'w', newline='', encoding='utf-8') if options['rejects'] else None
+        try:
+            on_reject = None
+            if rejects_file:
+                writer = csv.DictWriter(rejects_file, fieldnames=['row', 'errors'] + FIELDS, extrasaction='ignore')
+                writer.writeheader()
+
+                def on_reject(reject):
+                    data = reject['data'] if isinstance(reject['data'], dict) else {}
+                    writer.writerow({**data, 'row': reject['row'], 'errors': '; '.join(reject['errors'])})
+            else:
+                def on_reject(reject):
+                    self.stderr.write(f"Row {reject['row']}: {'; '.join(reject['errors'])}")
+
+            try:
+                summary = import_bookings(
+                    read_rows(input_file, format),
+                    chunk_size=options['chunk_size'],
+                    on_reject=on_reject,
+                    send_summary=not options['no_webhook']
+                )
+            except (csv.Error, json.JSONDecodeError, UnicodeDecodeError) as e:
+                raise CommandError(f"Could not read {path}: {e}")
+        finally:
+            if input_file is not sys.stdin:
+                input_file.close()
+            if rejects_file:
+                rejects_file.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {summary['created']} bookings for {len(summary['properties'])} properties; {summary['rejected']} rows rejected."
+        ))
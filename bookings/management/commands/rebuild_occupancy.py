@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from properties.models import Property
+from bookings.occupancy import rebuild_property_occupancy
+
+
+class Command(BaseCommand):
+    help = "Rebuild the stored occupancy bitmaps from the bookings. Run after importing or editing bookings in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--property', type=int, action='append', dest='property_ids', help="Only rebuild this property (can be repeated)")
+
+    def handle(self, *args, **options):
+        properties = Property.objects.all()
+        if options['property_ids']:
+            properties = properties.filter(pk__in=options['property_ids'])
+
+        count = 0
+        for property_id in properties.values_list('pk', flat=True).iterator():
+            rebuild_property_occupancy(property_id)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the occupancy of {count} properties."))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from bookings.ical import SYNC_WORKERS, sync_feeds
+from bookings.models import CalendarFeed
+
+
+class Command(BaseCommand):
+    help = "Fetch the active external iCal feeds and update the dates they block. Only changed feeds are downloaded and only changed events written."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--property', type=int, action='append', dest='property_ids', help="Only sync this property's feeds (can be repeated)")
+        parser.add_argument('--workers', type=int, default=SYNC_WORKERS, help=f"Feeds fetched at once (default {SYNC_WORKERS})")
+
+    def handle(self, *args, **options):
+        feeds = CalendarFeed.objects.filter(is_active=True)
+        if options['property_ids']:
+            feeds = feeds.filter(property_id__in=options['property_ids'])
+
+        results = sync_feeds(feeds, workers=max(options['workers'], 1))
+
+        counts = {}
+        for feed, result in results.items():
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+            if result['status'] == 'error':
+                self.stderr.write(f"{feed} ({feed.property}): {result['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Synced {len(results)} calendars: {counts.get('synced', 0)} updated, "
+            f"{counts.get('not_modified', 0) + counts.get('unchanged', 0)} unchanged, {counts.get('error', 0)} failed."
+        ))
@@ -0,0 +1,28 @@
+# Generated by Django 5.1 on 2026-10-18 12:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0006_booking_base_total_booking_fees_total_and_more'),
+        ('properties', '0011_propertynightlyrate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PropertyOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField()),
+                ('nights', models.BinaryField()),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancy', to='properties.property')),
+            ],
+            options={
+                'verbose_name_plural': 'Property occupancy',
+                'unique_together': {('property', 'year')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-18 12:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0007_propertyoccupancy'),
+        ('guests', '0001_initial'),
+        ('properties', '0011_propertynightlyrate'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['property', 'check_in_date', 'check_out_date', 'status'], name='booking_stay_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['property', 'check_out_date', 'status'], name='booking_check_out_idx'),
+        ),
+    ]
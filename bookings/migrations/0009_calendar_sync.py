@@ -0,0 +1,54 @@
+# Generated by Django 5.1 on 2026-10-18 12:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0008_booking_stay_indexes'),
+        ('properties', '0011_propertynightlyrate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.CreateModel(
+            name='CalendarFeed',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('url', models.URLField(max_length=500)),
+                ('is_active', models.BooleanField(default=True)),
+                ('etag', models.CharField(blank=True, editable=False, max_length=200)),
+                ('last_modified', models.CharField(blank=True, editable=False, max_length=100)),
+                ('content_hash', models.CharField(blank=True, editable=False, max_length=64)),
+                ('last_synced_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('last_error', models.TextField(blank=True, editable=False)),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_feeds', to='properties.property')),
+            ],
+            options={
+                'unique_together': {('property', 'url')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CalendarBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uid', models.CharField(max_length=255)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('summary', models.CharField(blank=True, max_length=255)),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_blocks', to='properties.property')),
+                ('feed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocks', to='bookings.calendarfeed')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['property', 'start_date', 'end_date'], name='calendar_block_dates_idx')],
+                'unique_together': {('feed', 'uid')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1 on 2026-10-18 12:54
+
+from django.db import migrations, models
+
+
+def analyze(apps, schema_editor):
+    # SQLite has no statistics until ANALYZE runs, and without them it sorts
+    # an owner's bookings rather than walking the new index in order.
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('ANALYZE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0009_calendar_sync'),
+        ('guests', '0001_initial'),
+        ('properties', '0013_property_owner_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['check_in_date', 'id'], name='booking_check_in_id_idx'),
+        ),
+        migrations.RunPython(analyze, migrations.RunPython.noop),
+    ]
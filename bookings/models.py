@@ -1,7 +1,68 @@
-from django.db import models
+import random
+import time
+from django.conf import settings
+from django.db import OperationalError, connection, models, transaction
+from django.db.models import Subquery, Value
+from django.db.models.functions import Coalesce
 from django.core.exceptions import ValidationError
 from datetime import timedelta
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
+from properties.models import Property
+from properties.pricing import round_price
+from .quote import get_quote
+
+# Bookings in these statuses hold their nights; cancelled ones release them.
+ACTIVE_STATUSES = ['pending', 'confirmed', 'completed']
+
+SAVE_ATTEMPTS = getattr(settings, 'BOOKING_SAVE_ATTEMPTS', 5)
+SAVE_BACKOFF = getattr(settings, 'BOOKING_SAVE_BACKOFF', 0.05)  # seconds, doubled after each attempt
+
+
+def get_neighbourhood(property, check_in_date, check_out_date, exclude_pk=None):
+    """
+    The (check_in_date, check_out_date) of the active bookings and calendar
+    blocks that can overlap a stay or border it. For bookings that is the
+    last one starting before the check-in date and every one starting from
+    the check-in up to the check-out date: as active bookings never overlap,
+    no other booking can. Blocks from external calendars can overlap
+    bookings and each other, so the same shortcut does not hold for them;
+    they are few, and every one touching the stay is included. Both come
+    back from a single query, the bookings from a range scan of
+    `booking_stay_idx` whatever the property's history.
+    """
+    active_bookings = Booking.objects.filter(property=property, status__in=ACTIVE_STATUSES).exclude(pk=exclude_pk)
+    previous_check_in = active_bookings.filter(
+        check_in_date__lt=check_in_date
+    ).order_by('-check_in_date').values('check_in_date')[:1]
+
+    stays = active_bookings.filter(
+        check_in_date__gte=Coalesce(Subquery(previous_check_in), Value(check_in_date)),
+        check_in_date__lte=check_out_date
+    ).order_by().values_list('check_in_date', 'check_out_date')
+    return list(stays.union(get_touching_blocks(property, check_in_date, check_out_date), all=True))
+
+
+def get_touching_blocks(property, check_in_date, check_out_date):
+    """The (start_date, end_date) of the calendar blocks that overlap a stay or end or start on its dates, as a queryset."""
+    return CalendarBlock.objects.filter(
+        property=property,
+        start_date__lte=check_out_date,
+        end_date__gte=check_in_date
+    ).order_by().values_list('start_date', 'end_date')
+
+
+def assess_stay(stays, check_in_date, check_out_date):
+    """
+    Whether a stay overlaps any of `stays`, and whether it is a gap stay: one
+    of them ends on its check-in date and another starts on its check-out date.
+    """
+    overlapping = ends_on_check_in = starts_on_check_out = False
+    for stay_check_in_date, stay_check_out_date in stays:
+        overlapping = overlapping or (stay_check_in_date < check_out_date and stay_check_out_date > check_in_date)
+        ends_on_check_in = ends_on_check_in or stay_check_out_date == check_in_date
+        starts_on_check_out = starts_on_check_out or stay_check_in_date == check_out_date
+    return overlapping, ends_on_check_in and starts_on_check_out
+
 
 class Booking(models.Model):
     property = models.ForeignKey('properties.Property', on_delete=models.CASCADE, related_name='bookings')
@@ -19,92 +80,58 @@ class Booking(models.Model):
         ('completed', 'Completed')
     ], default='pending')
     booking_date = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     special_requests = models.TextField(blank=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so that the occupancy of the old dates can be cleared on save.
+        instance._loaded_stay = (
+            instance.__dict__.get('property_id'),
+            instance.__dict__.get('check_in_date'),
+            instance.__dict__.get('check_out_date'),
+            instance.__dict__.get('status')
+        )
+        return instance
+
+    def get_quote(self):
+        key = (self.property_id, self.check_in_date, self.check_out_date, self.num_guests)
+        if getattr(self, '_quote_key', None) != key:
+            self._quote = get_quote(self.property, self.check_in_date, self.check_out_date, self.num_guests)
+            self._quote_key = key
+        return self._quote
+
     def calculate_price_breakdown(self):
-        breakdown = []
         if self.check_in_date and self.check_out_date and self.property:
-            current_date = self.check_in_date
-            while current_date < self.check_out_date:
-                price, rule_applied = self.get_price_and_rule_for_date(current_date)
-                breakdown.append({
-                    'date': current_date,
-                    'price': price,
-                    'rule_applied': rule_applied
-                })
-                current_date += timedelta(days=1)
-        return breakdown
+            return self.get_quote().breakdown
+        return []
 
     def get_price_and_rule_for_date(self, date):
         if not self.property:
             return Decimal('0.00'), "No property selected"
 
-        base_price = self.property.nightly_rate
-        applicable_rules = []
-
-        for rule in self.property.pricing_rules.all():
-            if rule.rule_type == 'override' and rule.start_date == date:
-                return self.round_price(base_price * rule.get_modifier_factor()), f"Override: {rule.price_modifier}%"
-            elif rule.rule_type == 'seasonal' and rule.start_date <= date <= rule.end_date:
-                applicable_rules.append(rule)
-            elif rule.rule_type == 'weekend' and date.weekday() in [4, 5]:  # Friday and Saturday
-                applicable_rules.append(rule)
-
-        if applicable_rules:
-            applicable_rules.sort(key=lambda x: (x.rule_type != 'seasonal', -x.price_modifier))
-            applied_rule = applicable_rules[0]
-            return self.round_price(base_price * applied_rule.get_modifier_factor()), f"{applied_rule.get_rule_type_display()}: {applied_rule.price_modifier}%"
-
-        return self.round_price(base_price), "Base rate"
+        day = self.property.get_price_calendar().breakdown(date, date + timedelta(days=1))[0]
+        return day['price'], day['rule_applied']
 
     def calculate_total_price(self):
-        base_total = sum(Decimal(day['price']) for day in self.calculate_price_breakdown())
-        fees_total = self.calculate_fees()
-        return self.round_price(base_total + fees_total)
+        return self.get_quote().total_price
 
     def calculate_fees(self):
-        total_fees = Decimal('0.00')
-        nights = (self.check_out_date - self.check_in_date).days
-        base_total = sum(Decimal(day['price']) for day in self.calculate_price_breakdown())
-
-        for fee in self.property.fees.all():
-            fee_amount = self.calculate_fee_amount(fee)
-            total_fees += fee_amount
-
-        return self.round_price(total_fees)
+        return self.get_quote().fees_total
 
     def calculate_fee_amount(self, fee):
-        nights = (self.check_out_date - self.check_in_date).days
-        base_total = sum(Decimal(day['price']) for day in self.calculate_price_breakdown())
-
-        if fee.fee_type == 'percentage':
-            fee_amount = base_total * (fee.amount / Decimal('100'))
-        else:  # fixed amount
-            fee_amount = fee.amount
-
-        if fee.applies == 'per_night':
-            fee_amount *= nights
-        
-        if fee.is_extra_guest_fee and self.num_guests > fee.extra_guest_threshold:
-            extra_guests = self.num_guests - fee.extra_guest_threshold
-            fee_amount *= extra_guests
-
-        return self.round_price(fee_amount)
+        return self.get_quote().get_fee_amount(fee)
 
     def get_incorporated_fees_per_night(self):
-        nights = (self.check_out_date - self.check_in_date).days
-        incorporated_fees_total = sum(
-            self.calculate_fee_amount(fee)
-            for fee in self.property.fees.all()
-            if fee.display_strategy == 'incorporated'
-        )
-        return self.round_price(incorporated_fees_total / nights) if nights > 0 else Decimal('0.00')
+        return self.get_quote().incorporated_fees_per_night
 
     @staticmethod
     def round_price(price):
-        return Decimal(price).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        return round_price(price)
 
-    def clean(self):
+    def clean(self, stays=None, occupancy=None):
+        # `stays` and `occupancy` are passed on to `check_availability()`.
         if not self.check_in_date:
             raise ValidationError("Check-in date is required.")
         if not self.check_out_date:
@@ -117,33 +144,145 @@ class Booking(models.Model):
         if self.check_out_date <= self.check_in_date:
             raise ValidationError("Check-out date must be after check-in date.")
 
-        nights = (self.check_out_date - self.check_in_date).days
+        self.check_availability(stays=stays, occupancy=occupancy)
 
-        overlapping_bookings = Booking.objects.filter(
-            property=self.property,
-            check_in_date__lt=self.check_out_date,
-            check_out_date__gt=self.check_in_date
-        ).exclude(pk=self.pk)
+        self._quote_key = None
+        quote = self.get_quote()
+        self.base_total = quote.base_total
+        self.fees_total = quote.fees_total
+        self.total_price = quote.total_price
 
-        if overlapping_bookings.exists():
-            raise ValidationError("This booking overlaps with an existing booking.")
+    def check_availability(self, stays=None, occupancy=None):
+        # `stays` lets batch callers pass the (check_in_date, check_out_date)
+        # of the property's active bookings and blocks around the stay that
+        # they have already fetched instead of querying for them here, and
+        # `occupancy` the property's stored occupancy around the stay.
+        if occupancy is None and stays is None and self.pk is None:
+            from .occupancy import get_occupancy
+            occupancy = get_occupancy(
+                self.property.pk,
+                self.check_in_date - timedelta(days=1),
+                self.check_out_date + timedelta(days=1)
+            )
+
+        if occupancy is not None:
+            overlapping = not occupancy.is_free(self.check_in_date, self.check_out_date)
+            fills_gap = occupancy.fills_gap(self.check_in_date, self.check_out_date)
+        else:
+            if stays is None:
+                stays = get_neighbourhood(self.property, self.check_in_date, self.check_out_date, exclude_pk=self.pk)
+            overlapping, fills_gap = assess_stay(stays, self.check_in_date, self.check_out_date)
+
+        # Cancelled bookings hold no nights, so they can always be cancelled,
+        # even once a calendar block has been imported over them. A stay that
+        # overlaps others does not fill a gap between them.
+        if overlapping:
+            if self.status in ACTIVE_STATUSES:
+                raise ValidationError("This booking overlaps with an existing booking.")
+            fills_gap = False
 
         # Check booking rules
         try:
-            self.property.check_booking_rules(self.check_in_date, self.check_out_date)
+            self.property.check_booking_rules(self.check_in_date, self.check_out_date, fills_gap=fills_gap)
         except ValidationError as e:
             raise ValidationError(str(e))
 
-        self.base_total = self.round_price(sum(Decimal(day['price']) for day in self.calculate_price_breakdown()))
-        self.fees_total = self.calculate_fees()
-        self.total_price = self.base_total + self.fees_total
-
     def save(self, *args, **kwargs):
-        self.full_clean()
-        super().save(*args, **kwargs)
+        # Validation and the write happen in one transaction holding a lock on
+        # the property's row, so two bookings for the same property cannot
+        # both pass the overlap check while bookings for other properties go
+        # ahead in parallel. On SQLite, which has no row locks, the
+        # transaction starts with BEGIN IMMEDIATE instead (see settings).
+        if connection.in_atomic_block:
+            # The caller's transaction cannot be retried from in here.
+            return self._save_locked(*args, **kwargs)
+
+        for attempt in range(SAVE_ATTEMPTS):
+            adding = self._state.adding
+            loaded_stay = getattr(self, '_loaded_stay', None)
+            try:
+                return self._save_locked(*args, **kwargs)
+            except OperationalError:
+                # Lock timeouts and deadlocks roll the whole transaction back,
+                # the occupancy written for the save included.
+                if adding:
+                    self.pk = None
+                    self._state.adding = True
+                self._loaded_stay = loaded_stay
+                if attempt == SAVE_ATTEMPTS - 1:
+                    raise
+                time.sleep(SAVE_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    def _save_locked(self, *args, **kwargs):
+        with transaction.atomic():
+            list(Property.objects.select_for_update().filter(pk=self.property_id).values_list('pk'))
+            self.full_clean()
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.guest} at {self.property} ({self.check_in_date} to {self.check_out_date})"
 
     class Meta:
-        ordering = ['-check_in_date']
\ No newline at end of file
+        ordering = ['-check_in_date']
+        indexes = [
+            # Back the availability checks. Status is the last column rather
+            # than a partial index condition, which SQLite cannot match when
+            # the statuses are passed as query parameters.
+            models.Index(fields=['property', 'check_in_date', 'check_out_date', 'status'], name='booking_stay_idx'),
+            models.Index(fields=['property', 'check_out_date', 'status'], name='booking_check_out_idx'),
+            # Backs keyset pages of bookings in check-in order.
+            models.Index(fields=['check_in_date', 'id'], name='booking_check_in_id_idx'),
+        ]
+
+class PropertyOccupancy(models.Model):
+    property = models.ForeignKey('properties.Property', on_delete=models.CASCADE, related_name='occupancy')
+    year = models.PositiveIntegerField()
+    # One bit per night of the year, little-endian: bit 0 is the night of 1 January.
+    nights = models.BinaryField()
+
+    def __str__(self):
+        return f"Occupancy of {self.property} in {self.year}"
+
+    class Meta:
+        unique_together = ('property', 'year')
+        verbose_name_plural = "Property occupancy"
+
+
+class CalendarFeed(models.Model):
+    """An external iCal calendar whose events block the property's dates."""
+    property = models.ForeignKey('properties.Property', on_delete=models.CASCADE, related_name='calendar_feeds')
+    name = models.CharField(max_length=100, blank=True)
+    url = models.URLField(max_length=500)
+    is_active = models.BooleanField(default=True)
+    # Validators from the last response, sent back to fetch the feed only if it changed.
+    etag = models.CharField(max_length=200, blank=True, editable=False)
+    last_modified = models.CharField(max_length=100, blank=True, editable=False)
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
+    last_synced_at = models.DateTimeField(null=True, blank=True, editable=False)
+    last_error = models.TextField(blank=True, editable=False)
+
+    def __str__(self):
+        return self.name or self.url
+
+    class Meta:
+        unique_together = ('property', 'url')
+
+
+class CalendarBlock(models.Model):
+    """Dates blocked by an event in a `CalendarFeed`, kept in step with the feed by the event's UID."""
+    feed = models.ForeignKey(CalendarFeed, on_delete=models.CASCADE, related_name='blocks')
+    property = models.ForeignKey('properties.Property', on_delete=models.CASCADE, related_name='calendar_blocks')
+    uid = models.CharField(max_length=255)
+    start_date = models.DateField()
+    # Exclusive, like a booking's check-out date.
+    end_date = models.DateField()
+    summary = models.CharField(max_length=255, blank=True)
+
+    def __str__(self):
+        return f"{self.property} blocked from {self.start_date} to {self.end_date}"
+
+    class Meta:
+        unique_together = ('feed', 'uid')
+        indexes = [
+            models.Index(fields=['property', 'start_date', 'end_date'], name='calendar_block_dates_idx'),
+        ]
@@ -0,0 +1,161 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from .models import ACTIVE_STATUSES, Booking, CalendarBlock, PropertyOccupancy
+
+# Years after the current one that are kept indexed for every property with bookings.
+YEARS_AHEAD = getattr(settings, 'OCCUPANCY_YEARS_AHEAD', 2)
+BITMAP_BYTES = 46  # 366 nights
+
+
+class Occupancy:
+    """The booked nights of one property from `start_date` onwards, one bit per night."""
+
+    def __init__(self, start_date, bits):
+        self.start_date = start_date
+        self.bits = bits
+
+    def is_booked(self, night):
+        return bool(self.bits >> (night - self.start_date).days & 1)
+
+    def is_free(self, check_in_date, check_out_date):
+        nights = (check_out_date - check_in_date).days
+        return not self.bits >> (check_in_date - self.start_date).days & ((1 << nights) - 1)
+
+    def fills_gap(self, check_in_date, check_out_date):
+        """
+        Whether a free stay has one booking ending on its check-in date and
+        another starting on its check-out date: the nights either side of it
+        are booked and, as bookings are contiguous, must end and start there.
+        """
+        return self.is_booked(check_in_date - timedelta(days=1)) and self.is_booked(check_out_date)
+
+
+def get_blocked_stays(property_id, start_date, end_date):
+    """The (start_date, end_date) of the property's calendar blocks that overlap the nights from `start_date` up to `end_date`."""
+    return list(CalendarBlock.objects.filter(
+        property_id=property_id,
+        start_date__lt=end_date,
+        end_date__gt=start_date
+    ).values_list('start_date', 'end_date'))
+
+
+def get_years(check_in_date, check_out_date):
+    return range(check_in_date.year, (check_out_date - timedelta(days=1)).year + 1)
+
+
+def build_bitmap(stays, year):
+    first_night = date(year, 1, 1)
+    bits = 0
+    for check_in_date, check_out_date in stays:
+        first = max((check_in_date - first_night).days, 0)
+        last = min((check_out_date - first_night).days, (date(year + 1, 1, 1) - first_night).days)
+        if first < last:
+            bits |= ((1 << (last - first)) - 1) << first
+    return bits
+
+
+def get_occupancies(property_ids, start_date, end_date):
+    """
+    The occupancy of each property over the nights from `start_date` up to
+    `end_date`, for the properties that have every year of it indexed.
+    Properties missing from the result have to be checked against bookings.
+    """
+    years = get_years(start_date, end_date)
+    rows = defaultdict(dict)
+    for property_id, year, nights in PropertyOccupancy.objects.filter(
+        property_id__in=property_ids,
+        year__in=years
+    ).values_list('property_id', 'year', 'nights'):
+        rows[property_id][year] = int.from_bytes(nights, 'little')
+
+    origin = date(years[0], 1, 1)
+    occupancies = {}
+    for property_id, bitmaps in rows.items():
+        if len(bitmaps) != len(years):
+            continue
+        bits = 0
+        for year, bitmap in bitmaps.items():
+            bits |= bitmap << (date(year, 1, 1) - origin).days
+        occupancies[property_id] = Occupancy(origin, bits)
+    return occupancies
+
+
+def get_occupancy(property_id, start_date, end_date):
+    return get_occupancies([property_id], start_date, end_date).get(property_id)
+
+
+def rebuild_occupancy(property_id, years):
+    """Recompute the stored occupancy of `years` from the property's bookings and calendar blocks."""
+    years = sorted(set(years))
+    if not years:
+        return
+    stays = list(Booking.objects.filter(
+        property_id=property_id,
+        status__in=ACTIVE_STATUSES,
+        check_in_date__lt=date(years[-1] + 1, 1, 1),
+        check_out_date__gt=date(years[0], 1, 1)
+    ).values_list('check_in_date', 'check_out_date'))
+    stays += get_blocked_stays(property_id, date(years[0], 1, 1), date(years[-1] + 1, 1, 1))
+
+    with transaction.atomic():
+        PropertyOccupancy.objects.filter(property_id=property_id, year__in=years).delete()
+        PropertyOccupancy.objects.bulk_create([
+            PropertyOccupancy(property_id=property_id, year=year, nights=build_bitmap(stays, year).to_bytes(BITMAP_BYTES, 'little'))
+            for year in years
+        ])
+
+
+def rebuild_property_occupancy(property_id):
+    """Recompute every stored year of a property, from its first booking to `YEARS_AHEAD` years from now."""
+    current_year = timezone.localdate().year
+    span = Booking.objects.filter(property_id=property_id, status__in=ACTIVE_STATUSES).aggregate(first=Min('check_in_date'), last=Max('check_out_date'))
+    block_span = CalendarBlock.objects.filter(property_id=property_id).aggregate(first=Min('start_date'), last=Max('end_date'))
+    first_dates = [value for value in (span['first'], block_span['first']) if value]
+    last_dates = [value for value in (span['last'], block_span['last']) if value]
+    first_year = min([current_year] + [value.year for value in first_dates])
+    last_year = max([current_year + YEARS_AHEAD] + [value.year for value in last_dates])
+    PropertyOccupancy.objects.filter(property_id=property_id).exclude(year__range=(first_year, last_year)).delete()
+    rebuild_occupancy(property_id, range(first_year, last_year + 1))
+
+
+def update_occupancy(property_id, removed=None, added=None):
+    """
+    Apply a booking change to the stored occupancy of a property: clear the
+    nights of the `removed` stay and set those of the `added` one, each a
+    (check_in_date, check_out_date) pair. Stored years are locked and
+    updated in place. When a stay is added, years that are not stored yet
+    are built from the bookings, which already include the change.
+    """
+    apply_stays(property_id, [removed] if removed else [], [added] if added else [])
+
+
+def apply_stays(property_id, removed, added):
+    """Like `update_occupancy`, for any number of removed and added stays at once."""
+    current_year = timezone.localdate().year
+    years = set(range(current_year, current_year + YEARS_AHEAD + 1))
+    for stay in removed + added:
+        years.update(get_years(*stay))
+
+    with transaction.atomic():
+        stored = PropertyOccupancy.objects.select_for_update().filter(property_id=property_id, year__in=years)
+        if removed:
+            # Calendar blocks may share nights with the removed stays, and
+            # those nights stay taken.
+            added = added + get_blocked_stays(property_id, min(stay[0] for stay in removed), max(stay[1] for stay in removed))
+        for row in stored:
+            years.discard(row.year)
+            bits = int.from_bytes(row.nights, 'little')
+            if removed:
+                bits &= ~build_bitmap(removed, row.year)
+            if added:
+                bits |= build_bitmap(added, row.year)
+            nights = bits.to_bytes(BITMAP_BYTES, 'little')
+            if nights != bytes(row.nights):
+                row.nights = nights
+                row.save(update_fields=['nights'])
+        if added:
+            rebuild_occupancy(property_id, years)
@@ -0,0 +1,106 @@
+from django.utils.functional import cached_property
+from properties.cache import get_cached
+from properties.pricing import divide_half_up, from_cents, to_cents
+
+
+class Quote:
+    """
+    The full price of one stay, computed once for a (property, dates, guests)
+    combination: the nightly breakdown, every fee amount and the split between
+    incorporated and separately shown fees.
+
+    All the arithmetic is done in integer cents and each amount is rounded
+    once, half up, exactly where the Decimal version rounded it; amounts are
+    turned back into Decimals only for the attributes read by callers.
+    """
+
+    def __init__(self, property, check_in_date, check_out_date, num_guests, calendar=None, fees=None, nightly_total=None):
+        self.property = property
+        self.check_in_date = check_in_date
+        self.check_out_date = check_out_date
+        self.num_guests = num_guests
+        self.nights = (check_out_date - check_in_date).days
+        self.calendar = calendar
+
+        # Callers that already know the sum of the nightly prices (e.g. from
+        # the stored nightly rates) can skip building the breakdown.
+        if nightly_total is not None:
+            self.nightly_total_cents = to_cents(nightly_total)
+        elif calendar is not None:
+            self.nightly_total_cents = calendar.total_cents(check_in_date, check_out_date)
+        else:
+            self.nightly_total_cents = sum(to_cents(day['price']) for day in self.breakdown)
+
+        if fees is None:
+            fees = property.fees.all()
+        self.fee_cents = [(fee, self.get_fee_cents(fee)) for fee in fees]
+
+        self.fees_total_cents = sum(cents for fee, cents in self.fee_cents)
+        self.total_price_cents = self.nightly_total_cents + self.fees_total_cents
+
+        self.nightly_total = self.base_total = from_cents(self.nightly_total_cents)
+        self.fees = [(fee, from_cents(cents)) for fee, cents in self.fee_cents]
+        self.fees_total = from_cents(self.fees_total_cents)
+        self.total_price = from_cents(self.total_price_cents)
+
+    @cached_property
+    def breakdown(self):
+        if self.calendar is not None:
+            return self.calendar.breakdown(self.check_in_date, self.check_out_date)
+        return self.property.get_price_breakdown(self.check_in_date, self.check_out_date)
+
+    def get_fee_cents(self, fee):
+        # Amounts and percentages both have two decimal places, so a
+        # percentage fee is nightly total (cents) * amount (hundredths of a
+        # percent) / 10000, rounded once after every multiplier is applied.
+        if fee.fee_type == 'percentage':
+            numerator, denominator = self.nightly_total_cents * to_cents(fee.amount), 10000
+        else:  # fixed amount
+            numerator, denominator = to_cents(fee.amount), 1
+
+        if fee.applies == 'per_night':
+            numerator *= self.nights
+
+        if fee.is_extra_guest_fee and self.num_guests > fee.extra_guest_threshold:
+            extra_guests = self.num_guests - fee.extra_guest_threshold
+            numerator *= extra_guests
+
+        return divide_half_up(numerator, denominator)
+
+    def get_fee_amount(self, fee):
+        return from_cents(self.get_fee_cents(fee))
+
+    @property
+    def incorporated_fees(self):
+        return [(fee, amount) for fee, amount in self.fees if fee.display_strategy == 'incorporated']
+
+    @property
+    def separate_fees(self):
+        return [(fee, amount) for fee, amount in self.fees if fee.display_strategy != 'incorporated']
+
+    @property
+    def incorporated_fees_total_cents(self):
+        return sum(cents for fee, cents in self.fee_cents if fee.display_strategy == 'incorporated')
+
+    @property
+    def incorporated_fees_total(self):
+        return from_cents(self.incorporated_fees_total_cents)
+
+    @property
+    def incorporated_fees_per_night(self):
+        if self.nights <= 0:
+            return from_cents(0)
+        return from_cents(divide_half_up(self.incorporated_fees_total_cents, self.nights))
+
+
+def get_quote(property, check_in_date, check_out_date, num_guests):
+    """A quote for the stay, reused from the pricing cache until the property or its rules change."""
+    def build():
+        return Quote(
+            property, check_in_date, check_out_date, num_guests,
+            calendar=getattr(property, '_price_calendar', None)
+        )
+
+    if property.pk is None:
+        return build()
+    return get_cached(property.pk, f'quote:{check_in_date}:{check_out_date}:{num_guests}', build)
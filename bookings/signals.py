@@ -1,15 +1,77 @@
-from django.db.models.signals import post_save
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from .models import Booking
+from properties.cache import AVAILABILITY_VERSION, bump_global_version
+from properties.models import Property
+from .models import ACTIVE_STATUSES, Booking, CalendarFeed
+from .occupancy import get_years, rebuild_occupancy, update_occupancy
 from api.webhooks import send_webhook
 from api.serializers import BookingSerializer
 
 @receiver(post_save, sender=Booking)
 def booking_saved(sender, instance, created, **kwargs):
     if created:
-        send_webhook('booking_created', BookingSerializer(instance).data)
+        event = 'booking_created'
+    elif instance.status == 'cancelled':
+        event = 'booking_cancelled'
     else:
-        if instance.status == 'cancelled':
-            send_webhook('booking_cancelled', BookingSerializer(instance).data)
-        else:
-            send_webhook('booking_updated', BookingSerializer(instance).data)
\ No newline at end of file
+        event = 'booking_updated'
+    # Queued in the booking's transaction; the webhook worker sends it once
+    # committed, so the property's lock is never held while subscribers are
+    # called. The payload is only built if the event has subscribers.
+    send_webhook(event, lambda: BookingSerializer(instance).data)
+
+
+def get_occupied_stay(property_id, check_in_date, check_out_date, status):
+    """The (property_id, check_in_date, check_out_date) a booking holds, or None if it holds no nights."""
+    if status not in ACTIVE_STATUSES:
+        return None
+    return property_id, check_in_date, check_out_date
+
+
+@receiver(post_save, sender=Booking)
+def update_booking_occupancy(sender, instance, created, **kwargs):
+    stay = get_occupied_stay(instance.property_id, instance.check_in_date, instance.check_out_date, instance.status)
+    loaded_stay = getattr(instance, '_loaded_stay', None)
+    previous = get_occupied_stay(*loaded_stay) if loaded_stay and not created else None
+    if previous != stay:
+        bump_global_version(AVAILABILITY_VERSION)
+        if previous and (not stay or previous[0] != stay[0]):
+            update_occupancy(previous[0], removed=previous[1:])
+            previous = None
+        if stay:
+            update_occupancy(stay[0], removed=previous[1:] if previous else None, added=stay[1:])
+    # Only once the occupancy is written: if the write fails, the save is
+    # rolled back and retried, and the retry must move the same stay again.
+    instance._loaded_stay = (instance.property_id, instance.check_in_date, instance.check_out_date, instance.status)
+
+
+@receiver(post_delete, sender=Booking)
+def clear_booking_occupancy(sender, instance, **kwargs):
+    if instance.status in ACTIVE_STATUSES:
+        update_occupancy(instance.property_id, removed=(instance.check_in_date, instance.check_out_date))
+        bump_global_version(AVAILABILITY_VERSION)
+
+
+def is_deleting_feed(origin):
+    # Feeds removed because their property is being deleted have no occupancy left to rebuild.
+    return isinstance(origin, CalendarFeed) or (isinstance(origin, QuerySet) and origin.model is CalendarFeed)
+
+
+@receiver(pre_delete, sender=CalendarFeed)
+def remember_feed_years(sender, instance, origin=None, **kwargs):
+    if is_deleting_feed(origin):
+        # Taken like `apply_feed()` takes it, before the blocks go.
+        list(Property.objects.select_for_update().filter(pk=instance.property_id).values_list('pk'))
+        instance._blocked_years = set()
+        for start_date, end_date in instance.blocks.values_list('start_date', 'end_date'):
+            instance._blocked_years.update(get_years(start_date, end_date))
+
+
+@receiver(post_delete, sender=CalendarFeed)
+def release_feed_blocks(sender, instance, **kwargs):
+    # The feed's blocks were deleted with it; the nights they held are free again.
+    years = getattr(instance, '_blocked_years', None)
+    if years:
+        rebuild_occupancy(instance.property_id, years)
+        bump_global_version(AVAILABILITY_VERSION)
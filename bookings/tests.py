@@ -1,3 +1,651 @@
-from django.test import TestCase
+import logging
+import random
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from unittest import mock
+from django.db import OperationalError, connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from rest_framework.test import APIClient
+from guests.models import Guest
+from owners.models import Owner
+from properties.cache import AVAILABILITY_VERSION, get_global_versions
+from properties.models import BookingRule, Fee, PricingRule, Property
+from api.models import OutboxEvent, WebhookSubscription
+from properties.pricing import PriceCalendar, round_price
+from .ical import get_export_key, sync_feeds
+from .importer import import_bookings
+from .models import Booking, CalendarBlock, CalendarFeed, PropertyOccupancy, assess_stay, get_neighbourhood
+from .occupancy import get_years, rebuild_occupancy, update_occupancy
+from .quote import Quote
 
-# Create your tests here.
+
+logger = logging.getLogger(__name__)
+
+
+def decimal_quote(property, rules, fees, check_in_date, check_out_date, num_guests):
+    """The Decimal arithmetic the integer-cents quote replaced, kept as the reference."""
+    calendar = PriceCalendar(property.nightly_rate, rules)
+    nights = (check_out_date - check_in_date).days
+
+    nightly_prices = []
+    for rule in calendar.rules_for_range(check_in_date, check_out_date):
+        nightly_prices.append(round_price(calendar.get_price(rule)))
+    nightly_total = sum(nightly_prices, Decimal('0.00'))
+
+    fee_amounts = []
+    for fee in fees:
+        if fee.fee_type == 'percentage':
+            fee_amount = nightly_total * (fee.amount / Decimal('100'))
+        else:
+            fee_amount = fee.amount
+        if fee.applies == 'per_night':
+            fee_amount *= nights
+        if fee.is_extra_guest_fee and num_guests > fee.extra_guest_threshold:
+            fee_amount *= num_guests - fee.extra_guest_threshold
+        fee_amounts.append(round_price(fee_amount))
+
+    incorporated_total = sum(
+        (amount for fee, amount in zip(fees, fee_amounts) if fee.display_strategy == 'incorporated'),
+        Decimal('0.00')
+    )
+    base_total = round_price(nightly_total)
+    fees_total = round_price(sum(fee_amounts, Decimal('0.00')))
+    return {
+        'nightly_prices': nightly_prices,
+        'base_total': base_total,
+        'fees': fee_amounts,
+        'fees_total': fees_total,
+        'total_price': base_total + fees_total,
+        'incorporated_fees_total': incorporated_total,
+        'incorporated_fees_per_night': round_price(incorporated_total / nights),
+    }
+
+
+def random_amount(rng, low, high):
+    return Decimal(rng.randint(low, high)) / 100
+
+
+class QuoteGoldenTests(SimpleTestCase):
+    """The integer-cents quote must agree with the Decimal arithmetic to the cent."""
+
+    seed = 20240601
+    cases = 2000
+
+    def random_property(self, rng):
+        start = date(2025, 1, 1)
+        property = Property(nightly_rate=random_amount(rng, 1, 99999999))
+
+        rules = []
+        for index in range(rng.randint(0, 8)):
+            rule_type = rng.choice(['weekend', 'seasonal', 'override'])
+            rule_start = start + timedelta(days=rng.randint(0, 120))
+            rules.append(PricingRule(
+                pk=index + 1,
+                rule_type=rule_type,
+                start_date=rule_start,
+                end_date=rule_start + timedelta(days=rng.randint(0, 30)) if rule_type == 'seasonal' else None,
+                price_modifier=random_amount(rng, 1, 99999),
+            ))
+
+        fees = []
+        for index in range(rng.randint(0, 5)):
+            is_extra_guest_fee = rng.random() < 0.3
+            fee_type = rng.choice(['percentage', 'fixed'])
+            fees.append(Fee(
+                pk=index + 1,
+                fee_type=fee_type,
+                applies=rng.choice(['per_night', 'once']),
+                display_strategy=rng.choice(['separate', 'incorporated']),
+                amount=random_amount(rng, 0, 10000 if fee_type == 'percentage' else 9999999),
+                is_extra_guest_fee=is_extra_guest_fee,
+                extra_guest_threshold=rng.randint(1, 6) if is_extra_guest_fee else None,
+            ))
+        return property, rules, fees
+
+    def test_matches_decimal_arithmetic(self):
+        rng = random.Random(self.seed)
+        for case in range(self.cases):
+            property, rules, fees = self.random_property(rng)
+            check_in_date = date(2025, 1, 1) + timedelta(days=rng.randint(0, 150))
+            check_out_date = check_in_date + timedelta(days=rng.randint(1, 40))
+            num_guests = rng.randint(1, 10)
+
+            expected = decimal_quote(property, rules, fees, check_in_date, check_out_date, num_guests)
+            quote = Quote(
+                property, check_in_date, check_out_date, num_guests,
+                calendar=PriceCalendar(property.nightly_rate, rules), fees=fees
+            )
+
+            with self.subTest(case=case):
+                self.assertEqual([day['price'] for day in quote.breakdown], expected['nightly_prices'])
+                self.assertEqual(quote.base_total, expected['base_total'])
+                self.assertEqual([amount for fee, amount in quote.fees], expected['fees'])
+                self.assertEqual(quote.fees_total, expected['fees_total'])
+                self.assertEqual(quote.total_price, expected['total_price'])
+                self.assertEqual(quote.incorporated_fees_total, expected['incorporated_fees_total'])
+                self.assertEqual(quote.incorporated_fees_per_night, expected['incorporated_fees_per_night'])
+
+    def test_rounds_half_up(self):
+        property = Property(nightly_rate=Decimal('0.05'))
+        rules = [PricingRule(pk=1, rule_type='override', start_date=date(2025, 1, 1), price_modifier=Decimal('50.00'))]
+        fees = [Fee(pk=1, fee_type='percentage', applies='once', display_strategy='incorporated',
+                    amount=Decimal('12.50'), is_extra_guest_fee=False)]
+        quote = Quote(
+            property, date(2025, 1, 1), date(2025, 1, 3), 1,
+            calendar=PriceCalendar(property.nightly_rate, rules), fees=fees
+        )
+        # 0.025 and 0.0875 both round up, not to even.
+        self.assertEqual([day['price'] for day in quote.breakdown], [Decimal('0.03'), Decimal('0.05')])
+        self.assertEqual(quote.fees_total, Decimal('0.01'))
+        self.assertEqual(quote.incorporated_fees_per_night, Decimal('0.01'))
+
+
+class AssessStayTests(SimpleTestCase):
+    def test_gap_stay_between_two_stays(self):
+        stays = [(date(2031, 1, 1), date(2031, 1, 5)), (date(2031, 1, 7), date(2031, 1, 10))]
+        self.assertEqual(assess_stay(stays, date(2031, 1, 5), date(2031, 1, 7)), (False, True))
+        # Bordering only one of them is not a gap stay.
+        self.assertEqual(assess_stay(stays, date(2031, 1, 5), date(2031, 1, 6)), (False, False))
+        self.assertEqual(assess_stay(stays, date(2031, 1, 6), date(2031, 1, 7)), (False, False))
+
+    def test_overlaps(self):
+        stays = [(date(2031, 1, 1), date(2031, 1, 5))]
+        self.assertEqual(assess_stay(stays, date(2031, 1, 4), date(2031, 1, 6))[0], True)
+        self.assertEqual(assess_stay(stays, date(2030, 12, 30), date(2031, 1, 2))[0], True)
+        self.assertEqual(assess_stay(stays, date(2031, 1, 2), date(2031, 1, 3))[0], True)
+        self.assertEqual(assess_stay(stays, date(2031, 1, 5), date(2031, 1, 8))[0], False)
+        self.assertEqual(assess_stay([], date(2031, 1, 5), date(2031, 1, 8)), (False, False))
+
+    def test_overlapping_stays(self):
+        # Calendar blocks can overlap bookings and each other.
+        stays = [(date(2031, 1, 1), date(2031, 1, 5)), (date(2031, 1, 3), date(2031, 1, 6)), (date(2031, 1, 8), date(2031, 1, 9))]
+        self.assertEqual(assess_stay(stays, date(2031, 1, 6), date(2031, 1, 8)), (False, True))
+        self.assertEqual(assess_stay(stays, date(2031, 1, 5), date(2031, 1, 8)), (True, True))
+
+
+class NeighbourhoodTests(TestCase):
+    def setUp(self):
+        owner = Owner.objects.create(first_name='Olive', last_name='Owner', email='owner@example.com', phone='1', address='1 Road')
+        self.guest = Guest.objects.create(first_name='Gus', last_name='Guest', email='guest@example.com', phone='1')
+        self.property = Property.objects.create(
+            name='Property', address='1 Road', owner=owner, bedrooms=1, bathrooms=1,
+            max_occupancy=4, nightly_rate=Decimal('100.00'), description='', minimum_stay=3
+        )
+        self.bookings = [self.book(check_in_date, check_out_date) for check_in_date, check_out_date in [
+            (date(2031, 1, 1), date(2031, 1, 5)),
+            (date(2031, 1, 7), date(2031, 1, 10)),
+            (date(2031, 1, 20), date(2031, 1, 25)),
+            (date(2031, 2, 1), date(2031, 2, 5)),
+        ]]
+
+    def book(self, check_in_date, check_out_date, **fields):
+        booking = Booking(property=self.property, guest=self.guest, num_guests=1, check_in_date=check_in_date, check_out_date=check_out_date, **fields)
+        booking.save()
+        return booking
+
+    def move(self, booking, check_in_date, check_out_date):
+        # Saving a booking that already exists checks it against get_neighbourhood().
+        booking = Booking.objects.get(pk=booking.pk)
+        booking.check_in_date, booking.check_out_date = check_in_date, check_out_date
+        booking.save()
+
+    def neighbourhood(self, check_in_date, check_out_date, exclude_pk=None):
+        return sorted(get_neighbourhood(self.property, check_in_date, check_out_date, exclude_pk=exclude_pk))
+
+    def test_only_bookings_that_can_overlap_or_border_the_stay(self):
+        # The last booking starting before the check-in, and those starting up to the check-out.
+        self.assertEqual(self.neighbourhood(date(2031, 1, 12), date(2031, 1, 20)), [
+            (date(2031, 1, 7), date(2031, 1, 10)), (date(2031, 1, 20), date(2031, 1, 25))
+        ])
+        self.assertEqual(self.neighbourhood(date(2031, 1, 5), date(2031, 1, 7)), [
+            (date(2031, 1, 1), date(2031, 1, 5)), (date(2031, 1, 7), date(2031, 1, 10))
+        ])
+
+    def test_gap_stay_is_allowed_below_the_minimum_stay(self):
+        with self.assertRaises(ValidationError):
+            self.move(self.bookings[3], date(2031, 1, 12), date(2031, 1, 14))
+        self.move(self.bookings[3], date(2031, 1, 5), date(2031, 1, 7))
+
+    def test_cancelled_bookings_are_ignored(self):
+        self.bookings[1].status = 'cancelled'
+        self.bookings[1].save()
+        self.assertEqual(self.neighbourhood(date(2031, 1, 5), date(2031, 1, 7)), [(date(2031, 1, 1), date(2031, 1, 5))])
+        # Its nights are free again, but no longer a gap.
+        self.move(self.bookings[2], date(2031, 1, 8), date(2031, 1, 11))
+        with self.assertRaises(ValidationError):
+            self.move(self.bookings[3], date(2031, 1, 5), date(2031, 1, 7))
+
+    def test_updated_booking_is_not_checked_against_itself(self):
+        booking = self.bookings[1]
+        self.assertNotIn((booking.check_in_date, booking.check_out_date), self.neighbourhood(date(2031, 1, 8), date(2031, 1, 11), exclude_pk=booking.pk))
+        self.move(booking, date(2031, 1, 8), date(2031, 1, 11))
+        # Moving into another booking is still refused.
+        with self.assertRaises(ValidationError):
+            self.move(booking, date(2031, 1, 18), date(2031, 1, 21))
+
+    def test_blocks_overlapping_bookings(self):
+        feed = CalendarFeed.objects.create(property=self.property, url='http://calendar.example/feed.ics')
+        CalendarBlock.objects.create(feed=feed, property=self.property, uid='a', start_date=date(2031, 1, 3), end_date=date(2031, 1, 12))
+        with self.assertNumQueries(1):
+            neighbourhood = self.neighbourhood(date(2031, 1, 12), date(2031, 1, 15))
+        self.assertIn((date(2031, 1, 3), date(2031, 1, 12)), neighbourhood)
+        self.assertEqual(assess_stay(neighbourhood, date(2031, 1, 12), date(2031, 1, 15)), (False, False))
+        self.assertTrue(assess_stay(self.neighbourhood(date(2031, 1, 10), date(2031, 1, 12)), date(2031, 1, 10), date(2031, 1, 12))[0])
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    """Bookings made from many threads at once never overlap."""
+
+    threads = 8
+    attempts_per_thread = 40
+
+    def setUp(self):
+        owner = Owner.objects.create(first_name='Olive', last_name='Owner', email='owner@example.com', phone='1', address='1 Road')
+        self.guest = Guest.objects.create(first_name='Gus', last_name='Guest', email='guest@example.com', phone='1')
+        self.properties = [
+            Property.objects.create(
+                name=f'Property {index}', address='1 Road', owner=owner, bedrooms=1, bathrooms=1,
+                max_occupancy=4, nightly_rate=Decimal('100.00'), description='', allow_gap_stays=False
+            )
+            for index in range(4)
+        ]
+
+    def book_randomly(self, seed, outcomes):
+        rng = random.Random(seed)
+        try:
+            for attempt in range(self.attempts_per_thread):
+                check_in_date = date(2030, 1, 1) + timedelta(days=rng.randint(0, 60))
+                booking = Booking(
+                    property=rng.choice(self.properties), guest=self.guest, num_guests=1,
+                    check_in_date=check_in_date, check_out_date=check_in_date + timedelta(days=rng.randint(1, 5))
+                )
+                try:
+                    booking.save()
+                    outcomes.append('created')
+                except ValidationError:
+                    outcomes.append('rejected')
+                except Exception as e:
+                    outcomes.append(repr(e))
+        finally:
+            connections.close_all()
+
+    def test_no_double_bookings(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("SQLite's shared in-memory test database does not wait for locks; run against a file or server database.")
+
+        outcomes = []
+        workers = [threading.Thread(target=self.book_randomly, args=(seed, outcomes)) for seed in range(self.threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        created = outcomes.count('created')
+        logger.info(
+            "%d bookings created, %d rejected in %.2fs (%.0f bookings/s)",
+            created, outcomes.count('rejected'), elapsed, created / elapsed
+        )
+        self.assertEqual([outcome for outcome in outcomes if outcome not in ('created', 'rejected')], [])
+        self.assertGreater(created, 0)
+
+        for property in self.properties:
+            stays = sorted(property.bookings.values_list('check_in_date', 'check_out_date'))
+            for (check_in_date, check_out_date), (next_check_in_date, next_check_out_date) in zip(stays, stays[1:]):
+                self.assertLessEqual(check_out_date, next_check_in_date)
+
+
+def stored_occupancy(property):
+    return {year: bytes(nights) for year, nights in PropertyOccupancy.objects.filter(property=property).values_list('year', 'nights')}
+
+
+class OccupancyTests(TransactionTestCase):
+    """The occupancy kept up to date booking by booking matches one rebuilt from the bookings."""
+
+    seed = 20240710
+    operations = 200
+
+    def setUp(self):
+        owner = Owner.objects.create(first_name='Olive', last_name='Owner', email='owner@example.com', phone='1', address='1 Road')
+        self.guest = Guest.objects.create(first_name='Gus', last_name='Guest', email='guest@example.com', phone='1')
+        self.properties = [
+            Property.objects.create(
+                name=f'Property {index}', address='1 Road', owner=owner, bedrooms=1, bathrooms=1,
+                max_occupancy=4, nightly_rate=Decimal('100.00'), description=''
+            )
+            for index in range(3)
+        ]
+
+    def assertOccupancyRebuilds(self, property):
+        stored = stored_occupancy(property)
+        for check_in_date, check_out_date in property.bookings.exclude(status='cancelled').values_list('check_in_date', 'check_out_date'):
+            self.assertTrue(set(get_years(check_in_date, check_out_date)) <= set(stored))
+        rebuild_occupancy(property.pk, stored)
+        self.assertEqual(stored, stored_occupancy(property))
+
+    def random_stay(self, rng):
+        # Around the turn of a year, so stays span two stored years.
+        check_in_date = date(2031, 12, 1) + timedelta(days=rng.randint(0, 60))
+        return check_in_date, check_in_date + timedelta(days=rng.randint(1, 10))
+
+    def test_matches_rebuild(self):
+        rng = random.Random(self.seed)
+        for operation in range(self.operations):
+            bookings = list(Booking.objects.all())
+            action = rng.choice(['create', 'create', 'move', 'cancel', 'restore', 'delete']) if bookings else 'create'
+            booking = rng.choice(bookings) if bookings else None
+            if action == 'create':
+                check_in_date, check_out_date = self.random_stay(rng)
+                booking = Booking(
+                    property=rng.choice(self.properties), guest=self.guest, num_guests=1,
+                    check_in_date=check_in_date, check_out_date=check_out_date
+                )
+            elif action == 'move':
+                booking.check_in_date, booking.check_out_date = self.random_stay(rng)
+                if rng.random() < 0.3:
+                    booking.property = rng.choice(self.properties)
+            elif action == 'cancel':
+                booking.status = 'cancelled'
+            elif action == 'restore':
+                booking.status = 'confirmed'
+            try:
+                booking.delete() if action == 'delete' else booking.save()
+            except ValidationError:
+                pass
+            with self.subTest(operation=operation, action=action):
+                for property in self.properties:
+                    self.assertOccupancyRebuilds(property)
+
+    def test_retried_save_moves_the_stay(self):
+        booking = Booking(
+            property=self.properties[0], guest=self.guest, num_guests=1,
+            check_in_date=date(2031, 12, 30), check_out_date=date(2032, 1, 3)
+        )
+        booking.save()
+        booking = Booking.objects.get(pk=booking.pk)
+        booking.check_in_date, booking.check_out_date = date(2032, 1, 10), date(2032, 1, 12)
+
+        # The first write of the occupancy fails as a lock timeout would.
+        calls = []
+
+        def update_once_failing(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return update_occupancy(*args, **kwargs)
+
+        with mock.patch('bookings.signals.update_occupancy', update_once_failing), mock.patch('bookings.models.SAVE_BACKOFF', 0):
+            booking.save()
+        self.assertEqual(len(calls), 2)
+        self.assertOccupancyRebuilds(self.properties[0])
+
+
+class ImportTests(TestCase):
+    def setUp(self):
+        owner = Owner.objects.create(first_name='Olive', last_name='Owner', email='owner@example.com', phone='1', address='1 Road')
+        self.guest = Guest.objects.create(first_name='Gus', last_name='Guest', email='guest@example.com', phone='1')
+        self.properties = [self.create_property(owner, f'Property {index}') for index in range(2)]
+
+    def create_property(self, owner, name):
+        property = Property.objects.create(
+            name=name, address='1 Road', owner=owner, bedrooms=1, bathrooms=1, max_occupancy=4,
+            nightly_rate=Decimal('100.00'), description='', minimum_stay=3, no_checkin_days='6'
+        )
+        BookingRule.objects.create(property=property, start_date=date(2031, 7, 1), end_date=date(2031, 8, 31), min_nights=5)
+        PricingRule.objects.create(property=property, rule_type='weekend', price_modifier=Decimal('125.00'))
+        Fee.objects.create(property=property, name='Cleaning', fee_type='fixed', applies='once', display_strategy='separate', amount=Decimal('40.00'))
+        return property
+
+    def row(self, check_in_date, check_out_date, property=None, **fields):
+        return {
+            'property': str((property or self.properties[0]).pk), 'guest': str(self.guest.pk),
+            'check_in_date': check_in_date.isoformat(), 'check_out_date': check_out_date.isoformat(),
+            'num_guests': '2', **fields
+        }
+
+    def run_import(self, rows, chunk_size=1000):
+        rejects = []
+        summary = import_bookings(rows, chunk_size=chunk_size, on_reject=rejects.append)
+        return summary, {reject['row']: reject['errors'] for reject in rejects}
+
+    def test_rejects_carry_their_row_numbers(self):
+        summary, rejects = self.run_import([
+            self.row(date(2031, 1, 6), date(2031, 1, 9)),
+            self.row(date(2031, 1, 6), date(2031, 1, 9), property=Property(pk=999999)),
+            {**self.row(date(2031, 2, 6), date(2031, 2, 9)), 'guest': '999999'},
+            {**self.row(date(2031, 2, 6), date(2031, 2, 9)), 'check_in_date': '6 February'},
+            self.row(date(2031, 2, 9), date(2031, 2, 6)),
+            self.row(date(2031, 3, 6), date(2031, 3, 7)),
+            'not a row',
+            self.row(date(2031, 3, 10), date(2031, 3, 13)),
+        ])
+        self.assertEqual((summary['created'], summary['rejected']), (2, 6))
+        self.assertEqual(sorted(rejects), [2, 3, 4, 5, 6, 7])
+        self.assertEqual(rejects[2], ['Property not found.'])
+        self.assertEqual(rejects[3], ['Guest not found.'])
+        self.assertEqual(rejects[4], ['check_in_date must be a date as YYYY-MM-DD.'])
+        self.assertEqual(rejects[5], ['Check-out date must be after check-in date.'])
+        self.assertIn('minimum stay', rejects[6][0])
+
+    def test_overlaps_within_and_across_chunks(self):
+        self.run_import([self.row(date(2031, 1, 6), date(2031, 1, 10))])
+        summary, rejects = self.run_import([
+            self.row(date(2031, 1, 8), date(2031, 1, 12)),   # the booking imported before
+            self.row(date(2031, 1, 13), date(2031, 1, 17)),
+            self.row(date(2031, 1, 15), date(2031, 1, 19)),  # row 2, in the same chunk
+            self.row(date(2031, 1, 16), date(2031, 1, 20)),  # row 2, in an earlier chunk
+            self.row(date(2031, 1, 17), date(2031, 1, 20)),
+            self.row(date(2031, 1, 15), date(2031, 1, 19), status='cancelled'),
+        ], chunk_size=3)
+        self.assertEqual(sorted(rejects), [1, 3, 4])
+        self.assertEqual(rejects[1], ['This booking overlaps with an existing booking.'])
+        self.assertEqual(summary['created'], 3)
+
+    def test_gap_stays_between_rows_of_the_chunk(self):
+        summary, rejects = self.run_import([
+            self.row(date(2031, 1, 10), date(2031, 1, 11)),  # not a gap yet
+            self.row(date(2031, 1, 6), date(2031, 1, 10)),
+            self.row(date(2031, 1, 11), date(2031, 1, 15)),
+            self.row(date(2031, 1, 10), date(2031, 1, 11)),  # fills the gap the two rows above leave
+        ])
+        self.assertEqual(sorted(rejects), [1])
+        self.assertEqual(summary['created'], 3)
+
+    def test_updates_occupancy_and_availability(self):
+        versions = get_global_versions([AVAILABILITY_VERSION])
+        self.run_import([
+            self.row(date(2031, 12, 29), date(2032, 1, 3)),
+            self.row(date(2031, 1, 6), date(2031, 1, 10), property=self.properties[1]),
+        ])
+        self.assertNotEqual(get_global_versions([AVAILABILITY_VERSION]), versions)
+        for property in self.properties:
+            stored = stored_occupancy(property)
+            rebuild_occupancy(property.pk, stored)
+            self.assertEqual(stored, stored_occupancy(property))
+        # New bookings are checked against the stored occupancy.
+        with self.assertRaises(ValidationError):
+            Booking(property=self.properties[0], guest=self.guest, num_guests=1, check_in_date=date(2032, 1, 1), check_out_date=date(2032, 1, 5)).save()
+
+    def test_sends_one_summary_webhook(self):
+        user = User.objects.create_user('owner')
+        for event in ('booking_created', 'bookings_imported'):
+            WebhookSubscription.objects.create(user=user, event=event, target_url='http://hooks.example/')
+        summary, rejects = self.run_import([
+            self.row(date(2031, 1, 6) + timedelta(days=7 * index), date(2031, 1, 10) + timedelta(days=7 * index))
+            for index in range(5)
+        ] + [self.row(date(2031, 1, 6), date(2031, 1, 10))], chunk_size=2)
+        self.assertEqual(list(OutboxEvent.objects.values_list('event', 'payload')), [
+            ('bookings_imported', {'created': 5, 'rejected': 1, 'properties': [self.properties[0].pk]})
+        ])
+
+    def test_matches_booking_save(self):
+        # The same random rows, imported for one property and saved one by
+        # one for its twin, are accepted, rejected and priced alike.
+        rng = random.Random(20240720)
+        imported, saved = self.properties
+        rows = []
+        for index in range(300):
+            check_in_date = date(2031, 6, 1) + timedelta(days=rng.randint(0, 120))
+            check_out_date = check_in_date + timedelta(days=rng.randint(1, 8))
+            rows.append(self.row(check_in_date, check_out_date, property=imported, status=rng.choice(['pending', 'confirmed', 'cancelled'])))
+        self.run_import(rows, chunk_size=40)
+
+        for row in rows:
+            booking = Booking(
+                property=saved, guest=self.guest, num_guests=int(row['num_guests']), status=row['status'],
+                check_in_date=date.fromisoformat(row['check_in_date']), check_out_date=date.fromisoformat(row['check_out_date'])
+            )
+            try:
+                booking.save()
+            except ValidationError:
+                pass
+
+        def outcome(property):
+            return sorted(property.bookings.values_list('check_in_date', 'check_out_date', 'status', 'base_total', 'fees_total', 'total_price'))
+        self.assertGreater(len(outcome(imported)), 50)
+        self.assertEqual(outcome(imported), outcome(saved))
+
+
+class FeedServer(ThreadingHTTPServer):
+    """A local stand-in for external calendars: serves `feeds` by path and honours If-None-Match."""
+
+    def __init__(self):
+        self.feeds = {}
+        self.requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                body = self.feeds.get(handler.path)
+                self.requests.append((handler.path, handler.headers.get('If-None-Match')))
+                if body is None:
+                    handler.send_response(404)
+                    handler.end_headers()
+                    return
+                etag = f'"{hash(body)}"'
+                if handler.headers.get('If-None-Match') == etag:
+                    handler.send_response(304)
+                    handler.send_header('ETag', etag)
+                    handler.end_headers()
+                    return
+                handler.send_response(200)
+                handler.send_header('ETag', etag)
+                handler.send_header('Content-Type', 'text/calendar')
+                handler.send_header('Content-Length', str(len(body.encode())))
+                handler.end_headers()
+                handler.wfile.write(body.encode())
+
+            def log_message(handler, *args):
+                pass
+
+        super().__init__(('127.0.0.1', 0), Handler)
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server_address[1]}{path}'
+
+
+def ics(*events):
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0']
+    for uid, start_date, end_date in events:
+        lines += [
+            'BEGIN:VEVENT', f'UID:{uid}', f"DTSTART;VALUE=DATE:{start_date:%Y%m%d}", f"DTEND;VALUE=DATE:{end_date:%Y%m%d}",
+            'SUMMARY:Not available', 'BEGIN:VALARM', 'TRIGGER:-PT15M', 'END:VALARM', 'END:VEVENT'
+        ]
+    return '\r\n'.join(lines + ['END:VCALENDAR'])
+
+
+class CalendarSyncTests(TestCase):
+    def setUp(self):
+        self.server = FeedServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        owner = Owner.objects.create(first_name='Olive', last_name='Owner', email='owner@example.com', phone='1', address='1 Road')
+        self.guest = Guest.objects.create(first_name='Gus', last_name='Guest', email='guest@example.com', phone='1')
+        self.properties = [
+            Property.objects.create(
+                name=f'Property {index}', address='1 Road', owner=owner, bedrooms=1, bathrooms=1,
+                max_occupancy=4, nightly_rate=Decimal('100.00'), description='', minimum_stay=1
+            )
+            for index in range(3)
+        ]
+        self.feeds = []
+        for property in self.properties:
+            self.server.feeds[f'/{property.pk}.ics'] = ics(
+                ('a@other', date(2031, 1, 10), date(2031, 1, 14)),
+                ('b@other', date(2031, 2, 1), date(2031, 2, 3)),
+                ('booking-1@propertymentor', date(2031, 3, 1), date(2031, 3, 5)),
+            )
+            self.feeds.append(CalendarFeed.objects.create(property=property, url=self.server.url(f'/{property.pk}.ics')))
+
+    def test_sync_writes_only_what_changed(self):
+        results = sync_feeds(self.feeds, workers=3)
+        self.assertEqual([results[feed]['created'] for feed in self.feeds], [2, 2, 2])
+        kept = CalendarBlock.objects.get(feed=self.feeds[0], uid='a@other')
+
+        # Unchanged feeds are answered with 304 Not Modified.
+        results = sync_feeds(CalendarFeed.objects.all())
+        self.assertEqual({result['status'] for result in results.values()}, {'not_modified'})
+        self.assertTrue(all(etag for path, etag in self.server.requests[-3:]))
+
+        self.server.feeds[f'/{self.properties[0].pk}.ics'] = ics(
+            ('a@other', date(2031, 1, 10), date(2031, 1, 14)),
+            ('b@other', date(2031, 2, 2), date(2031, 2, 4)),
+            ('c@other', date(2031, 4, 1), date(2031, 4, 2)),
+        )
+        results = sync_feeds(CalendarFeed.objects.all())
+        result = next(result for feed, result in results.items() if feed.pk == self.feeds[0].pk)
+        self.assertEqual((result['created'], result['updated'], result['deleted']), (1, 1, 0))
+        self.assertEqual(CalendarBlock.objects.get(uid='a@other', feed=self.feeds[0]).pk, kept.pk)
+        self.assertEqual(
+            sorted(CalendarBlock.objects.filter(feed=self.feeds[0]).values_list('uid', 'start_date')),
+            [('a@other', date(2031, 1, 10)), ('b@other', date(2031, 2, 2)), ('c@other', date(2031, 4, 1))]
+        )
+
+    def test_blocks_make_dates_unavailable(self):
+        sync_feeds(self.feeds)
+        property = self.properties[0]
+        with self.assertRaises(ValidationError):
+            Booking(property=property, guest=self.guest, num_guests=1, check_in_date=date(2031, 1, 12), check_out_date=date(2031, 1, 16)).save()
+        # Our own exported bookings are not imported back as blocks.
+        Booking(property=property, guest=self.guest, num_guests=1, check_in_date=date(2031, 3, 1), check_out_date=date(2031, 3, 5)).save()
+
+    def test_deleting_a_feed_frees_its_dates(self):
+        sync_feeds(self.feeds)
+        property = self.properties[0]
+        versions = get_global_versions([AVAILABILITY_VERSION])
+
+        self.feeds[0].delete()
+        self.assertNotEqual(get_global_versions([AVAILABILITY_VERSION]), versions)
+        Booking(property=property, guest=self.guest, num_guests=1, check_in_date=date(2031, 1, 12), check_out_date=date(2031, 1, 16)).save()
+        # The other properties keep their blocks.
+        with self.assertRaises(ValidationError):
+            Booking(property=self.properties[1], guest=self.guest, num_guests=1, check_in_date=date(2031, 1, 12), check_out_date=date(2031, 1, 16)).save()
+
+    def test_export_is_conditional(self):
+        property = self.properties[0]
+        Booking(property=property, guest=self.guest, num_guests=1, check_in_date=date(2031, 5, 1), check_out_date=date(2031, 5, 4)).save()
+        client = APIClient()
+        url = f'/api/properties/{property.pk}/calendar.ics'
+
+        self.assertEqual(client.get(url).status_code, 403)
+        response = client.get(url, {'key': get_export_key(property.pk)})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'DTSTART;VALUE=DATE:20310501', response.content)
+        # Another change could still come in the second of the last one.
+        self.assertNotIn('Last-Modified', response)
+
+        client.force_authenticate(User.objects.create_user('owner'))
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        with mock.patch('time.time', return_value=time.time() + 1):
+            last_modified = client.get(url)['Last-Modified']
+            self.assertEqual(client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        Booking(property=property, guest=self.guest, num_guests=1, check_in_date=date(2031, 6, 1), check_out_date=date(2031, 6, 4)).save()
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django import forms
+from django.urls import reverse
 from .models import Property, PricingRule, BookingRule, Fee
 
 class PropertyAdminForm(forms.ModelForm):
@@ -43,6 +44,15 @@ class PropertyAdmin(admin.ModelAdmin):
     list_filter = ('bedrooms', 'bathrooms', 'minimum_stay')
     search_fields = ('name', 'address', 'owner__first_name', 'owner__last_name')
     inlines = [PricingRuleInline, BookingRuleInline, FeeInline]
+    readonly_fields = ('calendar_export_url',)
+
+    def calendar_export_url(self, obj):
+        if not obj.pk:
+            return "The calendar export will be available after saving."
+        from bookings.ical import get_export_key
+        return f"{reverse('property-ical', args=[obj.pk])}?key={get_export_key(obj.pk)}"
+
+    calendar_export_url.short_description = "Calendar export (iCal)"
 
     def get_form(self, request, obj=None, **kwargs):
         form = super().get_form(request, obj, **kwargs)
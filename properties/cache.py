@@ -0,0 +1,220 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+CACHE_ALIAS = getattr(settings, 'PRICING_CACHE_ALIAS', 'default')
+CACHE_TIMEOUT = getattr(settings, 'PRICING_CACHE_TIMEOUT', 60 * 60)
+LOCAL_CACHE_SIZE = getattr(settings, 'PRICING_CACHE_LOCAL_SIZE', 2048)
+
+# Collections with a global version: any property, rule or fee, and any
+# booking or calendar block.
+PROPERTIES_VERSION = 'properties'
+AVAILABILITY_VERSION = 'availability'
+
+
+class LRUCache:
+    """
+    A small thread-safe least-recently-used cache that counts its hits and
+    misses. With a `timeout`, entries expire that many seconds after they
+    were set.
+    """
+
+    def __init__(self, maxsize, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.timeout if self.timeout is not None else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'size': len(self),
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+
+local_cache = LRUCache(LOCAL_CACHE_SIZE)
+
+
+def get_shared_cache():
+    return caches[CACHE_ALIAS]
+
+
+def _version_key(property_id):
+    return f'pricing:version:{property_id}'
+
+
+def get_property_versions(property_ids):
+    """
+    The current cache version of each property. Versions are random tokens
+    rather than counters, so a version that falls out of the shared cache is
+    never handed out again with different data behind it.
+    """
+    shared_cache = get_shared_cache()
+    keys = {property_id: _version_key(property_id) for property_id in property_ids}
+    found = shared_cache.get_many(keys.values())
+
+    versions = {}
+    for property_id, key in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            if not shared_cache.add(key, version, timeout=None):
+                version = shared_cache.get(key, version)
+        versions[property_id] = version
+    return versions
+
+
+def get_property_version(property_id):
+    return get_property_versions([property_id])[property_id]
+
+
+def bump_property_version(property_id):
+    key = _version_key(property_id)
+    get_shared_cache().set(key, uuid.uuid4().hex, timeout=None)
+    # Bump again once the change is committed, in case another process cached
+    # the old data under the new version before it became visible.
+    transaction.on_commit(lambda: get_shared_cache().set(key, uuid.uuid4().hex, timeout=None))
+
+
+def get_global_versions(names):
+    """
+    The current version of each named collection (e.g. every property, or
+    every booking) as (token, changed_at), where `changed_at` is the Unix
+    time of the change that set it. Like property versions, tokens are
+    random and live in the shared cache without expiry.
+    """
+    shared_cache = get_shared_cache()
+    keys = {name: f'version:{name}' for name in names}
+    found = shared_cache.get_many(keys.values())
+
+    versions = {}
+    for name, key in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = (uuid.uuid4().hex, int(time.time()))
+            if not shared_cache.add(key, version, timeout=None):
+                version = shared_cache.get(key, version)
+        versions[name] = version
+    return versions
+
+
+def bump_global_version(name):
+    def bump():
+        get_shared_cache().set(f'version:{name}', (uuid.uuid4().hex, int(time.time())), timeout=None)
+    bump()
+    transaction.on_commit(bump)
+
+
+def get_many_cached(property_ids, name, build_many):
+    """
+    Fetch a value per property from the local LRU, then the shared cache, and
+    build whatever is still missing with `build_many(property_ids)`, which
+    returns a dict. Entries are keyed by the property's current version, so
+    any change to the property or its rules makes them unreachable.
+    """
+    versions = get_property_versions(property_ids)
+    keys = {property_id: f'pricing:{property_id}:{versions[property_id]}:{name}' for property_id in property_ids}
+
+    values = {}
+    for property_id, key in keys.items():
+        value = local_cache.get(key)
+        if value is not None:
+            values[property_id] = value
+
+    missing = [property_id for property_id in property_ids if property_id not in values]
+    if missing:
+        shared_cache = get_shared_cache()
+        found = shared_cache.get_many([keys[property_id] for property_id in missing])
+        for property_id in missing:
+            value = found.get(keys[property_id])
+            if value is not None:
+                values[property_id] = value
+                local_cache.set(keys[property_id], value)
+
+        missing = [property_id for property_id in missing if property_id not in values]
+        if missing:
+            built = {property_id: value for property_id, value in build_many(missing).items() if value is not None}
+            shared_cache.set_many({keys[property_id]: value for property_id, value in built.items()}, timeout=CACHE_TIMEOUT)
+            for property_id, value in built.items():
+                local_cache.set(keys[property_id], value)
+            values.update(built)
+
+    return values
+
+
+def get_cached(property_id, name, build):
+    return get_many_cached([property_id], name, lambda property_ids: {property_id: build()}).get(property_id)
+
+
+def _load_property_bundles(property_ids):
+    from .models import Property
+    from .pricing import PriceCalendar
+    from .rule_index import BookingRuleIndex
+
+    properties = Property.objects.prefetch_related('pricing_rules', 'booking_rules', 'fees').in_bulk(property_ids)
+    for property in properties.values():
+        property._price_calendar = PriceCalendar(property.nightly_rate, property.pricing_rules.all())
+        property._booking_rule_index = BookingRuleIndex(property.booking_rules.all())
+    return properties
+
+
+def get_property_bundles(property_ids):
+    """
+    Properties with their pricing rules, booking rules and fees prefetched and
+    their price calendar and booking rule index compiled, served from the cache where possible. The
+    instances are shared between requests and must be treated as read-only.
+    """
+    return get_many_cached(list(property_ids), 'bundle', _load_property_bundles)
+
+
+def get_property_bundle(property_id):
+    return get_property_bundles([property_id]).get(property_id)
+
+
+def get_cache_stats():
+    return local_cache.get_stats()
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from properties.models import Property
+from properties.nightly_rates import find_inconsistencies, refresh_nightly_rates
+
+
+def describe_rate(rate):
+    if rate is None:
+        return "nothing"
+    price, rule_applied = rate
+    return f"{price} ({rule_applied})"
+
+
+class Command(BaseCommand):
+    help = "Compare the stored nightly rates with the prices the pricing rules give."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--property', type=int, action='append', dest='property_ids', help="Only check this property (can be repeated)")
+        parser.add_argument('--fix', action='store_true', help="Rebuild the rates of any property that is out of date")
+
+    def handle(self, *args, **options):
+        properties = Property.objects.all()
+        if options['property_ids']:
+            properties = properties.filter(pk__in=options['property_ids'])
+
+        inconsistent = 0
+        for property in properties.iterator():
+            inconsistencies = find_inconsistencies(property)
+            if not inconsistencies:
+                continue
+
+            inconsistent += 1
+            date, expected, stored = inconsistencies[0]
+            self.stdout.write(
+                f"{property} (#{property.pk}): {len(inconsistencies)} nights differ, "
+                f"first on {date}: expected {describe_rate(expected)}, stored {describe_rate(stored)}"
+            )
+            if options['fix']:
+                refresh_nightly_rates(property)
+
+        if not inconsistent:
+            self.stdout.write(self.style.SUCCESS("All stored nightly rates match the pricing rules."))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt the rates of {inconsistent} properties."))
+        else:
+            raise CommandError(f"{inconsistent} properties have stale nightly rates. Run with --fix to rebuild them.")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from properties.models import Property
+from properties.nightly_rates import HORIZON_DAYS, refresh_nightly_rates
+
+
+class Command(BaseCommand):
+    help = "Rebuild the stored nightly rates for the rolling pricing horizon. Run daily to roll the horizon forward."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--property', type=int, action='append', dest='property_ids', help="Only rebuild this property (can be repeated)")
+
+    def handle(self, *args, **options):
+        properties = Property.objects.all()
+        if options['property_ids']:
+            properties = properties.filter(pk__in=options['property_ids'])
+
+        count = 0
+        for property in properties.iterator():
+            refresh_nightly_rates(property)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {HORIZON_DAYS} nights of rates for {count} properties."))
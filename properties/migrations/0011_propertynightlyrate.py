@@ -0,0 +1,28 @@
+# Generated by Django 5.1 on 2026-10-18 12:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0010_fee'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PropertyNightlyRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('rule_applied', models.CharField(max_length=50)),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='nightly_rates', to='properties.property')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'price'], name='properties__date_112467_idx')],
+                'unique_together': {('property', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 12:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('owners', '0001_initial'),
+        ('properties', '0012_property_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['owner', 'id'], name='property_owner_id_idx'),
+        ),
+    ]
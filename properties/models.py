@@ -3,6 +3,8 @@ from django.core.exceptions import ValidationError
 from owners.models import Owner
 from decimal import Decimal
 from django.core.validators import MinValueValidator
+from .pricing import PriceCalendar
+from .rule_index import BookingRuleIndex
 
 class PricingRule(models.Model):
     RULE_TYPES = [
@@ -30,6 +32,10 @@ class PricingRule(models.Model):
             raise ValidationError("End date must be after start date.")
         if self.price_modifier <= 0:
             raise ValidationError("Price modifier must be greater than 0.")
+        if self.rule_type == 'override' and self.property_id:
+            # Only one override can apply to a date.
+            if self.property.pricing_rules.filter(rule_type='override', start_date=self.start_date).exclude(pk=self.pk).exists():
+                raise ValidationError("There is already an override for this date.")
 
     def __str__(self):
         return f"{self.get_rule_type_display()} for {self.property} ({self.price_modifier}%)"
@@ -48,6 +54,14 @@ class BookingRule(models.Model):
             raise ValidationError("End date must be after start date.")
         if self.min_nights <= 0:
             raise ValidationError("Minimum nights must be a positive number.")
+        if self.property_id:
+            # Overlapping rules are ambiguous, only the earliest would apply.
+            overlapping = self.property.booking_rules.filter(
+                start_date__lte=self.end_date,
+                end_date__gte=self.start_date
+            ).exclude(pk=self.pk).first()
+            if overlapping:
+                raise ValidationError(f"This rule overlaps an existing rule from {overlapping.start_date} to {overlapping.end_date}.")
 
     def __str__(self):
         return f"Minimum stay of {self.min_nights} nights for {self.property} from {self.start_date} to {self.end_date}"
@@ -91,6 +105,21 @@ class Fee(models.Model):
     class Meta:
         unique_together = ('property', 'name')
 
+class PropertyNightlyRate(models.Model):
+    property = models.ForeignKey('Property', on_delete=models.CASCADE, related_name='nightly_rates')
+    date = models.DateField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    rule_applied = models.CharField(max_length=50)
+
+    def __str__(self):
+        return f"{self.property} on {self.date}: {self.price}"
+
+    class Meta:
+        unique_together = ('property', 'date')
+        indexes = [
+            models.Index(fields=['date', 'price']),
+        ]
+
 class Property(models.Model):
     WEEKEND_DAYS = [4, 5]  # Friday and Saturday
     DAYS_OF_WEEK = [
@@ -112,12 +141,20 @@ class Property(models.Model):
     nightly_rate = models.DecimalField(max_digits=8, decimal_places=2)
     description = models.TextField()
     date_added = models.DateField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     allow_gap_stays = models.BooleanField(default=True, help_text="Allow bookings shorter than the minimum stay to fill gaps between bookings")
     no_checkin_days = models.CharField(max_length=7, blank=True, help_text="Days when check-in is not allowed")
     no_checkout_days = models.CharField(max_length=7, blank=True, help_text="Days when check-out is not allowed")
     minimum_stay = models.PositiveIntegerField(default=1, help_text="Minimum number of nights required for a booking")
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so that a changed nightly rate can be detected on save.
+        instance._loaded_nightly_rate = instance.__dict__.get('nightly_rate')
+        return instance
+
     @property
     def total_fees(self):
         return self.fees.count()
@@ -125,26 +162,31 @@ class Property(models.Model):
     def __str__(self):
         return self.name
     
+    def get_price_calendar(self):
+        # Properties loaded through the pricing cache carry a compiled calendar.
+        calendar = getattr(self, '_price_calendar', None)
+        if calendar is None:
+            calendar = PriceCalendar(self.nightly_rate, self.pricing_rules.all())
+        return calendar
+
+    def get_booking_rule_index(self):
+        # Properties loaded through the pricing cache carry a compiled index.
+        index = getattr(self, '_booking_rule_index', None)
+        if index is None:
+            index = BookingRuleIndex(self.booking_rules.all())
+        return index
+
+    def get_price_breakdown(self, check_in_date, check_out_date):
+        from .nightly_rates import get_nightly_breakdown
+        breakdown = get_nightly_breakdown(self, check_in_date, check_out_date)
+        if breakdown is None:
+            breakdown = self.get_price_calendar().breakdown(check_in_date, check_out_date)
+        return breakdown
+
     def get_price_for_date(self, date):
-        base_price = self.nightly_rate
-        applicable_rules = []
-
-        for rule in self.pricing_rules.all():
-            if rule.rule_type == 'override' and rule.start_date == date:
-                return base_price * rule.get_modifier_factor()  # Highest priority, return immediately
-            elif rule.rule_type == 'seasonal' and rule.start_date <= date <= rule.end_date:
-                applicable_rules.append(rule)
-            elif rule.rule_type == 'weekend' and date.weekday() in self.WEEKEND_DAYS:
-                applicable_rules.append(rule)
-
-        if applicable_rules:
-            # Sort by rule type (seasonal before weekend) and then by modifier (highest modifier first)
-            applicable_rules.sort(key=lambda x: (x.rule_type != 'seasonal', -x.price_modifier))
-            return base_price * applicable_rules[0].get_modifier_factor()
-
-        return base_price
+        return self.get_price_calendar().price_for_date(date)
     
-    def check_booking_rules(self, check_in_date, check_out_date):
+    def check_booking_rules(self, check_in_date, check_out_date, fills_gap=None):
         nights = (check_out_date - check_in_date).days
         
         # Check no check-in and no check-out rules
@@ -155,25 +197,30 @@ class Property(models.Model):
             raise ValidationError(f"Check-out is not allowed on {check_out_date.strftime('%A')}s for this property.")
 
         # Check minimum stay rules
-        min_stay = self.minimum_stay
-        for rule in self.booking_rules.all():
-            if rule.start_date <= check_in_date <= rule.end_date:
-                min_stay = max(min_stay, rule.min_nights)
-                break
+        min_stay = max(self.minimum_stay, self.get_booking_rule_index().min_nights_for_check_in(check_in_date))
 
         if nights < min_stay:
             if self.allow_gap_stays:
-                prev_booking = self.bookings.filter(check_out_date__lte=check_in_date).order_by('-check_out_date').first()
-                next_booking = self.bookings.filter(check_in_date__gte=check_out_date).order_by('check_in_date').first()
-                
-                if prev_booking and next_booking:
-                    gap_size = (next_booking.check_in_date - prev_booking.check_out_date).days
-                    if nights == gap_size:
-                        # This is a valid gap stay
-                        return
+                # Callers that have checked the stay's neighbours already know.
+                if fills_gap is None:
+                    fills_gap = self.is_gap_stay(check_in_date, check_out_date)
+
+                if fills_gap:
+                    # This is a valid gap stay
+                    return
             
             # If we get here, it's not a valid booking
             raise ValidationError(f"Booking does not meet minimum stay requirement of {min_stay} nights and is not a valid gap stay.")
 
+    def is_gap_stay(self, check_in_date, check_out_date):
+        """Whether the stay exactly fills the gap between the previous and next bookings."""
+        from bookings.models import assess_stay, get_neighbourhood
+        overlapping, fills_gap = assess_stay(get_neighbourhood(self, check_in_date, check_out_date), check_in_date, check_out_date)
+        return fills_gap
+
     class Meta:
-        verbose_name_plural = "Properties"
\ No newline at end of file
+        verbose_name_plural = "Properties"
+        indexes = [
+            # Backs keyset pages of an owner's properties.
+            models.Index(fields=['owner', 'id'], name='property_owner_id_idx'),
+        ]
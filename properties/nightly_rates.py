@@ -0,0 +1,123 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.utils import timezone
+from .models import PricingRule, PropertyNightlyRate
+from .pricing import PriceCalendar
+
+HORIZON_DAYS = getattr(settings, 'NIGHTLY_RATE_HORIZON_DAYS', 540)
+
+
+def get_horizon():
+    start_date = timezone.localdate()
+    return start_date, start_date + timedelta(days=HORIZON_DAYS)
+
+
+def covers(check_in_date, check_out_date):
+    horizon_start, horizon_end = get_horizon()
+    return horizon_start <= check_in_date and check_out_date <= horizon_end
+
+
+def get_rule_date_range(rule):
+    """The nights a pricing rule can affect, or (None, None) for every night."""
+    if rule.rule_type == 'seasonal' and rule.start_date and rule.end_date:
+        return rule.start_date, rule.end_date + timedelta(days=1)
+    if rule.rule_type == 'override' and rule.start_date:
+        return rule.start_date, rule.start_date + timedelta(days=1)
+    return None, None
+
+
+def refresh_nightly_rates(property, start_date=None, end_date=None):
+    """
+    Regenerate the stored nightly rates of `property` between `start_date`
+    and `end_date`, clipped to the rolling horizon. Without dates the whole
+    horizon is rebuilt and rates for past nights are dropped.
+    """
+    horizon_start, horizon_end = get_horizon()
+    if start_date is None and end_date is None:
+        property.nightly_rates.filter(date__lt=horizon_start).delete()
+    start_date = max(start_date or horizon_start, horizon_start)
+    end_date = min(end_date or horizon_end, horizon_end)
+
+    # Rules are read fresh rather than through `property.pricing_rules`, whose
+    # prefetched results may predate the change being applied.
+    calendar = PriceCalendar(property.nightly_rate, PricingRule.objects.filter(property=property))
+
+    with transaction.atomic():
+        property.nightly_rates.filter(date__gte=start_date, date__lt=end_date).delete()
+        if start_date < end_date:
+            PropertyNightlyRate.objects.bulk_create([
+                PropertyNightlyRate(property=property, date=day['date'], price=day['price'], rule_applied=day['rule_applied'])
+                for day in calendar.breakdown(start_date, end_date)
+            ])
+
+
+def refresh_rule_nightly_rates(rule):
+    start_date, end_date = get_rule_date_range(rule)
+    refresh_nightly_rates(rule.property, start_date, end_date)
+
+
+def get_nightly_breakdown(property, check_in_date, check_out_date):
+    """The stored breakdown for a stay, or None if the table does not cover every night of it."""
+    if not covers(check_in_date, check_out_date):
+        return None
+
+    breakdown = list(property.nightly_rates.filter(
+        date__gte=check_in_date,
+        date__lt=check_out_date
+    ).order_by('date').values('date', 'price', 'rule_applied'))
+
+    if len(breakdown) != (check_out_date - check_in_date).days:
+        return None
+    return breakdown
+
+
+def get_nightly_totals(property_ids, check_in_date, check_out_date):
+    """Sum of the stored nightly prices of a stay, by property, for the properties that have every night stored."""
+    if not covers(check_in_date, check_out_date):
+        return {}
+
+    totals = PropertyNightlyRate.objects.filter(
+        property_id__in=property_ids,
+        date__gte=check_in_date,
+        date__lt=check_out_date
+    ).values('property_id').annotate(
+        total=Sum('price'),
+        nights=Count('pk')
+    ).filter(nights=(check_out_date - check_in_date).days)
+
+    return {row['property_id']: row['total'] for row in totals}
+
+
+def nightly_total_subquery(check_in_date, check_out_date):
+    """
+    A Property annotation with the sum of the stored nightly prices of a
+    stay, or NULL when the table does not cover every night of it.
+    """
+    return Subquery(
+        PropertyNightlyRate.objects.filter(
+            property=OuterRef('pk'),
+            date__gte=check_in_date,
+            date__lt=check_out_date
+        ).values('property').annotate(
+            total=Sum('price'),
+            nights=Count('pk')
+        ).filter(nights=(check_out_date - check_in_date).days).values('total')
+    )
+
+
+def find_inconsistencies(property):
+    """Compare the stored rates over the horizon with the pricing rules. Returns (date, expected, stored) tuples."""
+    horizon_start, horizon_end = get_horizon()
+    stored = {
+        rate['date']: (rate['price'], rate['rule_applied'])
+        for rate in property.nightly_rates.filter(date__gte=horizon_start, date__lt=horizon_end).values('date', 'price', 'rule_applied')
+    }
+
+    inconsistencies = []
+    for day in property.get_price_calendar().breakdown(horizon_start, horizon_end):
+        expected = (day['price'], day['rule_applied'])
+        if stored.get(day['date']) != expected:
+            inconsistencies.append((day['date'], expected, stored.get(day['date'])))
+    return inconsistencies
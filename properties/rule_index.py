@@ -0,0 +1,128 @@
+from bisect import bisect_right
+from datetime import timedelta
+
+
+class IntervalIndex:
+    """
+    Date intervals cut into sorted, non-overlapping segments, each holding the
+    items that cover it ordered by `key` (lowest first). Finding what covers a
+    date is a binary search over the segment boundaries.
+
+    `intervals` are (start, end, item) tuples with `end` exclusive.
+    """
+
+    def __init__(self, intervals, key):
+        intervals = sorted(intervals, key=lambda interval: interval[0])
+        points = sorted({point for start, end, item in intervals for point in (start, end) if start < end})
+
+        self.bounds = []
+        self.segments = []
+        active = {}
+        position = 0
+        for point in points:
+            for item_id, (end, item) in list(active.items()):
+                if end <= point:
+                    del active[item_id]
+            while position < len(intervals) and intervals[position][0] <= point:
+                start, end, item = intervals[position]
+                if start < end:
+                    active[position] = (end, item)
+                position += 1
+
+            covering = tuple(sorted((item for end, item in active.values()), key=key))
+            if self.segments and self.segments[-1] == covering:
+                continue
+            self.bounds.append(point)
+            self.segments.append(covering)
+
+    def at(self, date):
+        """The items covering `date`, best first."""
+        index = bisect_right(self.bounds, date) - 1
+        if index < 0:
+            return ()
+        return self.segments[index]
+
+    def first_at(self, date):
+        covering = self.at(date)
+        return covering[0] if covering else None
+
+    def spans(self, start_date, end_date):
+        """Yield (first, last, items) for the segments between two dates, as day offsets from `start_date`, `last` exclusive."""
+        nights = (end_date - start_date).days
+        index = max(bisect_right(self.bounds, start_date) - 1, 0)
+        while index < len(self.bounds) and self.bounds[index] < end_date:
+            first = max((self.bounds[index] - start_date).days, 0)
+            if index + 1 < len(self.bounds):
+                last = min((self.bounds[index + 1] - start_date).days, nights)
+            else:
+                last = nights
+            if first < last and self.segments[index]:
+                yield first, last, self.segments[index]
+            index += 1
+
+
+class PricingRuleIndex:
+    """
+    A property's pricing rules indexed by date: overrides by their date, the
+    weekend rule with the highest modifier, and seasonal rules in an
+    `IntervalIndex` where the highest modifier covering a date comes first
+    (ties go to the rule given first).
+    """
+
+    def __init__(self, rules):
+        self.overrides = {}
+        self.weekend_rule = None
+        seasonal = []
+
+        for order, rule in enumerate(rules):
+            if rule.rule_type == 'override':
+                self.overrides.setdefault(rule.start_date, rule)
+            elif rule.rule_type == 'seasonal':
+                if rule.start_date and rule.end_date:
+                    seasonal.append((rule.start_date, rule.end_date + timedelta(days=1), (order, rule)))
+            elif rule.rule_type == 'weekend':
+                if self.weekend_rule is None or rule.price_modifier > self.weekend_rule.price_modifier:
+                    self.weekend_rule = rule
+
+        index = IntervalIndex(seasonal, key=lambda item: (-item[1].price_modifier, item[0]))
+        # Drop the ordering used to break ties now that it has been applied.
+        index.segments = [tuple(rule for order, rule in covering) for covering in index.segments]
+        self.seasonal = index
+
+    def seasonal_rules_for_date(self, date):
+        return self.seasonal.at(date)
+
+    def seasonal_rule_for_date(self, date):
+        return self.seasonal.first_at(date)
+
+    def override_for_date(self, date):
+        return self.overrides.get(date)
+
+
+class BookingRuleIndex:
+    """
+    A property's booking rules indexed by date. Like `check_booking_rules`
+    always has, the rule that applies to a check-in date is the covering rule
+    with the earliest start date.
+    """
+
+    def __init__(self, rules):
+        self.rules = IntervalIndex(
+            [(rule.start_date, rule.end_date + timedelta(days=1), rule) for rule in rules],
+            key=lambda rule: (rule.start_date, rule.pk or 0)
+        )
+
+    def rule_for_date(self, date):
+        return self.rules.first_at(date)
+
+    def min_nights_for_check_in(self, date):
+        rule = self.rule_for_date(date)
+        return rule.min_nights if rule else 0
+
+    def min_nights_for_range(self, start_date, end_date):
+        """The rule minimum for a check-in on each day from `start_date` up to `end_date` (0 where no rule applies)."""
+        min_nights = [0] * (end_date - start_date).days
+        for first, last, covering in self.rules.spans(start_date, end_date):
+            min_nights[first:last] = [covering[0].min_nights] * (last - first)
+        return min_nights
+
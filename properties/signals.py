@@ -1,12 +1,61 @@
-from django.db.models.signals import post_save
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
-from .models import Property
+from .models import Property, PricingRule, BookingRule, Fee
+from .cache import PROPERTIES_VERSION, bump_global_version, bump_property_version
+from .nightly_rates import refresh_nightly_rates, refresh_rule_nightly_rates
 from api.webhooks import send_webhook
 from api.serializers import PropertySerializer
 
 @receiver(post_save, sender=Property)
 def property_saved(sender, instance, created, **kwargs):
+    # The payload is only built if the event has subscribers.
     if created:
-        send_webhook('property_created', PropertySerializer(instance).data)
+        send_webhook('property_created', lambda: PropertySerializer(instance).data)
     else:
-        send_webhook('property_updated', PropertySerializer(instance).data)
\ No newline at end of file
+        send_webhook('property_updated', lambda: PropertySerializer(instance).data)
+
+@receiver(post_save, sender=Property)
+def refresh_property_nightly_rates(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'nightly_rate' not in update_fields:
+        return
+    if created or getattr(instance, '_loaded_nightly_rate', None) != instance.nightly_rate:
+        refresh_nightly_rates(instance)
+        instance._loaded_nightly_rate = instance.nightly_rate
+
+@receiver(pre_save, sender=PricingRule)
+def remember_previous_pricing_rule(sender, instance, **kwargs):
+    # The nights the rule covered before this save need regenerating too.
+    instance._previous_rule = PricingRule.objects.filter(pk=instance.pk).first() if instance.pk else None
+
+@receiver(post_save, sender=PricingRule)
+def refresh_pricing_rule_nightly_rates(sender, instance, **kwargs):
+    refresh_rule_nightly_rates(instance)
+    previous = getattr(instance, '_previous_rule', None)
+    if previous is not None:
+        refresh_rule_nightly_rates(previous)
+
+@receiver(post_delete, sender=PricingRule)
+def refresh_deleted_pricing_rule_nightly_rates(sender, instance, origin=None, **kwargs):
+    # Rules removed because their property is being deleted have nothing left to refresh.
+    if isinstance(origin, PricingRule) or (isinstance(origin, QuerySet) and origin.model is PricingRule):
+        refresh_rule_nightly_rates(instance)
+
+# Registered after the nightly rate handlers so the cache version only moves
+# once the stored rates are up to date.
+@receiver(post_save, sender=Property)
+@receiver(post_delete, sender=Property)
+def invalidate_property_cache(sender, instance, **kwargs):
+    bump_property_version(instance.pk)
+    bump_global_version(PROPERTIES_VERSION)
+
+@receiver(post_save, sender=PricingRule)
+@receiver(post_delete, sender=PricingRule)
+@receiver(post_save, sender=BookingRule)
+@receiver(post_delete, sender=BookingRule)
+@receiver(post_save, sender=Fee)
+@receiver(post_delete, sender=Fee)
+def invalidate_property_rules_cache(sender, instance, **kwargs):
+    bump_property_version(instance.property_id)
+    # Searches with dates include the price of the stay.
+    bump_global_version(PROPERTIES_VERSION)
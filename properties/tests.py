@@ -1,3 +1,393 @@
-from django.test import TestCase
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from owners.models import Owner
+from bookings.quote import get_quote
+from .cache import get_property_bundle, get_shared_cache, local_cache
+from .models import BookingRule, Fee, PricingRule, Property, PropertyNightlyRate
+from .pricing import PriceCalendar, round_price
+from .rule_index import BookingRuleIndex, IntervalIndex, PricingRuleIndex
 
-# Create your tests here.
+CHECK_IN_DATE = date(2031, 1, 9)  # Thursday, so the stay has a Friday and a Saturday
+CHECK_OUT_DATE = date(2031, 1, 12)
+
+
+class PricingCacheTests(TestCase):
+    """Edits to a property or its rules show in the next quote, whichever cache layer serves it."""
+
+    def setUp(self):
+        # Primary keys are reused between tests, so no cached entry may survive one.
+        get_shared_cache().clear()
+        local_cache.clear()
+        owner = Owner.objects.create(first_name='Olive', last_name='Owner', email='owner@example.com', phone='1', address='1 Road')
+        self.property = Property.objects.create(
+            name='Cottage', address='1 Road', owner=owner, bedrooms=1, bathrooms=1, max_occupancy=4,
+            nightly_rate=Decimal('100.00'), description='', allow_gap_stays=False
+        )
+        self.rule = PricingRule.objects.create(property=self.property, rule_type='weekend', price_modifier=Decimal('125.00'))
+        self.fee = Fee.objects.create(
+            property=self.property, name='Cleaning', fee_type='fixed', applies='once', display_strategy='separate', amount=Decimal('40.00')
+        )
+        self.booking_rule = BookingRule.objects.create(property=self.property, start_date=date(2031, 1, 1), end_date=date(2031, 1, 31), min_nights=2)
+
+    def quote(self):
+        bundle = get_property_bundle(self.property.pk)
+        return get_quote(bundle, CHECK_IN_DATE, CHECK_OUT_DATE, 2).total_price
+
+    def warm(self, expected):
+        # Cache the quote in both layers, and check the shared copy is the one served once the local one is gone.
+        self.assertEqual(self.quote(), expected)
+        local_cache.clear()
+        self.assertEqual(self.quote(), expected)
+        self.assertEqual(local_cache.get_stats()['hits'], 0)
+
+    def assertQuote(self, expected):
+        # First in this process, whose LRU still holds the old quote, then in
+        # a process that only has the shared cache.
+        self.assertEqual(self.quote(), expected)
+        local_cache.clear()
+        self.assertEqual(self.quote(), expected)
+
+    def test_pricing_rule_edit(self):
+        self.warm(Decimal('390.00'))
+        self.rule.price_modifier = Decimal('150.00')
+        self.rule.save()
+        self.assertQuote(Decimal('440.00'))
+        self.rule.delete()
+        self.assertQuote(Decimal('340.00'))
+
+    def test_fee_edit(self):
+        self.warm(Decimal('390.00'))
+        self.fee.amount = Decimal('60.00')
+        self.fee.save()
+        self.assertQuote(Decimal('410.00'))
+        Fee.objects.create(
+            property=self.property, name='Linen', fee_type='fixed', applies='per_night', display_strategy='separate', amount=Decimal('5.00')
+        )
+        self.assertQuote(Decimal('425.00'))
+
+    def test_nightly_rate_edit(self):
+        self.warm(Decimal('390.00'))
+        self.property.nightly_rate = Decimal('200.00')
+        self.property.save()
+        self.assertQuote(Decimal('740.00'))
+
+    def test_booking_rule_edit(self):
+        self.warm(Decimal('390.00'))
+        get_property_bundle(self.property.pk).check_booking_rules(CHECK_IN_DATE, CHECK_OUT_DATE)
+        self.booking_rule.min_nights = 4
+        self.booking_rule.save()
+        for _ in range(2):
+            with self.assertRaises(ValidationError):
+                get_property_bundle(self.property.pk).check_booking_rules(CHECK_IN_DATE, CHECK_OUT_DATE)
+            local_cache.clear()
+
+
+class CheckNightlyRatesTests(TestCase):
+    def setUp(self):
+        owner = Owner.objects.create(first_name='Olive', last_name='Owner', email='owner@example.com', phone='1', address='1 Road')
+        self.properties = [
+            Property.objects.create(
+                name=f'Cottage {index}', address='1 Road', owner=owner, bedrooms=1, bathrooms=1, max_occupancy=4,
+                nightly_rate=Decimal('100.00'), description=''
+            )
+            for index in range(2)
+        ]
+        self.rule = PricingRule.objects.create(property=self.properties[0], rule_type='weekend', price_modifier=Decimal('125.00'))
+
+    def check(self, *args):
+        stdout = StringIO()
+        call_command('check_nightly_rates', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def assertDrift(self, *args, message):
+        with self.assertRaisesMessage(CommandError, message):
+            self.check(*args)
+
+    def test_rates_kept_by_the_signals_match(self):
+        self.assertIn('All stored nightly rates match', self.check())
+
+    def test_detects_drift(self):
+        # Changes made without signals leave the stored rates behind.
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        PropertyNightlyRate.objects.filter(property=self.properties[0], date=tomorrow).update(price=Decimal('1.00'))
+        self.assertDrift(message='1 properties have stale nightly rates')
+
+        Property.objects.filter(pk=self.properties[1].pk).update(nightly_rate=Decimal('90.00'))
+        self.assertDrift(message='2 properties have stale nightly rates')
+        self.assertIn('expected 90.00 (Base rate), stored 100.00 (Base rate)', self.check('--property', str(self.properties[1].pk), '--fix'))
+        self.assertDrift(message='1 properties have stale nightly rates')
+
+    def test_detects_missing_and_rule_changes(self):
+        PricingRule.objects.filter(pk=self.rule.pk).update(price_modifier=Decimal('150.00'))
+        self.assertDrift(message='1 properties have stale nightly rates')
+        PropertyNightlyRate.objects.filter(property=self.properties[1])[:1].get().delete()
+        self.assertDrift(message='2 properties have stale nightly rates')
+
+        output = self.check('--fix')
+        self.assertIn('Rebuilt the rates of 2 properties', output)
+        self.assertIn('stored nothing', output)
+        self.assertIn('All stored nightly rates match', self.check())
+
+
+def linear_booking_rule(rules, date):
+    """The rule `check_booking_rules` applied before the index: the first covering rule in the default ordering."""
+    for rule in sorted(rules, key=lambda rule: (rule.start_date, rule.pk)):
+        if rule.start_date <= date <= rule.end_date:
+            return rule
+    return None
+
+
+def linear_pricing_rule(rules, date):
+    """The rule the per-night lookup applied before the price calendar (`Booking.get_price_and_rule_for_date`)."""
+    applicable_rules = []
+    for rule in rules:
+        if rule.rule_type == 'override' and rule.start_date == date:
+            return rule
+        elif rule.rule_type == 'seasonal' and rule.start_date <= date <= rule.end_date:
+            applicable_rules.append(rule)
+        elif rule.rule_type == 'weekend' and date.weekday() in [4, 5]:
+            applicable_rules.append(rule)
+    if applicable_rules:
+        applicable_rules.sort(key=lambda rule: (rule.rule_type != 'seasonal', -rule.price_modifier))
+        return applicable_rules[0]
+    return None
+
+
+def random_pricing_rules(rng, first_date, days):
+    """Overrides, seasonal and weekend rules over `days` days, with shared dates and tied modifiers."""
+    rules = []
+    for pk in range(1, rng.randint(0, 25) + 1):
+        rule_type = rng.choice(['override', 'seasonal', 'seasonal', 'weekend'])
+        start_date = first_date + timedelta(days=rng.randint(0, days - 1))
+        end_date = min(start_date + timedelta(days=rng.choice([0, 0, 1, 6, 20])), first_date + timedelta(days=days - 1))
+        rules.append(PricingRule(
+            pk=pk, rule_type=rule_type, price_modifier=Decimal(rng.choice([50, 80, 125, 125, 150, 200])),
+            start_date=None if rule_type == 'weekend' else start_date,
+            end_date=end_date if rule_type == 'seasonal' else None
+        ))
+    return rules
+
+
+class IntervalIndexTests(SimpleTestCase):
+    def setUp(self):
+        # Items are (name, rank), best rank first.
+        self.index = IntervalIndex([
+            (date(2031, 1, 10), date(2031, 1, 20), ('long', 2)),
+            (date(2031, 1, 12), date(2031, 1, 14), ('short', 1)),
+            (date(2031, 1, 20), date(2031, 1, 25), ('touching', 3)),
+            (date(2031, 1, 27), date(2031, 1, 27), ('empty', 0)),
+            (date(2031, 1, 27), date(2031, 1, 29), ('late', 1)),
+        ], key=lambda item: item[1])
+
+    def names(self, items):
+        return [name for name, rank in items]
+
+    def test_at_segment_boundaries(self):
+        for day, names in [
+            (date(2031, 1, 9), []),
+            (date(2031, 1, 10), ['long']),
+            (date(2031, 1, 11), ['long']),
+            (date(2031, 1, 12), ['short', 'long']),
+            (date(2031, 1, 13), ['short', 'long']),
+            (date(2031, 1, 14), ['long']),
+            (date(2031, 1, 19), ['long']),
+            # The end is exclusive, so a touching interval takes over on the day.
+            (date(2031, 1, 20), ['touching']),
+            (date(2031, 1, 24), ['touching']),
+            (date(2031, 1, 25), []),
+            (date(2031, 1, 27), ['late']),
+            (date(2031, 1, 29), []),
+            (date(2032, 1, 1), []),
+        ]:
+            with self.subTest(day=day):
+                self.assertEqual(self.names(self.index.at(day)), names)
+                self.assertEqual(self.index.first_at(day), self.index.at(day)[0] if names else None)
+
+    def test_adjacent_intervals_of_the_same_items_are_one_segment(self):
+        index = IntervalIndex([
+            (date(2031, 1, 1), date(2031, 1, 5), 'a'),
+            (date(2031, 1, 5), date(2031, 1, 9), 'b'),
+            (date(2031, 1, 1), date(2031, 1, 9), 'c'),
+        ], key=lambda item: item)
+        self.assertEqual(index.at(date(2031, 1, 4)), ('a', 'c'))
+        self.assertEqual(index.at(date(2031, 1, 5)), ('b', 'c'))
+        self.assertEqual(IntervalIndex([(date(2031, 1, 1), date(2031, 1, 5), 'a'), (date(2031, 1, 5), date(2031, 1, 9), 'a')], key=str).bounds, [
+            date(2031, 1, 1), date(2031, 1, 9)
+        ])
+
+    def test_spans(self):
+        spans = [(first, last, self.names(items)) for first, last, items in self.index.spans(date(2031, 1, 8), date(2031, 1, 28))]
+        self.assertEqual(spans, [
+            (2, 4, ['long']), (4, 6, ['short', 'long']), (6, 12, ['long']), (12, 17, ['touching']), (19, 20, ['late'])
+        ])
+        # Clipped to a range that starts and ends inside segments.
+        spans = [(first, last, self.names(items)) for first, last, items in self.index.spans(date(2031, 1, 13), date(2031, 1, 21))]
+        self.assertEqual(spans, [(0, 1, ['short', 'long']), (1, 7, ['long']), (7, 8, ['touching'])])
+        self.assertEqual(list(self.index.spans(date(2031, 2, 1), date(2031, 3, 1))), [])
+        self.assertEqual(list(IntervalIndex([], key=str).spans(date(2031, 1, 1), date(2031, 2, 1))), [])
+
+    def test_matches_a_scan_of_every_interval(self):
+        rng = random.Random(20240709)
+        first_date = date(2031, 1, 1)
+        for _ in range(300):
+            intervals = []
+            for rank in range(rng.randint(0, 12)):
+                start = first_date + timedelta(days=rng.randint(0, 40))
+                intervals.append((start, start + timedelta(days=rng.randint(0, 15)), (rng.randint(0, 3), rank)))
+            index = IntervalIndex(intervals, key=lambda item: item)
+            nights = [index.at(first_date + timedelta(days=offset)) for offset in range(-2, 60)]
+            expected = [
+                tuple(sorted(item for start, end, item in intervals if start <= first_date + timedelta(days=offset) < end))
+                for offset in range(-2, 60)
+            ]
+            self.assertEqual(nights, expected)
+
+            spanned = [()] * 30
+            for first, last, items in index.spans(first_date + timedelta(days=5), first_date + timedelta(days=35)):
+                spanned[first:last] = [items] * (last - first)
+            self.assertEqual(spanned, expected[7:37])
+
+
+class RuleIndexTests(SimpleTestCase):
+    def test_open_ended_pricing_rules(self):
+        weekend = PricingRule(pk=1, rule_type='weekend', price_modifier=Decimal('125.00'))
+        stronger_weekend = PricingRule(pk=2, rule_type='weekend', price_modifier=Decimal('150.00'))
+        undated = PricingRule(pk=3, rule_type='seasonal', start_date=date(2031, 1, 1), price_modifier=Decimal('300.00'))
+        index = PricingRuleIndex([weekend, stronger_weekend, undated])
+        # Weekend rules have no dates and the strongest applies to every weekend;
+        # a seasonal rule without an end date applies to no date.
+        self.assertIs(index.weekend_rule, stronger_weekend)
+        self.assertIsNone(index.seasonal_rule_for_date(date(2031, 1, 1)))
+        self.assertEqual(index.seasonal.bounds, [])
+
+    def test_pricing_rules_match_the_linear_scan(self):
+        rng = random.Random(20240712)
+        first_date = date(2031, 1, 1)
+        for _ in range(500):
+            rules = random_pricing_rules(rng, first_date, 60)
+            index = PricingRuleIndex(rules)
+            for offset in range(-3, 64):
+                day = first_date + timedelta(days=offset)
+                rule = (
+                    index.override_for_date(day)
+                    or index.seasonal_rule_for_date(day)
+                    or (index.weekend_rule if day.weekday() in [4, 5] else None)
+                )
+                self.assertIs(rule, linear_pricing_rule(rules, day), day)
+
+    def test_booking_rules_match_the_linear_scan(self):
+        rng = random.Random(20240713)
+        first_date = date(2031, 1, 1)
+        for _ in range(500):
+            rules = []
+            for pk in rng.sample(range(1, 50), rng.randint(0, 10)):
+                start_date = first_date + timedelta(days=rng.randint(0, 50))
+                rules.append(BookingRule(
+                    pk=pk, start_date=start_date, end_date=start_date + timedelta(days=rng.choice([0, 1, 3, 10])), min_nights=rng.randint(1, 7)
+                ))
+            index = BookingRuleIndex(rules)
+            days = [first_date + timedelta(days=offset) for offset in range(-3, 64)]
+            expected = [linear_booking_rule(rules, day) for day in days]
+            self.assertEqual([index.rule_for_date(day) for day in days], expected)
+            self.assertEqual(
+                index.min_nights_for_range(days[0], days[-1] + timedelta(days=1)),
+                [rule.min_nights if rule else 0 for rule in expected]
+            )
+            self.assertEqual([index.min_nights_for_check_in(day) for day in days], [rule.min_nights if rule else 0 for rule in expected])
+
+
+class RuleValidationTests(TestCase):
+    def setUp(self):
+        owner = Owner.objects.create(first_name='Olive', last_name='Owner', email='owner@example.com', phone='1', address='1 Road')
+        self.property, self.other = [
+            Property.objects.create(
+                name=name, address='1 Road', owner=owner, bedrooms=1, bathrooms=1, max_occupancy=4, nightly_rate=Decimal('100.00'), description=''
+            )
+            for name in ('Cottage', 'Barn')
+        ]
+
+    def test_duplicate_override_is_rejected(self):
+        override = PricingRule.objects.create(property=self.property, rule_type='override', start_date=date(2031, 1, 1), price_modifier=Decimal('150.00'))
+        with self.assertRaisesMessage(ValidationError, 'There is already an override for this date.'):
+            PricingRule(property=self.property, rule_type='override', start_date=date(2031, 1, 1), price_modifier=Decimal('80.00')).full_clean()
+        # Saving the override again, one on another date or at another property is fine.
+        override.full_clean()
+        PricingRule(property=self.property, rule_type='override', start_date=date(2031, 1, 2), price_modifier=Decimal('80.00')).full_clean()
+        PricingRule(property=self.other, rule_type='override', start_date=date(2031, 1, 1), price_modifier=Decimal('80.00')).full_clean()
+        # Seasonal rules may overlap, as the highest modifier wins.
+        PricingRule.objects.create(property=self.property, rule_type='seasonal', start_date=date(2031, 1, 1), end_date=date(2031, 1, 31), price_modifier=Decimal('120.00'))
+        PricingRule(property=self.property, rule_type='seasonal', start_date=date(2031, 1, 1), end_date=date(2031, 1, 31), price_modifier=Decimal('130.00')).full_clean()
+
+    def test_overlapping_booking_rules_are_rejected(self):
+        rule = BookingRule.objects.create(property=self.property, start_date=date(2031, 1, 10), end_date=date(2031, 1, 20), min_nights=3)
+        for start_date, end_date in [
+            (date(2031, 1, 12), date(2031, 1, 15)),
+            (date(2031, 1, 1), date(2031, 1, 10)),   # ends on the rule's first day
+            (date(2031, 1, 20), date(2031, 1, 25)),  # starts on its last day
+            (date(2031, 1, 1), date(2031, 1, 31)),
+        ]:
+            with self.subTest(start_date=start_date, end_date=end_date):
+                with self.assertRaisesMessage(ValidationError, 'This rule overlaps an existing rule from 2031-01-10 to 2031-01-20.'):
+                    BookingRule(property=self.property, start_date=start_date, end_date=end_date, min_nights=2).full_clean()
+        rule.full_clean()
+        BookingRule(property=self.property, start_date=date(2031, 1, 1), end_date=date(2031, 1, 9), min_nights=2).full_clean()
+        BookingRule(property=self.property, start_date=date(2031, 1, 21), end_date=date(2031, 1, 25), min_nights=2).full_clean()
+        BookingRule(property=self.other, start_date=date(2031, 1, 12), end_date=date(2031, 1, 15), min_nights=2).full_clean()
+
+
+def get_price_and_rule_for_date(nightly_rate, rules, date):
+    """A copy of the per-night lookup `PriceCalendar` replaced, from `Booking`."""
+    applicable_rules = []
+    for rule in rules:
+        if rule.rule_type == 'override' and rule.start_date == date:
+            return round_price(nightly_rate * rule.get_modifier_factor()), f"Override: {rule.price_modifier}%"
+        elif rule.rule_type == 'seasonal' and rule.start_date <= date <= rule.end_date:
+            applicable_rules.append(rule)
+        elif rule.rule_type == 'weekend' and date.weekday() in [4, 5]:  # Friday and Saturday
+            applicable_rules.append(rule)
+
+    if applicable_rules:
+        applicable_rules.sort(key=lambda x: (x.rule_type != 'seasonal', -x.price_modifier))
+        applied_rule = applicable_rules[0]
+        return round_price(nightly_rate * applied_rule.get_modifier_factor()), f"{applied_rule.get_rule_type_display()}: {applied_rule.price_modifier}%"
+
+    return round_price(nightly_rate), "Base rate"
+
+
+class PriceCalendarTests(SimpleTestCase):
+    """The compiled calendar prices every night as the per-night lookup did: override, then seasonal, then weekend, highest modifier first."""
+
+    def test_precedence(self):
+        weekend = PricingRule(pk=1, rule_type='weekend', price_modifier=Decimal('300.00'))
+        seasonal = PricingRule(pk=2, rule_type='seasonal', start_date=date(2031, 1, 10), end_date=date(2031, 1, 11), price_modifier=Decimal('50.00'))
+        tied = PricingRule(pk=3, rule_type='seasonal', start_date=date(2031, 1, 11), end_date=date(2031, 1, 12), price_modifier=Decimal('50.00'))
+        override = PricingRule(pk=4, rule_type='override', start_date=date(2031, 1, 11), price_modifier=Decimal('20.00'))
+        calendar = PriceCalendar(Decimal('100.00'), [weekend, seasonal, tied, override])
+        # Thursday 9th to Monday 13th.
+        rules = calendar.rules_for_range(date(2031, 1, 9), date(2031, 1, 14))
+        self.assertEqual([rule and rule.pk for rule in rules], [None, seasonal.pk, override.pk, tied.pk, None])
+        self.assertEqual(calendar.rule_for_date(date(2031, 1, 17)).pk, weekend.pk)
+
+    def test_matches_the_per_night_lookup(self):
+        rng = random.Random(20240701)
+        first_date = date(2031, 1, 1)
+        for _ in range(500):
+            nightly_rate = Decimal(rng.randint(1, 50000)) / 100
+            rules = random_pricing_rules(rng, first_date, 60)
+            calendar = PriceCalendar(nightly_rate, rules)
+            # Ranges that start and end before, inside and after the rules.
+            start_date = first_date + timedelta(days=rng.randint(-5, 55))
+            end_date = start_date + timedelta(days=rng.randint(1, 20))
+            days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days)]
+
+            expected = [get_price_and_rule_for_date(nightly_rate, rules, day) for day in days]
+            self.assertEqual([(day['price'], day['rule_applied']) for day in calendar.breakdown(start_date, end_date)], expected)
+            self.assertEqual(calendar.nightly_cents(start_date, end_date), [int(price * 100) for price, rule_applied in expected])
+            self.assertEqual(calendar.rules_for_range(start_date, end_date), [calendar.rule_for_date(day) for day in days])
+            self.assertEqual([round_price(calendar.price_for_date(day)) for day in days], [price for price, rule_applied in expected])